@@ -1,12 +1,18 @@
 import Config as config
-import arcpy
+import argparse
 import os
 import sys
 import time
 import logging
-import pandas as pd
 from datetime import datetime
 from datetime import date
+from SchemaPlanner import (ArcpyBackend, SqliteBackend, apply_plan, format_plan, plan_schema_changes,
+                           read_field_requests)
+
+try:
+    import arcpy  # Not needed for a dry run against SQLite
+except ImportError:
+    arcpy = None
 
 start_time = time.time()
 formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
@@ -23,7 +29,8 @@ globalFlag = True
 CurrentTime = datetime.now().strftime("%Y%m%d-%H%M%S")
 logDareTime = "_"+CurrentTime
 logFilePath= mydir +"\\" +"Log"
-arcpy.env.workspace = logFilePath
+if arcpy is not None:
+    arcpy.env.workspace = logFilePath
 if not os.path.isdir(logFilePath):
      os.mkdir(logFilePath)
 logCFullName =  logFilePath +"\\" +"AddBackhaulType"+ logDareTime +".log"
@@ -54,66 +61,50 @@ def write_log(msg):
         sys.stdout.flush()
         sys.exit()
         globalFlag = False
-def modify_length():
+def modify_length(dry_run=False, database=None, excel_path=None):
+    """
+    Adds the fields listed in the spreadsheet that the tables do not have
+    yet, one batched operation per table. With dry_run only the plan is
+    logged; with database the tables are read from that SQLite/GeoPackage
+    file instead of the SDE connection.
+    """
     globalFlag=True
+    backend = None
     try:
-      
-        myconn= arcpy.ArcSDESQLExecute(SdePath )
-        print("connected :" +SdePath)
+        backend = SqliteBackend(database) if database else ArcpyBackend(SdePath)
+        print("connected :" + (database or SdePath))
         try:
-        
-            df = pd.read_excel(mydir + config.excelPath,usecols=[0,1])
-            
-            df = df.where(pd.notnull(df), None)
-            print(df)
-            df['Column Name'] = df.groupby(['Table Name'])['Column Name'].transform(lambda x : ','.join(x))
-            # drop duplicate data
-            df = df.drop_duplicates()
-            #print(df)
+            requests = read_field_requests(excel_path or mydir + config.excelPath)
             write_log("Length Modifying script Started.... ")
-            for index, row in df.iterrows():
-                tabe_name = row['Table Name'].split(".")[1]
-                tabe_name = row['Table Name']
-                in_field = row['Column Name']
-                columnsArr = in_field.split(",")
-                #print(tabe_name,"==",in_field)
-                #print(columnsArr)
-                if in_field:
-                    inFeatures=SdePath +"\\"+ tabe_name
-                   # inFeatures=SdePath +"\\NE.TELCO\\"+ row['Table  Name']
-                    print("inFeatures :"+inFeatures) 
-                    fieldName1=in_field
-                    new_field_name=in_field
-                    new_field_alias = in_field
-                    fieldAlias=in_field
-                    field_type="Text"
-                    fieldlength="255"
-                    field_is_nullable="NULLABLE"
-                    clear_field_alias="false"
-
-                    try:
-                        #add new field in spatial table
-                        arcpy.management.AddField(inFeatures, fieldName1, "TEXT",field_length=fieldlength,
-                                  field_alias=fieldAlias, field_is_nullable="NULLABLE")
-                        write_log("New Field Added.")
-                    except Exception as err:
-                        print("Add Field Error: ",err)
-                        #logging.warning("Add Field Error:  {0}".format(err))
-                        write_log("Add Field Error:  {0}".format(err))
-                        globalFlag = False
+            # Every table's schema is read once, then only the missing fields are added
+            plans = plan_schema_changes(requests, backend)
+            for line in format_plan(plans):
+                write_log(line)
+            if dry_run:
+                write_log("Dry run: no fields added.")
+            elif apply_plan(plans, backend, write_log):
+                globalFlag = False
         except Exception as err:
             print(err)
-        
+            write_log("Error: {0}".format(err))
+            globalFlag = False
+
     except Exception as err:
-        in_table = SdePath 
-        #in_table = SdePath +'/NE.TELCO'
         write_log("Error in sde connection {0}".format(err))
         print("Database connection error: ",err)
-        globalFlag = False   
+        globalFlag = False
     finally:
+        if backend is not None:
+            backend.close()
         print("Script Executed Successfully.")
         write_log("Script Executed Successfully.")
         write_log("Length Modifying script Ended.... ")
         return globalFlag
 
-modify_length()
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add the spreadsheet's missing fields to the geodatabase tables")
+    parser.add_argument("--dry-run", action="store_true", help="only log the plan; add nothing")
+    parser.add_argument("--sqlite", help="SQLite or GeoPackage file to use instead of the SDE connection")
+    parser.add_argument("--excel", help="spreadsheet to read instead of the one in Config.py")
+    options = parser.parse_args()
+    modify_length(options.dry_run, options.sqlite, options.excel)
@@ -0,0 +1,228 @@
+"""
+Plans and applies the field additions listed in the ModifyLength spreadsheet.
+
+The spreadsheet has one row per (Table Name, Column Name). Instead of one
+AddField call per row, which fails on every field that already exists and
+costs a round trip to the geodatabase each time, the planner:
+  - reads the existing fields of every target table once,
+  - compares them with the spreadsheet (field names are case-insensitive,
+    as in the geodatabase),
+  - and adds only the missing fields, all of a table's in one operation.
+Fields that exist already are left alone; if their type or length differs
+from what the spreadsheet asks for, the plan says so, but they are not
+altered.
+
+Backends:
+  ArcpyBackend   an SDE connection file or any other arcpy workspace;
+                 ListFields, then one AddFields (Add Fields (multiple))
+                 call per table
+  SqliteBackend  a SQLite database or GeoPackage, to try the spreadsheet
+                 without SDE; PRAGMA table_info, then one transaction of
+                 ALTER TABLE ... ADD COLUMN per table. Tables are looked up
+                 by their bare name: NE.TELCO\\NE.SPAN is table SPAN.
+Works with the ArcGIS Python 2.7 as well as Python 3.
+"""
+import sqlite3
+from collections import OrderedDict
+
+try:
+    import arcpy  # Only needed by ArcpyBackend
+except ImportError:
+    arcpy = None
+
+# What every spreadsheet field is added as
+FIELD_TYPE = "TEXT"
+FIELD_LENGTH = 255
+
+
+def read_field_requests(excel_path):
+    """
+    Table name -> list of the field names the spreadsheet asks for, in
+    sheet order, without blank rows or repeated fields. The first column
+    holds the table, the second the field, whatever their headers say
+    (older sheets spell it 'Table  Name').
+    """
+    import pandas as pd
+
+    df = pd.read_excel(excel_path, usecols=[0, 1])
+    requests = OrderedDict()
+    for table_name, column_name in zip(df.iloc[:, 0], df.iloc[:, 1]):
+        if pd.isnull(table_name) or pd.isnull(column_name):
+            continue
+        table_name, column_name = ("%s" % table_name).strip(), ("%s" % column_name).strip()
+        if not table_name or not column_name:
+            continue
+        fields = requests.setdefault(table_name, [])
+        if column_name.upper() not in [field.upper() for field in fields]:
+            fields.append(column_name)
+    return requests
+
+
+class TablePlan(object):
+    """What the plan does to one table."""
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.missing_table = False
+        self.to_add = []
+        self.existing = []
+        # (field name, existing type, existing length)
+        self.mismatched = []
+
+
+class SchemaBackend(object):
+    """
+    Where the tables live. list_fields() returns the upper-cased names of a
+    table's fields mapped to (name, type, length), or None if there is no
+    such table; add_fields() adds several fields to one table in one go.
+    """
+
+    def list_fields(self, table_name):
+        raise NotImplementedError
+
+    def add_fields(self, table_name, field_names):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class ArcpyBackend(SchemaBackend):
+    """Tables of an arcpy workspace, e.g. an enterprise geodatabase through its .sde file."""
+
+    # arcpy field types, as AddField spells them
+    FIELD_TYPES = {"String": "TEXT", "Integer": "LONG", "SmallInteger": "SHORT", "Double": "DOUBLE",
+                   "Single": "FLOAT", "Date": "DATE", "GUID": "GUID", "Blob": "BLOB"}
+
+    def __init__(self, workspace):
+        if arcpy is None:
+            raise RuntimeError("arcpy is not available; use the SQLite backend")
+        self.workspace = workspace
+
+    def table_path(self, table_name):
+        return self.workspace + "\\" + table_name
+
+    def list_fields(self, table_name):
+        path = self.table_path(table_name)
+        if not arcpy.Exists(path):
+            return None
+        fields = {}
+        for field in arcpy.ListFields(path):
+            fields[field.name.upper()] = (field.name, self.FIELD_TYPES.get(field.type, field.type.upper()),
+                                         field.length if field.type == "String" else None)
+        return fields
+
+    def add_fields(self, table_name, field_names):
+        path = self.table_path(table_name)
+        if hasattr(arcpy.management, "AddFields"):
+            # [name, type, alias, length, default, domain]
+            arcpy.management.AddFields(path, [[name, FIELD_TYPE, name, FIELD_LENGTH, "", ""] for name in field_names])
+            return
+        # ArcGIS before 10.6 has no Add Fields (multiple)
+        for name in field_names:
+            arcpy.management.AddField(path, name, FIELD_TYPE, field_length=FIELD_LENGTH,
+                                      field_alias=name, field_is_nullable="NULLABLE")
+
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SqliteBackend(SchemaBackend):
+    """Tables of a SQLite database or GeoPackage, looked up by their bare name."""
+
+    def __init__(self, database_path):
+        self.connection = sqlite3.connect(database_path)
+
+    @staticmethod
+    def local_name(table_name):
+        """NE.TELCO\\NE.SPAN -> SPAN: no feature dataset and no owner."""
+        return table_name.split("\\")[-1].split(".")[-1]
+
+    def list_fields(self, table_name):
+        rows = self.connection.execute(
+            "PRAGMA table_info(" + quote_identifier(self.local_name(table_name)) + ")").fetchall()
+        if not rows:
+            return None
+        fields = {}
+        for row in rows:
+            name, declared = row[1], row[2].upper()
+            field_type, _, length = declared.partition("(")
+            length = length.rstrip(")").strip()
+            fields[name.upper()] = (name, field_type.strip(), int(length) if length.isdigit() else None)
+        return fields
+
+    def add_fields(self, table_name, field_names):
+        table = quote_identifier(self.local_name(table_name))
+        # SQLite adds one column per ALTER TABLE; the transaction makes it all or nothing
+        with self.connection:
+            for name in field_names:
+                self.connection.execute("ALTER TABLE {0} ADD COLUMN {1} {2}({3})".format(
+                    table, quote_identifier(name), FIELD_TYPE, FIELD_LENGTH))
+
+    def close(self):
+        self.connection.close()
+
+
+def plan_schema_changes(requests, backend):
+    """A TablePlan for every table in requests, reading each table's fields once."""
+    plans = []
+    for table_name, field_names in requests.items():
+        plan = TablePlan(table_name)
+        existing = backend.list_fields(table_name)
+        if existing is None:
+            plan.missing_table = True
+            plans.append(plan)
+            continue
+        for name in field_names:
+            current = existing.get(name.upper())
+            if current is None:
+                plan.to_add.append(name)
+                continue
+            plan.existing.append(current[0])
+            if current[1] != FIELD_TYPE or current[2] not in (None, FIELD_LENGTH):
+                plan.mismatched.append(current)
+        plans.append(plan)
+    return plans
+
+
+def format_plan(plans):
+    """The plan as lines of text, one or more per table, and a total."""
+    lines = []
+    for plan in plans:
+        if plan.missing_table:
+            lines.append("{0}: table not found, skipped".format(plan.table_name))
+            continue
+        if plan.to_add:
+            lines.append("{0}: add {1} ({2}({3}))".format(
+                plan.table_name, ", ".join(plan.to_add), FIELD_TYPE, FIELD_LENGTH))
+        if plan.existing:
+            lines.append("{0}: already has {1}".format(plan.table_name, ", ".join(plan.existing)))
+        for name, field_type, length in plan.mismatched:
+            lines.append("{0}: {1} is {2}{3}, not {4}({5}); left as it is".format(
+                plan.table_name, name, field_type, "({0})".format(length) if length else "", FIELD_TYPE, FIELD_LENGTH))
+    adding = [plan for plan in plans if plan.to_add]
+    lines.append("{0} field(s) to add to {1} table(s); {2} already present; {3} table(s) not found".format(
+        sum(len(plan.to_add) for plan in adding), len(adding),
+        sum(len(plan.existing) for plan in plans), sum(plan.missing_table for plan in plans)))
+    return lines
+
+
+def apply_plan(plans, backend, log=None):
+    """
+    Adds the missing fields, one add_fields() call per table. A failing
+    table does not stop the others. Returns the (table name, error) pairs.
+    """
+    errors = []
+    for plan in plans:
+        if not plan.to_add:
+            continue
+        try:
+            backend.add_fields(plan.table_name, plan.to_add)
+            if log:
+                log("{0}: added {1}".format(plan.table_name, ", ".join(plan.to_add)))
+        except Exception as err:
+            errors.append((plan.table_name, err))
+            if log:
+                log("{0}: Add Fields Error: {1}".format(plan.table_name, err))
+    return errors
@@ -0,0 +1,110 @@
+"""
+Output format benchmark.
+
+Converts one .kml/.kmz to every output format of FeatureWriters, at full
+precision and at each --precision, and prints for each: the file size,
+its gzip size (what a web server sends), the conversion time, the time to
+read every feature back, and the time to read only the features in a
+bounding box covering --query-fraction of the layer's extent. The JSON
+formats have to be parsed in full for that; FlatGeobuf reads its index and
+the matching features.
+Example: python BenchmarkFormats.py D:\\data\\schools.kmz --precision 6 5
+"""
+import argparse
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import FlatGeobuf
+from FeatureWriters import WRITERS
+from KmlReader import layerName, readFeatures
+from LayerIndex import geometryBounds
+
+
+def intersects(geometry, bbox):
+    """True if the bounding box of a GeoJSON geometry intersects bbox."""
+    if geometry is None:
+        return False
+    minX, minY, maxX, maxY = geometryBounds(geometry)
+    return minX <= bbox[2] and minY <= bbox[3] and maxX >= bbox[0] and maxY >= bbox[1]
+
+
+def queryBox(path, fraction):
+    """A box centred on the layer at path covering fraction of its extent."""
+    boxes = [geometryBounds(feature["geometry"]) for feature in readFeatures(path) if feature["geometry"] is not None]
+    minX, minY = min(box[0] for box in boxes), min(box[1] for box in boxes)
+    maxX, maxY = max(box[2] for box in boxes), max(box[3] for box in boxes)
+    side = fraction ** 0.5 / 2
+    centreX, centreY = (minX + maxX) / 2, (minY + maxY) / 2
+    return (centreX - (maxX - minX) * side, centreY - (maxY - minY) * side,
+            centreX + (maxX - minX) * side, centreY + (maxY - minY) * side)
+
+
+def readAll(path, outputFormat):
+    """Every feature in the file at path."""
+    if outputFormat == "fgb":
+        return list(FlatGeobuf.readFeatures(path))
+    with open(path, encoding="utf-8") as f:
+        if outputFormat == "geojson":
+            return json.load(f)["features"]
+        return [json.loads(line.lstrip("\x1e")) for line in f]
+
+
+def query(path, outputFormat, bbox):
+    """The features whose bounding box intersects bbox."""
+    if outputFormat == "fgb":
+        return list(FlatGeobuf.readFeatures(path, bbox))
+    return [feature for feature in readAll(path, outputFormat) if intersects(feature["geometry"], bbox)]
+
+
+def gzipSize(path):
+    with open(path, "rb") as f:
+        return len(gzip.compress(f.read(), 6))
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the size and read time of the output formats")
+    parser.add_argument("input", help=".kml or .kmz file")
+    parser.add_argument("--precision", type=int, nargs="*", default=[6], help="precisions to try besides full")
+    parser.add_argument("--query-fraction", type=float, default=0.01,
+                        help="share of the layer's extent (by area) covered by the bounding box query")
+    options = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="formats-")
+    try:
+        print(f"{'format':<11} {'precision':>9} {'bytes':>13} {'gzip bytes':>13} {'write s':>8} "
+              f"{'read s':>7} {'bbox query s':>13} {'hits':>7}")
+        bbox = queryBox(options.input, options.query_fraction)
+        for precision in [None, *options.precision]:
+            for outputFormat, writerClass in WRITERS.items():
+                path = os.path.join(folder, layerName(options.input) + writerClass.extension)
+
+                def convert():
+                    with writerClass(path, precision) as writer:
+                        for feature in readFeatures(options.input):
+                            writer.write(feature)
+                    return writer.count
+
+                count, writeSeconds = timed(convert)
+                features, readSeconds = timed(readAll, path, outputFormat)
+                assert len(features) == count
+                hits, querySeconds = timed(query, path, outputFormat, bbox)
+                print(f"{outputFormat:<11} {precision if precision is not None else 'full':>9} "
+                      f"{os.path.getsize(path):>13,} {gzipSize(path):>13,} {writeSeconds:>8.2f} "
+                      f"{readSeconds:>7.2f} {querySeconds:>13.3f} {len(hits):>7,}", flush=True)
+                os.unlink(path)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
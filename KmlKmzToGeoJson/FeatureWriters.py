@@ -0,0 +1,252 @@
+"""
+Streaming writers for the features KmlReader yields.
+
+A writer is opened on an output path, gets features one at a time through
+write() and never holds more than one of them. The output is written to a
+temporary file next to the destination and only renamed over it by
+close(), so a failed or interrupted conversion never leaves a truncated
+file behind; abort() throws the temporary file away instead.
+
+WRITERS maps each output format to its writer:
+  geojson     one FeatureCollection; a reader has to parse all of it
+  geojsonseq  GeoJSON Text Sequence (RFC 8142): one feature per record,
+              each starting with an RS character
+  ndjson      newline-delimited GeoJSON: one feature per line
+  fgb         FlatGeobuf: binary, with a packed Hilbert R-tree index so a
+              reader can fetch just the features in a bounding box
+
+With a precision, coordinates are rounded to that many decimal places
+(6 is about 10 cm), which shortens the JSON formats and makes every
+format compress better. With index=True the JSON writers also write a
+LayerIndex sidecar locating every feature in the file.
+"""
+import json
+import os
+import tempfile
+from array import array
+
+import FlatGeobuf
+from LayerIndex import INDEX_SUFFIX, IndexBuilder
+
+# Compact output; features built by KmlReader never contain cycles
+ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), check_circular=False, default=str)
+
+
+def defaultMode():
+    """Permissions of a new file under the current umask (mkstemp makes them owner-only)."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def roundCoordinates(coordinates, precision):
+    """GeoJSON coordinates (a position or nested lists of them) rounded to precision decimal places."""
+    if not coordinates or not isinstance(coordinates[0], (list, tuple)):
+        return [round(value, precision) for value in coordinates]
+    return [roundCoordinates(part, precision) for part in coordinates]
+
+
+def quantizeGeometry(geometry, precision):
+    """A copy of a GeoJSON geometry with its coordinates rounded to precision decimal places."""
+    if geometry["type"] == "GeometryCollection":
+        return {"type": "GeometryCollection",
+                "geometries": [quantizeGeometry(part, precision) for part in geometry["geometries"]]}
+    return {"type": geometry["type"], "coordinates": roundCoordinates(geometry["coordinates"], precision)}
+
+
+class FeatureWriter:
+    """
+    Base class of the writers: the temporary file, the context manager, the
+    precision and the index. Subclasses write their format in writeHeader(),
+    writeFeature() and writeFooter(); writeFeature() returns the byte
+    offset and length of the feature it wrote, if the format can be indexed.
+    """
+
+    extension = None
+    binary = False
+    indexable = True
+
+    def __init__(self, path, precision=None, hasZ=False, index=False):
+        if index and not self.indexable:
+            raise ValueError(f"{self.extension} files cannot have a LayerIndex")
+        self.path = path
+        self.precision = precision
+        self.hasZ = hasZ
+        self.index = IndexBuilder() if index else None
+        self.position = 0
+        directory = os.path.dirname(path) or "."
+        fd, self.tempPath = tempfile.mkstemp(prefix="temp-", suffix=self.extension, dir=directory)
+        if self.binary:
+            self.file = os.fdopen(fd, "wb")
+        else:
+            self.file = os.fdopen(fd, "w", encoding="utf-8", newline="\n")
+        self.count = 0
+        self.writeHeader()
+
+    def writeHeader(self):
+        pass
+
+    def writeFooter(self):
+        pass
+
+    def writeText(self, text):
+        """Writes text to a text-mode file, keeping track of the byte position."""
+        self.file.write(text)
+        self.position += len(text) if text.isascii() else len(text.encode("utf-8"))
+
+    def write(self, feature):
+        if self.precision is not None and feature["geometry"] is not None:
+            feature = dict(feature, geometry=quantizeGeometry(feature["geometry"], self.precision))
+        span = self.writeFeature(feature)
+        if self.index is not None:
+            self.index.add(feature["geometry"], *span)
+        self.count += 1
+
+    def close(self):
+        """Finishes the file and moves it into place, after its index if it has one."""
+        self.writeFooter()
+        self.file.close()
+        os.chmod(self.tempPath, defaultMode())
+        if self.index is not None:
+            self.writeIndex()
+        os.replace(self.tempPath, self.path)
+
+    def writeIndex(self):
+        """
+        Writes the index of the finished temporary file into place. It goes
+        first: if the layer is then never renamed, the index names a size
+        and mtime the old layer does not have, so LayerIndex refuses it.
+        """
+        indexPath = self.path + INDEX_SUFFIX
+        fd, tempPath = tempfile.mkstemp(prefix="temp-", suffix=INDEX_SUFFIX, dir=os.path.dirname(indexPath) or ".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                self.index.write(f, os.stat(self.tempPath))
+            os.chmod(tempPath, defaultMode())
+            os.replace(tempPath, indexPath)
+        except BaseException:
+            os.unlink(tempPath)
+            raise
+
+    def abort(self):
+        """Discards everything written so far."""
+        self.file.close()
+        os.unlink(self.tempPath)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, exc, traceback):
+        if excType is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class GeoJsonWriter(FeatureWriter):
+    """Writes a GeoJSON FeatureCollection one feature at a time."""
+
+    extension = ".geojson"
+
+    def writeHeader(self):
+        self.writeText('{"type":"FeatureCollection","features":[\n')
+
+    def writeFooter(self):
+        self.writeText("\n]}\n")
+
+    def writeFeature(self, feature):
+        if self.count:
+            self.writeText(",\n")
+        offset = self.position
+        self.writeText(ENCODER.encode(feature))
+        return offset, self.position - offset
+
+
+class GeoJsonSeqWriter(FeatureWriter):
+    """Writes a GeoJSON Text Sequence: every feature on a line of its own, after an RS."""
+
+    extension = ".geojsons"
+    separator = "\x1e"
+
+    def writeFeature(self, feature):
+        offset = self.position + len(self.separator)
+        self.writeText(self.separator + ENCODER.encode(feature) + "\n")
+        return offset, self.position - offset - 1
+
+
+class NdjsonWriter(GeoJsonSeqWriter):
+    """Writes newline-delimited GeoJSON: every feature on a line of its own."""
+
+    extension = ".ndjson"
+    separator = ""
+
+
+class FlatGeobufWriter(FeatureWriter):
+    """
+    Writes a FlatGeobuf file with a spatial index. The index and the header
+    come first in the file but need every feature's bounding box, the
+    columns and the feature count, so features are encoded into a spool
+    file as they arrive and copied out in Hilbert order by close(). Only
+    their boxes and spool offsets (40 bytes a feature) stay in memory.
+    """
+
+    extension = ".fgb"
+    binary = True
+    # FlatGeobuf has an index of its own
+    indexable = False
+
+    def __init__(self, path, precision=None, hasZ=False, index=False):
+        self.spool = tempfile.TemporaryFile(dir=os.path.dirname(path) or ".")
+        self.spoolSize = 0
+        self.boxes = array("d")
+        self.offsets = array("Q")
+        self.columns = {}
+        self.geometryTypes = set()
+        super().__init__(path, precision, hasZ, index)
+
+    def writeFeature(self, feature):
+        data, bounds, geometryType = FlatGeobuf.encodeFeature(feature, self.columns, self.hasZ)
+        self.offsets.append(self.spoolSize)
+        self.spool.write(data)
+        self.spoolSize += len(data)
+        self.boxes.extend(bounds)
+        if geometryType is not None:
+            self.geometryTypes.add(geometryType)
+
+    def writeFooter(self):
+        envelope = FlatGeobuf.extent(self.boxes)
+        geometryType = next(iter(self.geometryTypes)) if len(self.geometryTypes) == 1 else None
+        name = os.path.splitext(os.path.basename(self.path))[0]
+        self.file.write(FlatGeobuf.MAGIC)
+        self.file.write(FlatGeobuf.encodeHeader(name, envelope, geometryType, self.hasZ, list(self.columns), self.count))
+        if not self.count:
+            self.spool.close()
+            return
+
+        order = FlatGeobuf.hilbertOrder(self.boxes, envelope)
+        ends = self.offsets[1:]
+        ends.append(self.spoolSize)
+        boxes = array("d")
+        offsets = array("Q")
+        position = 0
+        for i in order:
+            boxes.extend(self.boxes[4 * i:4 * i + 4])
+            offsets.append(position)
+            position += ends[i] - self.offsets[i]
+        self.file.write(FlatGeobuf.packedRTree(boxes, offsets))
+        for i in order:
+            self.spool.seek(self.offsets[i])
+            self.file.write(self.spool.read(ends[i] - self.offsets[i]))
+        self.spool.close()
+
+    def abort(self):
+        self.spool.close()
+        super().abort()
+
+
+WRITERS = {
+    "geojson": GeoJsonWriter,
+    "geojsonseq": GeoJsonSeqWriter,
+    "ndjson": NdjsonWriter,
+    "fgb": FlatGeobufWriter,
+}
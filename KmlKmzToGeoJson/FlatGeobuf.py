@@ -0,0 +1,539 @@
+"""
+Encoding and decoding of FlatGeobuf (https://flatgeobuf.org), no extra packages needed.
+
+A FlatGeobuf file is the magic bytes, a size-prefixed flatbuffer Header, an
+optional packed Hilbert R-tree over the features' bounding boxes, and the
+size-prefixed flatbuffer Features in the order of the tree's leaves. A
+reader can fetch the header and the top of the tree, then only the
+features that intersect a bounding box, with a few range reads.
+
+Only the parts of the schema the converter needs are written: the layer
+name, envelope, geometry type, Z flag, WGS 84 CRS, string columns, the
+feature count and the index. Tables are laid out front to back, each
+vtable right before its table and everything a table references after it,
+so every offset points forward as the format requires. decodeHeader(),
+searchIndex() and decodeFeature() read any FlatGeobuf file back.
+"""
+import json
+import math
+import mmap
+import struct
+from array import array
+
+MAGIC = b"fgb\x03fgb\x00"
+
+INDEX_NODE_SIZE = 16
+
+# minX, minY, maxX, maxY and the offset of one index node
+NODE = struct.Struct("<ddddQ")
+
+GEOMETRY_TYPES = {
+    "Point": 1, "LineString": 2, "Polygon": 3, "MultiPoint": 4,
+    "MultiLineString": 5, "MultiPolygon": 6, "GeometryCollection": 7,
+}
+GEOMETRY_NAMES = {code: name for name, code in GEOMETRY_TYPES.items()}
+
+# Column types (ColumnType in header.fbs)
+STRING_COLUMN = 11
+JSON_COLUMN = 12
+BINARY_COLUMN = 14
+# struct format of the fixed-size column types
+COLUMN_FORMATS = {0: "b", 1: "B", 2: "?", 3: "h", 4: "H", 5: "i", 6: "I", 7: "q", 8: "Q", 9: "f", 10: "d"}
+
+# Bounding box of a feature without geometry: matches no query and widens nothing
+EMPTY_BOUNDS = (math.inf, math.inf, -math.inf, -math.inf)
+
+HILBERT_MAX = (1 << 16) - 1
+
+
+def pad(buf, alignment, extra=0):
+    """Appends zero bytes until len(buf) + extra is a multiple of alignment."""
+    buf.extend(bytes(-(len(buf) + extra) % alignment))
+
+
+def writeReference(buf, kind, value):
+    """Appends a string, vector or table to buf and returns its position."""
+    if kind == "table":
+        return writeTable(buf, value)
+    if kind == "string":
+        pad(buf, 4)
+        position = len(buf)
+        buf += struct.pack("<I", len(value)) + value + b"\0"
+        return position
+    if kind == "vector":
+        # Elements aligned to their size after the 4-byte length
+        buf += bytes(-(len(buf) + 4) % (8 if getattr(value, "itemsize", 1) == 8 else 4))
+        position = len(buf)
+        buf += struct.pack("<I", len(value))
+        buf += value
+        return position
+    # "tables": a vector of offsets, each to a table written after it
+    pad(buf, 4)
+    position = len(buf)
+    buf += struct.pack("<I", len(value)) + bytes(4 * len(value))
+    for i, fields in enumerate(value):
+        slot = position + 4 + 4 * i
+        struct.pack_into("<I", buf, slot, writeTable(buf, fields) - slot)
+    return position
+
+
+def tableLayout(kinds):
+    """
+    (vtable, alignment, inline size, scalars, references) of a table with
+    fields of kinds ((slot, kind) pairs). Scalars are (slot, offset, format)
+    and references (slot, offset), offsets from the start of the table.
+    """
+    scalars = sorted(((struct.calcsize(kind), slot, kind) for slot, kind in kinds if len(kind) == 1), reverse=True)
+    slotOffsets = [0] * (max(slot for slot, _ in kinds) + 1 if kinds else 0)
+    size = 4
+    for itemSize, slot, _ in scalars:
+        size += -size % itemSize
+        slotOffsets[slot] = size
+        size += itemSize
+    references = []
+    for slot, kind in kinds:
+        if len(kind) > 1:
+            size += -size % 4
+            slotOffsets[slot] = size
+            references.append((slot, size))
+            size += 4
+    vtable = struct.pack(f"<{len(slotOffsets) + 2}H", 4 + 2 * len(slotOffsets), size, *slotOffsets)
+    return (vtable, scalars[0][0] if scalars else 4, size,
+            [(slot, slotOffsets[slot], "<" + kind) for _, slot, kind in scalars], references)
+
+
+# Layout of every shape of table written so far; features repeat a handful of them
+LAYOUTS = {}
+
+
+def writeTable(buf, fields):
+    """
+    Appends a table, preceded by its vtable and followed by everything it
+    references, and returns the table's position. fields maps slot number to
+    (kind, value): kind is a struct format for a scalar, or "string",
+    "vector" (an array or bytes), "table" (fields) or "tables" (a list of fields).
+    """
+    kinds = tuple((slot, kind) for slot, (kind, _) in fields.items())
+    layout = LAYOUTS.get(kinds)
+    if layout is None:
+        layout = LAYOUTS[kinds] = tableLayout(kinds)
+    vtableBytes, alignment, size, scalars, references = layout
+
+    buf += bytes(len(buf) & 1)
+    vtable = len(buf)
+    buf += vtableBytes
+    buf += bytes(-len(buf) % alignment)
+    table = len(buf)
+    buf += bytes(size)
+    struct.pack_into("<i", buf, table, table - vtable)
+    for slot, offset, kind in scalars:
+        struct.pack_into(kind, buf, table + offset, fields[slot][1])
+    for slot, offset in references:
+        field = table + offset
+        struct.pack_into("<I", buf, field, writeReference(buf, *fields[slot]) - field)
+    return table
+
+
+def finish(fields):
+    """A size-prefixed flatbuffer with the table fields as its root."""
+    buf = bytearray(8)
+    root = writeTable(buf, fields)
+    struct.pack_into("<II", buf, 0, len(buf) - 4, root - 4)
+    return buf
+
+
+def geometryFields(geometry, hasZ, bounds):
+    """Fields of the Geometry table for a GeoJSON geometry; widens bounds [minX, minY, maxX, maxY]."""
+    kind = geometry["type"]
+    fields = {6: ("B", GEOMETRY_TYPES[kind])}
+    if kind == "GeometryCollection":
+        fields[7] = ("tables", [geometryFields(part, hasZ, bounds) for part in geometry["geometries"]])
+        return fields
+    if kind == "MultiPolygon":
+        fields[7] = ("tables", [geometryFields({"type": "Polygon", "coordinates": polygon}, hasZ, bounds)
+                                for polygon in geometry["coordinates"]])
+        return fields
+    coordinates = geometry["coordinates"]
+    if kind == "Point" and not hasZ:
+        x, y = coordinates[0], coordinates[1]
+        bounds[:] = min(bounds[0], x), min(bounds[1], y), max(bounds[2], x), max(bounds[3], y)
+        fields[1] = ("vector", array("d", (x, y)))
+        return fields
+    if kind == "Point":
+        lines = [[coordinates]]
+    elif kind == "LineString" or kind == "MultiPoint":
+        lines = [coordinates]
+    else:
+        lines = coordinates
+    xy = array("d")
+    z = array("d")
+    ends = array("I")
+    for line in lines:
+        for position in line:
+            xy.append(position[0])
+            xy.append(position[1])
+            if hasZ:
+                z.append(position[2] if len(position) > 2 else 0.0)
+        ends.append(len(xy) // 2)
+    if xy:
+        bounds[0] = min(bounds[0], min(xy[0::2]))
+        bounds[1] = min(bounds[1], min(xy[1::2]))
+        bounds[2] = max(bounds[2], max(xy[0::2]))
+        bounds[3] = max(bounds[3], max(xy[1::2]))
+    # Ends are only needed to split several rings or lines
+    if len(ends) > 1:
+        fields[0] = ("vector", ends)
+    fields[1] = ("vector", xy)
+    if hasZ:
+        fields[2] = ("vector", z)
+    return fields
+
+
+def encodeProperties(properties, columns):
+    """
+    Properties as FlatGeobuf property bytes. Every property is a string
+    column; columns maps column name to index and gets any new names.
+    """
+    data = bytearray()
+    for name, value in properties.items():
+        if value is None:
+            continue
+        index = columns.get(name)
+        if index is None:
+            index = columns[name] = len(columns)
+        value = (value if isinstance(value, str) else str(value)).encode("utf-8")
+        data += struct.pack("<HI", index, len(value))
+        data += value
+    return data
+
+
+def encodeFeature(feature, columns, hasZ=False):
+    """
+    A GeoJSON feature as a size-prefixed FlatGeobuf Feature. Returns
+    (bytes, bounding box, geometry type); for a feature without geometry the
+    box is EMPTY_BOUNDS and the type None.
+    """
+    fields = {}
+    bounds = list(EMPTY_BOUNDS)
+    geometry = feature["geometry"]
+    if geometry is not None:
+        fields[0] = ("table", geometryFields(geometry, hasZ, bounds))
+    properties = encodeProperties(feature["properties"], columns)
+    if properties:
+        fields[1] = ("vector", properties)
+    return finish(fields), bounds, geometry["type"] if geometry is not None else None
+
+
+def encodeHeader(name, envelope, geometryType, hasZ, columns, featuresCount, indexNodeSize=INDEX_NODE_SIZE):
+    """
+    The size-prefixed Header flatbuffer. columns are the column names in
+    index order; envelope is None if no feature has a geometry.
+    """
+    fields = {
+        0: ("string", name.encode("utf-8")),
+        2: ("B", GEOMETRY_TYPES.get(geometryType, 0)),
+        7: ("tables", [{0: ("string", column.encode("utf-8")), 1: ("B", STRING_COLUMN)} for column in columns]),
+        8: ("Q", featuresCount),
+        9: ("H", indexNodeSize),
+        # KML coordinates are always WGS 84
+        10: ("table", {1: ("i", 4326)}),
+    }
+    if envelope is not None:
+        fields[1] = ("vector", array("d", envelope))
+    if hasZ:
+        fields[3] = ("?", True)
+    return finish(fields)
+
+
+def hilbert(x, y):
+    """Position of (x, y), both 0..65535, along a Hilbert curve (as in the FlatGeobuf reference code)."""
+    a = x ^ y
+    b = 0xFFFF ^ a
+    c = 0xFFFF ^ (x | y)
+    d = x & (y ^ 0xFFFF)
+    A = a | (b >> 1)
+    B = (a >> 1) ^ a
+    C = ((c >> 1) ^ (b & (d >> 1))) ^ c
+    D = ((a & (c >> 1)) ^ (d >> 1)) ^ d
+    a, b, c, d = A, B, C, D
+    A = (a & (a >> 2)) ^ (b & (b >> 2))
+    B = (a & (b >> 2)) ^ (b & ((a ^ b) >> 2))
+    C ^= (a & (c >> 2)) ^ (b & (d >> 2))
+    D ^= (b & (c >> 2)) ^ ((a ^ b) & (d >> 2))
+    a, b, c, d = A, B, C, D
+    A = (a & (a >> 4)) ^ (b & (b >> 4))
+    B = (a & (b >> 4)) ^ (b & ((a ^ b) >> 4))
+    C ^= (a & (c >> 4)) ^ (b & (d >> 4))
+    D ^= (b & (c >> 4)) ^ ((a ^ b) & (d >> 4))
+    a, b, c, d = A, B, C, D
+    C ^= (a & (c >> 8)) ^ (b & (d >> 8))
+    D ^= (b & (c >> 8)) ^ ((a ^ b) & (d >> 8))
+    a = C ^ (C >> 1)
+    b = D ^ (D >> 1)
+    i0 = x ^ y
+    i1 = b | (0xFFFF ^ (i0 | a))
+    i0 = (i0 | (i0 << 8)) & 0x00FF00FF
+    i0 = (i0 | (i0 << 4)) & 0x0F0F0F0F
+    i0 = (i0 | (i0 << 2)) & 0x33333333
+    i0 = (i0 | (i0 << 1)) & 0x55555555
+    i1 = (i1 | (i1 << 8)) & 0x00FF00FF
+    i1 = (i1 | (i1 << 4)) & 0x0F0F0F0F
+    i1 = (i1 | (i1 << 2)) & 0x33333333
+    i1 = (i1 | (i1 << 1)) & 0x55555555
+    return (i1 << 1) | i0
+
+
+def extent(boxes):
+    """Bounding box of the boxes (an array of minX, minY, maxX, maxY), or None if they are all empty."""
+    if not boxes or min(boxes[0::4]) > max(boxes[2::4]):
+        return None
+    return [min(boxes[0::4]), min(boxes[1::4]), max(boxes[2::4]), max(boxes[3::4])]
+
+
+def hilbertOrder(boxes, envelope):
+    """Indexes of the boxes sorted by the Hilbert value of their centres within envelope."""
+    count = len(boxes) // 4
+    if envelope is None:
+        return list(range(count))
+    minX, minY, maxX, maxY = envelope
+    scaleX = HILBERT_MAX / (maxX - minX) if maxX > minX else 0.0
+    scaleY = HILBERT_MAX / (maxY - minY) if maxY > minY else 0.0
+    values = []
+    for i in range(0, len(boxes), 4):
+        x0, y0, x1, y1 = boxes[i:i + 4]
+        if x0 > x1:
+            values.append(0)
+        else:
+            values.append(hilbert(int(((x0 + x1) / 2 - minX) * scaleX), int(((y0 + y1) / 2 - minY) * scaleY)))
+    return sorted(range(count), key=values.__getitem__)
+
+
+def levelBounds(count, nodeSize):
+    """(first node, end node) of every tree level, leaves first; the root is node 0."""
+    levelSizes = [count]
+    n = count
+    while True:
+        n = -(-n // nodeSize)
+        levelSizes.append(n)
+        if n == 1:
+            break
+    bounds = []
+    end = sum(levelSizes)
+    for size in levelSizes:
+        bounds.append((end - size, end))
+        end -= size
+    return bounds
+
+
+def packedRTree(boxes, offsets, nodeSize=INDEX_NODE_SIZE):
+    """
+    The packed R-tree over the boxes (in feature order) as bytes. A leaf
+    holds the byte offset of its feature in the feature section, an inner
+    node the index of its first child.
+    """
+    levels = levelBounds(len(offsets), nodeSize)
+    nodes = levels[0][1]
+    leaves = levels[0][0]
+    minXs = array("d", bytes(8 * nodes))
+    minYs = array("d", bytes(8 * nodes))
+    maxXs = array("d", bytes(8 * nodes))
+    maxYs = array("d", bytes(8 * nodes))
+    nodeOffsets = array("Q", bytes(8 * nodes))
+    minXs[leaves:], minYs[leaves:] = boxes[0::4], boxes[1::4]
+    maxXs[leaves:], maxYs[leaves:] = boxes[2::4], boxes[3::4]
+    nodeOffsets[leaves:] = offsets
+    for (start, end), (parent, _) in zip(levels, levels[1:]):
+        for child in range(start, end, nodeSize):
+            last = min(child + nodeSize, end)
+            minXs[parent] = min(minXs[child:last])
+            minYs[parent] = min(minYs[child:last])
+            maxXs[parent] = max(maxXs[child:last])
+            maxYs[parent] = max(maxYs[child:last])
+            nodeOffsets[parent] = child
+            parent += 1
+    data = bytearray(NODE.size * nodes)
+    for i in range(nodes):
+        NODE.pack_into(data, NODE.size * i, minXs[i], minYs[i], maxXs[i], maxYs[i], nodeOffsets[i])
+    return data
+
+
+def tableField(buf, table, slot):
+    """Position of the field in slot of the table at position table, or None if it is absent."""
+    vtable = table - struct.unpack_from("<i", buf, table)[0]
+    vtableSize = struct.unpack_from("<H", buf, vtable)[0]
+    if 4 + 2 * slot >= vtableSize:
+        return None
+    offset = struct.unpack_from("<H", buf, vtable + 4 + 2 * slot)[0]
+    return table + offset if offset else None
+
+
+def follow(buf, position):
+    """Target of the offset stored at position."""
+    return position + struct.unpack_from("<I", buf, position)[0]
+
+
+def readScalar(buf, table, slot, kind, default):
+    field = tableField(buf, table, slot)
+    return default if field is None else struct.unpack_from("<" + kind, buf, field)[0]
+
+
+def readVector(buf, table, slot, kind):
+    """The scalar vector in slot as an array, empty if absent."""
+    field = tableField(buf, table, slot)
+    if field is None:
+        return array(kind)
+    vector = follow(buf, field)
+    length = struct.unpack_from("<I", buf, vector)[0]
+    return array(kind, buf[vector + 4:vector + 4 + length * struct.calcsize(kind)])
+
+
+def readString(buf, table, slot):
+    field = tableField(buf, table, slot)
+    if field is None:
+        return None
+    string = follow(buf, field)
+    length = struct.unpack_from("<I", buf, string)[0]
+    return bytes(buf[string + 4:string + 4 + length]).decode("utf-8")
+
+
+def readTables(buf, table, slot):
+    """Positions of the tables in the table vector in slot."""
+    field = tableField(buf, table, slot)
+    if field is None:
+        return []
+    vector = follow(buf, field)
+    length = struct.unpack_from("<I", buf, vector)[0]
+    return [follow(buf, vector + 4 + 4 * i) for i in range(length)]
+
+
+def decodeHeader(buf):
+    """
+    Reads the magic bytes and header at the start of buf. Returns a dict
+    with name, envelope, geometryType, hasZ, columns ([(name, type)]),
+    featuresCount, indexNodeSize, and the positions indexStart and
+    featuresStart of the index and the first feature.
+    """
+    if bytes(buf[:3]) != MAGIC[:3]:
+        raise ValueError("Not a FlatGeobuf file")
+    size = struct.unpack_from("<I", buf, 8)[0]
+    header = buf[12:12 + size]
+    root = follow(header, 0)
+    columns = [(readString(header, column, 0), readScalar(header, column, 1, "B", 0))
+               for column in readTables(header, root, 7)]
+    envelope = readVector(header, root, 1, "d")
+    header = {
+        "name": readString(header, root, 0),
+        "envelope": list(envelope) or None,
+        "geometryType": GEOMETRY_NAMES.get(readScalar(header, root, 2, "B", 0)),
+        "hasZ": readScalar(header, root, 3, "?", False),
+        "columns": columns,
+        "featuresCount": readScalar(header, root, 8, "Q", 0),
+        "indexNodeSize": readScalar(header, root, 9, "H", INDEX_NODE_SIZE),
+        "indexStart": 12 + size,
+    }
+    header["featuresStart"] = header["indexStart"] + indexSize(header)
+    return header
+
+
+def indexSize(header):
+    """Bytes taken by the header's packed R-tree, 0 if the file has none."""
+    if not header["indexNodeSize"] or not header["featuresCount"]:
+        return 0
+    return levelBounds(header["featuresCount"], header["indexNodeSize"])[0][1] * NODE.size
+
+
+def searchIndex(buf, header, bbox):
+    """Offsets in the feature section of the features whose boxes intersect bbox, in file order."""
+    nodeSize = header["indexNodeSize"]
+    levels = levelBounds(header["featuresCount"], nodeSize)
+    leaves = levels[0][0]
+    start = header["indexStart"]
+    minX, minY, maxX, maxY = bbox
+    found = []
+    stack = [(0, len(levels) - 1)]
+    while stack:
+        first, level = stack.pop()
+        for node in range(first, min(first + nodeSize, levels[level][1])):
+            nodeMinX, nodeMinY, nodeMaxX, nodeMaxY, offset = NODE.unpack_from(buf, start + NODE.size * node)
+            if maxX < nodeMinX or maxY < nodeMinY or minX > nodeMaxX or minY > nodeMaxY:
+                continue
+            if node >= leaves:
+                found.append(offset)
+            else:
+                stack.append((offset, level - 1))
+    found.sort()
+    return found
+
+
+def decodeGeometry(buf, table, geometryType, hasZ):
+    kind = GEOMETRY_NAMES[readScalar(buf, table, 6, "B", 0) or GEOMETRY_TYPES[geometryType]]
+    if kind == "GeometryCollection":
+        return {"type": kind, "geometries": [decodeGeometry(buf, part, None, hasZ) for part in readTables(buf, table, 7)]}
+    if kind == "MultiPolygon":
+        return {"type": kind, "coordinates": [decodeGeometry(buf, part, "Polygon", hasZ)["coordinates"]
+                                              for part in readTables(buf, table, 7)]}
+    xy = readVector(buf, table, 1, "d")
+    if hasZ:
+        z = readVector(buf, table, 2, "d")
+        positions = [[xy[2 * i], xy[2 * i + 1], z[i]] for i in range(len(z))]
+    else:
+        positions = [[xy[i], xy[i + 1]] for i in range(0, len(xy), 2)]
+    if kind == "Point":
+        return {"type": kind, "coordinates": positions[0]}
+    if kind == "LineString" or kind == "MultiPoint":
+        return {"type": kind, "coordinates": positions}
+    ends = readVector(buf, table, 0, "I") or [len(positions)]
+    return {"type": kind, "coordinates": [positions[start:end] for start, end in zip([0, *ends], ends)]}
+
+
+def decodeProperties(data, columns):
+    properties = {}
+    position = 0
+    while position < len(data):
+        index = struct.unpack_from("<H", data, position)[0]
+        name, kind = columns[index]
+        position += 2
+        if kind in COLUMN_FORMATS:
+            properties[name] = struct.unpack_from("<" + COLUMN_FORMATS[kind], data, position)[0]
+            position += struct.calcsize(COLUMN_FORMATS[kind])
+            continue
+        length = struct.unpack_from("<I", data, position)[0]
+        value = bytes(data[position + 4:position + 4 + length])
+        position += 4 + length
+        if kind == BINARY_COLUMN:
+            properties[name] = value
+        elif kind == JSON_COLUMN:
+            properties[name] = json.loads(value)
+        else:
+            properties[name] = value.decode("utf-8")
+    return properties
+
+
+def decodeFeature(buf, position, header):
+    """The GeoJSON feature whose size prefix is at position in buf, and the position after it."""
+    size = struct.unpack_from("<I", buf, position)[0]
+    feature = buf[position + 4:position + 4 + size]
+    root = follow(feature, 0)
+    field = tableField(feature, root, 0)
+    geometry = None if field is None else decodeGeometry(feature, follow(feature, field), header["geometryType"], header["hasZ"])
+    properties = decodeProperties(readVector(feature, root, 1, "B"), header["columns"])
+    return {"type": "Feature", "geometry": geometry, "properties": properties}, position + 4 + size
+
+
+def readFeatures(path, bbox=None):
+    """
+    Yields the features of a FlatGeobuf file as GeoJSON dicts, in file
+    order. With bbox (minX, minY, maxX, maxY) only those whose bounding box
+    intersects it are read, found through the index.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        header = decodeHeader(buf)
+        start = header["featuresStart"]
+        if bbox is not None and indexSize(header):
+            for offset in searchIndex(buf, header, bbox):
+                yield decodeFeature(buf, start + offset, header)[0]
+            return
+        position = start
+        while position < len(buf):
+            feature, position = decodeFeature(buf, position, header)
+            yield feature
@@ -1,41 +1,76 @@
-import arcpy
+import argparse
+import json
 import os,shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-def clearExistingShapefiles(folder):
-    for filename in os.listdir(folder):
-        file_path = os.path.join(folder, filename)
-        #print(filename)
-        try:
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path)
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)
-        except Exception as e:
-            print('Failed to delete %s. Reason: %s' % (file_path, e))
-
-def convertKMLKMZToGeoJson(file_path,filename):
-    
-    file_name = filename.split(".")[0]
-    # Output directory for the converted layer
-    output_path = r"D:\SHARE_SRIK\Geoprocessing\output_layer"
-    os.makedirs(output_path, exist_ok=True)
-    output_fc = os.path.join(r"D:\SHARE_SRIK\Geoprocessing\Shapefile", file_name+".shp")
+try:
+    import arcpy  # Only needed by the arcpy backend
+except ImportError:
+    arcpy = None
+
+from FeatureWriters import WRITERS
+from KmlReader import layerName, readFeatures
+from LayerIndex import INDEX_SUFFIX
+from Manifest import Manifest, fileHash
+from TilePyramid import STATE_NAME, TILE_FORMATS, buildPyramid, isCurrent
+
+# Input KML/KMZ folder and output GeoJSON folder used when none are given
+KMLKMZ_FOLDER = r"D:\SHARE_SRIK\Geoprocessing\kingdom_wide_schools_LayerTo"
+GEOJSON_OUTPUT_DIR = r"D:\SHARE_SRIK\Geoprocessing\GeoJson_Layer"
+# The arcpy backend creates one scratch folder per input file in here
+SCRATCH_ROOT = r"D:\SHARE_SRIK\Geoprocessing\Scratch"
+
+INPUT_EXTENSIONS = (".kml", ".kmz")
 
-    #Delete the existing shapefile
-    folder = "D:\SHARE_SRIK\Geoprocessing\Shapefile"
-    clearExistingShapefiles(folder)
+# Name of the geodatabase KMLToLayer creates in a file's scratch folder
+SCRATCH_LAYER_NAME = "layer"
 
+# Bump when a backend's output changes, so the manifest reconverts everything
+CONVERTER_VERSION = 2
+
+BACKENDS = ("arcpy", "python")
+
+def readFeatureClass(feature_class_path):
+    """Yields the rows of a feature class as GeoJSON feature dicts in WGS 84."""
+    fields = [field.name for field in arcpy.ListFields(feature_class_path) if field.type not in ("Geometry", "OID")]
+    with arcpy.da.SearchCursor(feature_class_path, ["SHAPE@"] + fields,
+                               spatial_reference=arcpy.SpatialReference(4326)) as cursor:
+        for row in cursor:
+            geometry = row[0].__geo_interface__ if row[0] is not None else None
+            yield {"type": "Feature", "geometry": geometry, "properties": dict(zip(fields, row[1:]))}
+
+def convertKMLKMZToGeoJson(file_path,filename,geojson_output_dir=GEOJSON_OUTPUT_DIR,scratch_root=SCRATCH_ROOT,
+                           output_format="geojson",precision=None,index=False):
+    """
+    Converts one file with arcpy and returns (features written, output paths).
+    The geodatabase and shapefiles go to a scratch folder of this file's own,
+    which is removed afterwards, so several files can be converted at once.
+    Plain GeoJSON goes through FeaturesToJSON; other formats, a precision or
+    an index stream the feature classes' rows into a FeatureWriters writer.
+    """
+    # The name findInputFiles() checked for clashes, so "site.a.kml" and "site.b.kml" stay apart
+    file_name = layerName(filename)
+    os.makedirs(scratch_root, exist_ok=True)
+    scratch = tempfile.mkdtemp(prefix=file_name+"-", dir=scratch_root)
+    # Output directory for the converted layer
+    output_path = os.path.join(scratch, "output_layer")
+    shapefile_folder = os.path.join(scratch, "Shapefile")
+    os.makedirs(output_path)
+    os.makedirs(shapefile_folder)
 
     # Output GeoJSON directory
-    geojson_output_dir = r"D:\SHARE_SRIK\Geoprocessing\GeoJson_Layer"
     os.makedirs(geojson_output_dir, exist_ok=True)
-    output_geojson = os.path.join(geojson_output_dir, file_name+".geojson")
 
     try:
-        # Step 1: Convert KML to Layer (which creates a file geodatabase)
-        arcpy.KMLToLayer_conversion(file_path, output_path)
+        # Step 1: Convert KML to Layer (which creates a file geodatabase). The
+        # scratch folder is this file's own, so a fixed name is safe, where
+        # one taken from the file name may have dots a geodatabase cannot
+        arcpy.KMLToLayer_conversion(file_path, output_path, SCRATCH_LAYER_NAME)
         # Step 2: Locate the output geodatabase
-        gdb_path = os.path.join(output_path, file_name+".gdb")
+        gdb_path = os.path.join(output_path, SCRATCH_LAYER_NAME+".gdb")
 
         # Set the workspace to the geodatabase
         arcpy.env.workspace = gdb_path
@@ -46,37 +81,287 @@ def convertKMLKMZToGeoJson(file_path,filename):
         if not datasets:
             raise FileNotFoundError(f"No datasets found in the geodatabase at: {gdb_path}")
 
-        print("Datasets in the geodatabase:")
-        feature_classes=None
-        for dataset in datasets:
-            print(f"Dataset: {dataset}")
-            # List feature classes in the dataset
-            feature_classes = arcpy.ListFeatureClasses(feature_dataset=dataset)
-
-            if not feature_classes:
-                print(f"No feature classes found in dataset: {dataset}")
-            else:
-                print(f"Feature classes in dataset {dataset}:")
-                for fc in feature_classes:
-                    #print(f"Feature class: {fc}")
-                    # Build full path to the feature class
-                    feature_class_path = os.path.join(gdb_path, dataset, fc)
-
-                    # Convert the feature class to a shapefile
-                    arcpy.CopyFeatures_management(feature_class_path, output_fc)
-
-                    # Convert the shapefile to GeoJSON
-                    arcpy.FeaturesToJSON_conversion(output_fc, output_geojson)
-
-                    print(f"Conversion complete. GeoJSON saved at: {output_geojson}")
-        print(feature_classes)
+        feature_classes = [(dataset, fc) for dataset in datasets
+                           for fc in arcpy.ListFeatureClasses(feature_dataset=dataset) or []]
+        if not feature_classes:
+            raise FileNotFoundError(f"No feature classes found in the geodatabase at: {gdb_path}")
+
+        features = 0
+        outputs = []
+        writer_class = WRITERS[output_format]
+        for dataset, fc in feature_classes:
+            # Build full path to the feature class
+            feature_class_path = os.path.join(gdb_path, dataset, fc)
+            output_fc = os.path.join(shapefile_folder, fc+".shp")
+            # One output per feature class, named after the input file
+            suffix = "" if len(feature_classes) == 1 else "_"+fc
+            output_geojson = os.path.join(geojson_output_dir, file_name+suffix+writer_class.extension)
+
+            if output_format != "geojson" or precision is not None or index:
+                with writer_class(output_geojson, precision, index=index) as writer:
+                    for feature in readFeatureClass(feature_class_path):
+                        writer.write(feature)
+                features += writer.count
+                outputs.append(output_geojson)
+                if index:
+                    outputs.append(output_geojson+INDEX_SUFFIX)
+                continue
+
+            # Convert the feature class to a shapefile
+            arcpy.CopyFeatures_management(feature_class_path, output_fc)
+            features += int(arcpy.GetCount_management(output_fc)[0])
+
+            # Convert the shapefile to GeoJSON
+            arcpy.FeaturesToJSON_conversion(output_fc, output_geojson)
+            outputs.append(output_geojson)
+        return features, outputs
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+def convertWithPython(file_path,geojson_output_dir,keepAltitude=False,output_format="geojson",precision=None,
+                      index=False):
+    """
+    Converts one .kml/.kmz straight to output_format (see FeatureWriters)
+    without arcpy or any intermediate geodatabase or shapefile: Placemarks
+    are streamed from the parser into the output file, so memory use does
+    not grow with the layer. With index, a LayerIndex sidecar is written
+    too. Returns (features written, output paths).
+    """
+    os.makedirs(geojson_output_dir, exist_ok=True)
+    writer_class = WRITERS[output_format]
+    output_geojson = os.path.join(geojson_output_dir, layerName(file_path)+writer_class.extension)
+    with writer_class(output_geojson, precision, keepAltitude, index) as writer:
+        for feature in readFeatures(file_path, keepAltitude):
+            writer.write(feature)
+    outputs = [output_geojson, output_geojson+INDEX_SUFFIX] if index else [output_geojson]
+    return writer.count, outputs
+
+def converterVersion(options):
+    """Identifies the backend and the settings that shape its output, for the manifest."""
+    version = f"{options.backend}-{CONVERTER_VERSION}"
+    if options.format != "geojson":
+        version += "-" + options.format
+    if options.precision is not None:
+        version += f"-precision{options.precision}"
+    if options.index:
+        version += "-index"
+    if options.backend == "python" and options.keep_altitude:
+        version += "-altitude"
+    return version
+
+def convertFile(task):
+    """
+    Converts one input file; the process pool's entry point. When the
+    file's content hash equals knownHash it is not converted again.
+    Returns a result dict; its error is None on success.
+    """
+    backend, file_path, filename, options, knownHash = task
+    start = time.perf_counter()
+    result = {"file": filename, "features": 0, "outputs": [], "sha256": None, "unchanged": False, "error": None}
+    try:
+        result["sha256"] = fileHash(file_path)
+        if result["sha256"] == knownHash:
+            result["unchanged"] = True
+        elif backend == "arcpy":
+            result["features"], result["outputs"] = convertKMLKMZToGeoJson(
+                file_path,filename,options["output"],options["scratch"],options["format"],options["precision"],
+                options["index"])
+        else:
+            result["features"], result["outputs"] = convertWithPython(
+                file_path,options["output"],options["keep_altitude"],options["format"],options["precision"],
+                options["index"])
     except Exception as err:
-        print(err)
-    
-    
-# Input KML file path
-kmlkmz_folder = r"D:\SHARE_SRIK\Geoprocessing\kingdom_wide_schools_LayerTo"
-
-for filename in os.listdir(kmlkmz_folder):
-    file_path = os.path.join(kmlkmz_folder, filename)
-    convertKMLKMZToGeoJson(file_path,filename)
+        result["error"] = f"{type(err).__name__}: {err}"
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+def findInputFiles(folder):
+    """
+    The .kml/.kmz files in folder, largest first so the long conversions
+    start early, plus a failure for every file whose output name is already
+    taken by another one (e.g. a.kml and a.kmz would both write a.geojson).
+    """
+    files = sorted((filename for filename in os.listdir(folder) if filename.lower().endswith(INPUT_EXTENSIONS)),
+                   key=lambda filename: -os.path.getsize(os.path.join(folder, filename)))
+    selected = []
+    clashes = []
+    owners = {}
+    for filename in files:
+        name = layerName(filename).lower()
+        if name in owners:
+            clashes.append({"file": filename, "features": 0, "seconds": 0.0, "unchanged": False,
+                            "error": f"Output name clashes with {owners[name]}"})
+        else:
+            owners[name] = filename
+            selected.append(filename)
+    return selected, clashes
+
+def runConversions(tasks, jobs):
+    """Yields the result of every task as it finishes, running up to jobs of them at once."""
+    if jobs <= 1:
+        for task in tasks:
+            yield convertFile(task)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(convertFile, task) for task in tasks]
+        for future in as_completed(futures):
+            yield future.result()
+
+def formatSeconds(seconds):
+    minutes, seconds = divmod(seconds, 60)
+    return f"{int(minutes)}m{seconds:04.1f}s" if minutes else f"{seconds:.1f}s"
+
+def cutTiles(options, manifest, converted):
+    """
+    Cuts a tile pyramid under options.tiles for every output layer in the
+    manifest: incrementally for the layers converted in this run, in full
+    for layers without a current pyramid. Deletes the pyramids of layers
+    that are gone. Returns the per-layer summaries.
+    """
+    settings = {"format": options.tile_format, "minZoom": options.min_zoom, "maxZoom": options.max_zoom}
+    layers = {}
+    for entry in manifest.entries.values():
+        for output in entry["outputs"]:
+            if not output.endswith(INDEX_SUFFIX):
+                layers[layerName(output)] = output
+    changed = {os.path.relpath(output, options.output) for result in converted for output in result["outputs"]}
+    os.makedirs(options.tiles, exist_ok=True)
+    for name in sorted(os.listdir(options.tiles)):
+        folder = os.path.join(options.tiles, name)
+        if name not in layers and os.path.exists(os.path.join(folder, STATE_NAME)):
+            shutil.rmtree(folder)
+            print(f"Removed the tiles of {name}, which is no longer converted")
+
+    summaries = []
+    for name, output in sorted(layers.items()):
+        folder = os.path.join(options.tiles, name)
+        if output not in changed and isCurrent(folder, settings):
+            continue
+        summary = buildPyramid(os.path.join(options.output, output), folder, settings, options.jobs, not options.force)
+        summary["layer"] = name
+        summaries.append(summary)
+        print(f"Tiles of {name}: {summary['tiles']:,} cut ({'incremental' if summary['incremental'] else 'full'}), "
+              f"{summary['written']:,} written, {summary['deleted']:,} deleted in {formatSeconds(summary['seconds'])}",
+              flush=True)
+    return summaries
+
+def runBatch(options):
+    """
+    Converts the files in options.input that changed since the last run,
+    printing progress and a summary, and updates the manifest in the output
+    folder. Returns the failures.
+    """
+    filenames, clashes = findInputFiles(options.input)
+    os.makedirs(options.output, exist_ok=True)
+    manifest = Manifest(options.output)
+    converter = converterVersion(options)
+    removed = manifest.collectGarbage(set(filenames) | {clash["file"] for clash in clashes})
+    for filename in removed:
+        print(f"Removed the outputs of {filename}, which is gone from the input folder")
+
+    settings = {"output": options.output, "scratch": options.scratch, "keep_altitude": options.keep_altitude,
+                "format": options.format, "precision": options.precision, "index": options.index}
+    tasks = []
+    stats = {}
+    skipped = 0
+    for filename in filenames:
+        file_path = os.path.join(options.input, filename)
+        stats[filename] = os.stat(file_path)
+        if not options.force and manifest.isUnchanged(filename, stats[filename], converter):
+            skipped += 1
+            continue
+        knownHash = None if options.force else manifest.knownHash(filename, converter)
+        tasks.append((options.backend, file_path, filename, settings, knownHash))
+    if removed:
+        manifest.save()
+
+    width = len(str(len(tasks)))
+    results = []
+    start = time.perf_counter()
+    print(f"Converting {len(tasks)} files with {options.jobs} job(s), {options.backend} backend "
+          f"({skipped} unchanged since the last run)")
+    for done, result in enumerate(runConversions(tasks, options.jobs), 1):
+        results.append(result)
+        filename = result["file"]
+        if result["error"] is not None:
+            status = f"FAILED: {result['error']}"
+        elif result["unchanged"]:
+            manifest.touch(filename, stats[filename])
+            manifest.save()
+            status = "unchanged"
+        else:
+            manifest.record(filename, stats[filename], result["sha256"], converter, result["outputs"], result["features"])
+            manifest.save()
+            status = f"{result['features']:,} features"
+        print(f"[{done:>{width}}/{len(tasks)}] {filename}  {formatSeconds(result['seconds'])}  {status}", flush=True)
+    elapsed = time.perf_counter() - start
+
+    results += clashes
+    failures = [result for result in results if result["error"] is not None]
+    converted = [result for result in results if result["error"] is None and not result["unchanged"]]
+    unchanged = skipped + sum(result["unchanged"] for result in results)
+    print(f"\nConverted {len(converted)} of {len(filenames) + len(clashes)} files "
+          f"({sum(result['features'] for result in converted):,} features) in {formatSeconds(elapsed)}; "
+          f"{unchanged} unchanged")
+    if failures:
+        print(f"{len(failures)} file(s) failed:")
+        for result in failures:
+            print(f"  {result['file']}: {result['error']}")
+    tiles = cutTiles(options, manifest, converted) if options.tiles else []
+    if options.report:
+        report = {
+            "backend": options.backend,
+            "format": options.format,
+            "jobs": options.jobs,
+            "seconds": round(elapsed, 3),
+            "converted": len(converted),
+            "unchanged": unchanged,
+            "failed": len(failures),
+            "removed": removed,
+            "tiles": tiles,
+            "files": [{"file": result["file"], "features": result["features"], "seconds": round(result["seconds"], 3),
+                       "unchanged": result["unchanged"], "error": result["error"]} for result in results],
+        }
+        with open(options.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert every KML/KMZ file in a folder to GeoJSON")
+    parser.add_argument("--backend", choices=BACKENDS, default="arcpy",
+                        help="arcpy (KMLToLayer -> shapefile -> GeoJSON) or python (streaming, no arcpy)")
+    parser.add_argument("--input", default=KMLKMZ_FOLDER, help="folder with the .kml/.kmz files")
+    parser.add_argument("--output", default=GEOJSON_OUTPUT_DIR, help="folder for the output files")
+    parser.add_argument("--format", choices=WRITERS, default="geojson",
+                        help="geojson, geojsonseq (RFC 8142), ndjson or fgb (FlatGeobuf with a spatial index)")
+    parser.add_argument("--precision", type=int,
+                        help="round coordinates to this many decimal places (6 is about 10 cm)")
+    parser.add_argument("--index", action="store_true",
+                        help="also write a spatial index next to each output for LayerIndex queries (not for fgb)")
+    parser.add_argument("--tiles", help="also cut every output layer into a z/x/y tile pyramid under this folder")
+    parser.add_argument("--tile-format", choices=TILE_FORMATS, default="mvt",
+                        help="--tiles: mvt (Mapbox Vector Tiles, .pbf) or geojson (compact per-tile GeoJSON)")
+    parser.add_argument("--min-zoom", type=int, default=0, help="--tiles: lowest zoom level")
+    parser.add_argument("--max-zoom", type=int, default=14, help="--tiles: highest zoom level")
+    parser.add_argument("--scratch", default=SCRATCH_ROOT,
+                        help="arcpy backend: folder for the per-file scratch geodatabases and shapefiles")
+    parser.add_argument("--jobs", type=int, default=1, help="number of files converted (and tiles cut) in parallel")
+    parser.add_argument("--report", help="also write the per-file results and failures to this JSON file")
+    parser.add_argument("--force", action="store_true",
+                        help="convert every file, even those the manifest says are unchanged")
+    parser.add_argument("--keep-altitude", action="store_true",
+                        help="python backend: keep KML altitudes as a third coordinate")
+    options = parser.parse_args()
+    if options.backend == "arcpy" and arcpy is None:
+        parser.error("arcpy is not available; use --backend python")
+    if options.index and not WRITERS[options.format].indexable:
+        parser.error(f"--format {options.format} has a spatial index of its own; --index is for the JSON formats")
+
+    if not 0 <= options.min_zoom <= options.max_zoom <= 24:
+        parser.error("--min-zoom and --max-zoom need 0 <= min <= max <= 24")
+
+    failures = runBatch(options)
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Streaming KML/KMZ reader that needs no arcpy.
+
+readFeatures(path) yields one GeoJSON feature dict per Placemark. The KML is
+parsed incrementally with ElementTree.iterparse: each Placemark is turned
+into a feature as soon as its end tag is read and is then removed from the
+tree, so memory stays flat however many Placemarks a layer has. A .kmz is
+read in place from its zip archive (doc.kml, or else the first .kml in it)
+without being extracted.
+
+Feature properties are the Placemark's name, description and folder path
+(like the Name, PopupInfo and FolderPath fields of KMLToLayer), plus every
+ExtendedData Data/SimpleData value as a string.
+"""
+import os
+import zipfile
+import xml.etree.ElementTree as ET
+
+# KML containers whose <name> makes up a Placemark's folder path
+CONTAINERS = ("Document", "Folder")
+
+GEOMETRIES = ("Point", "LineString", "LinearRing", "Polygon", "MultiGeometry")
+
+# GeoJSON type of a MultiGeometry whose parts are all of one KML type
+MULTI_TYPES = {"Point": "MultiPoint", "LineString": "MultiLineString", "Polygon": "MultiPolygon"}
+
+
+# Local name of every namespaced tag seen so far, so each is only split once
+LOCAL_NAMES = {}
+
+
+def localName(tag):
+    """Tag without its namespace, e.g. '{http://www.opengis.net/kml/2.2}Point' -> 'Point'."""
+    name = LOCAL_NAMES.get(tag)
+    if name is None:
+        name = LOCAL_NAMES[tag] = tag.rpartition("}")[2]
+    return name
+
+
+def openKml(path):
+    """Opens a .kml file, or the KML document inside a .kmz, as a binary stream."""
+    if not zipfile.is_zipfile(path):
+        return open(path, "rb")
+    archive = zipfile.ZipFile(path)
+    names = [name for name in archive.namelist() if name.lower().endswith(".kml")]
+    if not names:
+        archive.close()
+        raise ValueError(f"No KML document found in {path}")
+    name = "doc.kml" if "doc.kml" in names else names[0]
+    # The member stays readable after the archive object is closed
+    stream = archive.open(name)
+    archive.close()
+    return stream
+
+
+def parseCoordinates(text, keepAltitude=False):
+    """Turns a KML <coordinates> string ('lon,lat[,alt] ...') into GeoJSON positions."""
+    positions = []
+    size = 3 if keepAltitude else 2
+    for item in (text or "").split():
+        values = item.split(",")
+        positions.append([float(value) for value in values[:size]])
+    return positions
+
+
+def childrenNamed(element, name):
+    return [child for child in element if localName(child.tag) == name]
+
+
+def ringCoordinates(boundary, keepAltitude):
+    """Positions of the LinearRing inside an outerBoundaryIs/innerBoundaryIs element."""
+    for ring in boundary.iter():
+        if localName(ring.tag) == "coordinates":
+            return parseCoordinates(ring.text, keepAltitude)
+    return []
+
+
+def parseGeometry(element, keepAltitude=False):
+    """GeoJSON geometry dict for a KML geometry element, or None if it holds no coordinates."""
+    kind = localName(element.tag)
+    if kind == "MultiGeometry":
+        parts = [(localName(child.tag), parseGeometry(child, keepAltitude))
+                 for child in element if localName(child.tag) in GEOMETRIES]
+        parts = [(partKind, geometry) for partKind, geometry in parts if geometry is not None]
+        if not parts:
+            return None
+        kinds = {partKind for partKind, _ in parts}
+        if len(kinds) == 1 and next(iter(kinds)) in MULTI_TYPES:
+            return {"type": MULTI_TYPES[kinds.pop()], "coordinates": [geometry["coordinates"] for _, geometry in parts]}
+        return {"type": "GeometryCollection", "geometries": [geometry for _, geometry in parts]}
+    if kind == "Polygon":
+        rings = []
+        for child in element:
+            childKind = localName(child.tag)
+            if childKind == "outerBoundaryIs":
+                rings.insert(0, ringCoordinates(child, keepAltitude))
+            elif childKind == "innerBoundaryIs":
+                rings.append(ringCoordinates(child, keepAltitude))
+        if not rings or not rings[0]:
+            return None
+        return {"type": "Polygon", "coordinates": rings}
+    coordinates = childrenNamed(element, "coordinates")
+    if not coordinates:
+        return None
+    positions = parseCoordinates(coordinates[0].text, keepAltitude)
+    if not positions:
+        return None
+    if kind == "Point":
+        return {"type": "Point", "coordinates": positions[0]}
+    if kind == "LinearRing":
+        return {"type": "Polygon", "coordinates": [positions]}
+    return {"type": "LineString", "coordinates": positions}
+
+
+def placemarkFeature(placemark, folderPath, keepAltitude=False):
+    """GeoJSON feature dict for a complete Placemark element."""
+    properties = {"name": None, "description": None, "folderPath": folderPath}
+    geometry = None
+    for child in placemark:
+        kind = localName(child.tag)
+        if kind == "name" or kind == "description":
+            properties[kind] = (child.text or "").strip()
+        elif kind in GEOMETRIES:
+            geometry = parseGeometry(child, keepAltitude)
+        elif kind == "ExtendedData":
+            for data in child.iter():
+                dataKind = localName(data.tag)
+                if dataKind == "Data":
+                    values = childrenNamed(data, "value")
+                    properties[data.get("name")] = values[0].text if values else None
+                elif dataKind == "SimpleData":
+                    properties[data.get("name")] = data.text
+    return {"type": "Feature", "geometry": geometry, "properties": properties}
+
+
+def readFeatures(path, keepAltitude=False):
+    """Yields a GeoJSON feature dict for every Placemark in the .kml or .kmz at path, in file order."""
+    localNames = LOCAL_NAMES
+    with openKml(path) as stream:
+        # The root and the open containers, innermost last: a Placemark's
+        # parent is always stack[-1]. folders holds the containers' names,
+        # depths their depth in the document, to tell their own <name> from
+        # that of an overlay or link inside them.
+        stack = []
+        folders = []
+        depths = []
+        depth = 0
+        folderPath = ""
+        inPlacemark = False
+        for event, element in ET.iterparse(stream, events=("start", "end")):
+            kind = localNames.get(element.tag) or localName(element.tag)
+            if event == "start":
+                depth += 1
+                if kind == "Placemark":
+                    inPlacemark = True
+                elif kind in CONTAINERS or not stack:
+                    stack.append(element)
+                    folders.append(None)
+                    depths.append(depth)
+                continue
+            depth -= 1
+            if kind == "Placemark":
+                inPlacemark = False
+                yield placemarkFeature(element, folderPath, keepAltitude)
+                # Drop the finished Placemark so the tree never grows with the file
+                element.clear()
+                stack[-1].remove(element)
+            elif kind in CONTAINERS:
+                stack.pop()
+                folders.pop()
+                depths.pop()
+                folderPath = "/".join(name for name in folders if name)
+                # A container that is the root (a <Document> without <kml>) has no parent
+                if stack:
+                    stack[-1].remove(element)
+            elif kind == "name" and not inPlacemark and folders[-1] is None and depth == depths[-1]:
+                folders[-1] = (element.text or "").strip()
+                folderPath = "/".join(name for name in folders if name)
+
+
+def layerName(path):
+    """Output name for an input file: its name without the .kml/.kmz extension."""
+    return os.path.splitext(os.path.basename(path))[0]
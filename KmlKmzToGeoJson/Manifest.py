@@ -0,0 +1,115 @@
+"""
+Manifest of the inputs a batch run converted, for incremental runs.
+
+For every input file the manifest records its size, mtime and SHA-256, the
+converter version that produced its outputs, and the output files. A run
+skips an input whose size and mtime are unchanged without reading it; if
+only the mtime moved (e.g. the file was copied again), the content hash
+decides. Inputs are only reconverted when their content or the converter
+changed, or an output went missing. Outputs of inputs that disappeared from
+the input folder are deleted.
+
+The manifest is rewritten (atomically) after every converted file, so a run
+that fails half way keeps the work it finished.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+from FeatureWriters import defaultMode
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+# Bytes read at a time while hashing an input
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def fileHash(path):
+    """Hex SHA-256 of the file at path."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                return digest.hexdigest()
+            digest.update(chunk)
+
+
+class Manifest:
+    """The manifest file in an output folder. Outputs are stored relative to that folder."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self.entries = data["files"]
+
+    def _current(self, filename, converter):
+        """The entry of filename if it was made by converter and all its outputs still exist."""
+        entry = self.entries.get(filename)
+        if entry is None or entry["converter"] != converter:
+            return None
+        if not all(os.path.exists(os.path.join(self.folder, output)) for output in entry["outputs"]):
+            return None
+        return entry
+
+    def isUnchanged(self, filename, stat, converter):
+        """True if filename has the size and mtime it had when converter converted it."""
+        entry = self._current(filename, converter)
+        return entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+
+    def knownHash(self, filename, converter):
+        """SHA-256 of filename when converter last converted it, or None if it needs converting anyway."""
+        entry = self._current(filename, converter)
+        return entry["sha256"] if entry is not None else None
+
+    def touch(self, filename, stat):
+        """Records the new size and mtime of an input whose content turned out unchanged."""
+        entry = self.entries[filename]
+        entry["size"], entry["mtime_ns"] = stat.st_size, stat.st_mtime_ns
+
+    def record(self, filename, stat, digest, converter, outputs, features):
+        """
+        Records a successful conversion and deletes the outputs the previous
+        conversion of the file made that this one did not.
+        """
+        outputs = sorted(os.path.relpath(output, self.folder) for output in outputs)
+        old = self.entries.get(filename)
+        if old is not None:
+            self._delete(set(old["outputs"]) - set(outputs))
+        self.entries[filename] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": digest,
+            "converter": converter,
+            "outputs": outputs,
+            "features": features,
+        }
+
+    def collectGarbage(self, present):
+        """Deletes the outputs of inputs not in present and forgets them. Returns the inputs dropped."""
+        gone = [filename for filename in self.entries if filename not in present]
+        for filename in gone:
+            self._delete(self.entries.pop(filename)["outputs"])
+        return gone
+
+    def _delete(self, outputs):
+        for output in outputs:
+            try:
+                os.unlink(os.path.join(self.folder, output))
+            except FileNotFoundError:
+                pass
+
+    def save(self):
+        """Writes the manifest to a temporary file and moves it into place."""
+        fd, tempPath = tempfile.mkstemp(prefix="temp-", suffix=".json", dir=self.folder)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "files": self.entries}, f, indent=1, sort_keys=True)
+        os.chmod(tempPath, defaultMode())
+        os.replace(tempPath, self.path)
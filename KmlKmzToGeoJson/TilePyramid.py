@@ -0,0 +1,665 @@
+"""
+Cuts a converted layer into a z/x/y tile pyramid for web maps.
+
+Every feature is projected to Web Mercator once. For every zoom from
+minZoom to maxZoom, each tile its bounding box touches gets the feature:
+  - simplified with Douglas-Peucker at a tolerance of `tolerance` tile pixels
+    at that zoom, so low zooms carry far fewer vertices,
+  - clipped to the tile plus a `buffer` pixel margin, so lines and polygon
+    edges join up across tile borders,
+  - quantized to integer tile coordinates (0..extent).
+Tiles are written as Mapbox Vector Tiles (z/x/y.pbf, version 2, one layer
+named after the input) or as compact GeoJSON (z/x/y.geojson, longitude and
+latitude rounded to what a tile pixel can show). Tiles are cut across a
+process pool, a batch of tiles per task.
+
+Incremental mode keeps tiles.json in the pyramid folder, holding a hash
+and the bounding box of every feature. On the next run only the tiles
+touched by features that were added, removed or changed, at their old or
+new place, are rebuilt, and tiles left empty are deleted. A change of
+options, or a missing state file, rebuilds everything.
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import shutil
+import struct
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import FlatGeobuf
+from FeatureWriters import ENCODER, defaultMode
+from KmlReader import layerName
+
+STATE_NAME = "tiles.json"
+STATE_VERSION = 1
+
+TILE_FORMATS = {"mvt": ".pbf", "geojson": ".geojson"}
+
+DEFAULT_SETTINGS = {"format": "mvt", "minZoom": 0, "maxZoom": 14, "extent": 4096, "buffer": 64, "tolerance": 3}
+
+# Latitude where Web Mercator turns the world into a square
+MAX_LATITUDE = 85.0511287798
+
+# Tiles cut per pool task
+TILES_PER_TASK = 256
+
+# Below this many tiles, starting a pool costs more than it saves
+MIN_POOL_TILES = 512
+
+POINT, LINE, POLYGON = 1, 2, 3
+
+
+def readLayer(path):
+    """Yields the features of a converted layer: .geojson, .geojsons, .ndjson or .fgb."""
+    if path.endswith(".fgb"):
+        yield from FlatGeobuf.readFeatures(path)
+        return
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".geojson"):
+            yield from json.load(f)["features"]
+            return
+        for line in f:
+            line = line.lstrip("\x1e")
+            if line.strip():
+                yield json.loads(line)
+
+
+def project(x, y):
+    """Longitude and latitude to Web Mercator, the world being 0..1 with y down."""
+    sin = math.sin(math.radians(max(-MAX_LATITUDE, min(MAX_LATITUDE, y))))
+    return (x + 180) / 360, 0.5 - math.log((1 + sin) / (1 - sin)) / (4 * math.pi)
+
+
+def unproject(x, y):
+    """Web Mercator 0..1 back to longitude and latitude."""
+    return x * 360 - 180, math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+
+
+def projectLine(coordinates):
+    """A list of positions as a flat [x0, y0, x1, y1, ...] list in Web Mercator."""
+    flat = []
+    for position in coordinates:
+        flat.extend(project(position[0], position[1]))
+    return flat
+
+
+def projectGeometry(geometry):
+    """
+    A GeoJSON geometry as a list of (kind, parts) in Web Mercator: POINT
+    parts are one flat list of points, LINE parts are flat lines, and
+    POLYGON parts are polygons, each a list of flat rings (exterior first).
+    """
+    kind = geometry["type"]
+    coordinates = geometry.get("coordinates")
+    if kind == "GeometryCollection":
+        return [part for child in geometry["geometries"] for part in projectGeometry(child)]
+    if kind == "Point":
+        return [(POINT, [projectLine([coordinates])])]
+    if kind == "MultiPoint":
+        return [(POINT, [projectLine(coordinates)])]
+    if kind == "LineString":
+        return [(LINE, [projectLine(coordinates)])]
+    if kind == "MultiLineString":
+        return [(LINE, [projectLine(line) for line in coordinates])]
+    if kind == "Polygon":
+        return [(POLYGON, [[projectLine(ring) for ring in coordinates]])]
+    return [(POLYGON, [[projectLine(ring) for ring in polygon] for polygon in coordinates])]
+
+
+def partsBounds(geometries):
+    """(minX, minY, maxX, maxY) of projected geometries."""
+    xs = []
+    ys = []
+    for kind, parts in geometries:
+        lines = [ring for polygon in parts for ring in polygon] if kind == POLYGON else parts
+        for flat in lines:
+            xs.extend(flat[0::2])
+            ys.extend(flat[1::2])
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def featureHash(feature):
+    return hashlib.blake2b(ENCODER.encode(feature).encode("utf-8"), digest_size=10).hexdigest()
+
+
+def prepareFeatures(path):
+    """
+    Reads and projects every feature of a layer. Returns the features as
+    (properties, geometries, bounds) and their hashes.
+    """
+    features = []
+    hashes = []
+    for feature in readLayer(path):
+        if feature["geometry"] is None:
+            continue
+        geometries = projectGeometry(feature["geometry"])
+        geometries = [(kind, parts) for kind, parts in geometries if any(parts)]
+        if not geometries:
+            continue
+        features.append((feature["properties"], geometries, partsBounds(geometries)))
+        hashes.append(featureHash(feature))
+    return features, hashes
+
+
+def tileRange(bounds, zoom, margin):
+    """(x0, y0, x1, y1) of the tiles at zoom that bounds, widened by margin (world units), touch."""
+    scale = 1 << zoom
+    last = scale - 1
+    minX, minY, maxX, maxY = bounds
+    return (max(0, min(last, int((minX - margin) * scale))), max(0, min(last, int((minY - margin) * scale))),
+            max(0, min(last, int((maxX + margin) * scale))), max(0, min(last, int((maxY + margin) * scale))))
+
+
+def simplify(flat, sqTolerance):
+    """Douglas-Peucker on a flat line: the points to keep, first and last always."""
+    count = len(flat) // 2
+    if count <= 2:
+        return flat
+    keep = bytearray(count)
+    keep[0] = keep[-1] = 1
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay, bx, by = flat[2 * first], flat[2 * first + 1], flat[2 * last], flat[2 * last + 1]
+        dx, dy = bx - ax, by - ay
+        length = dx * dx + dy * dy
+        farthest = -1
+        maxSq = sqTolerance
+        for i in range(first + 1, last):
+            px, py = flat[2 * i], flat[2 * i + 1]
+            if length:
+                t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length))
+                ex, ey = px - ax - t * dx, py - ay - t * dy
+            else:
+                ex, ey = px - ax, py - ay
+            sq = ex * ex + ey * ey
+            if sq > maxSq:
+                farthest = i
+                maxSq = sq
+        if farthest >= 0:
+            keep[farthest] = 1
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [value for i in range(count) if keep[i] for value in (flat[2 * i], flat[2 * i + 1])]
+
+
+def simplifyGeometries(geometries, sqTolerance):
+    """Simplified projected geometries; lines under 2 points and rings under 4 are dropped."""
+    simplified = []
+    for kind, parts in geometries:
+        if kind == POINT:
+            simplified.append((kind, parts))
+        elif kind == LINE:
+            lines = [line for line in (simplify(flat, sqTolerance) for flat in parts) if len(line) >= 4]
+            if lines:
+                simplified.append((kind, lines))
+        else:
+            polygons = []
+            for polygon in parts:
+                rings = [simplify(ring, sqTolerance) for ring in polygon]
+                if len(rings[0]) >= 8:
+                    polygons.append([rings[0]] + [ring for ring in rings[1:] if len(ring) >= 8])
+            if polygons:
+                simplified.append((kind, polygons))
+    return simplified
+
+
+def intersect(out, ax, ay, bx, by, k, axis):
+    """Appends the point where segment a-b crosses coordinate k on axis."""
+    if axis == 0:
+        out += (k, ay + (by - ay) * (k - ax) / (bx - ax))
+    else:
+        out += (ax + (bx - ax) * (k - ay) / (by - ay), k)
+
+
+def clipLine(flat, k1, k2, axis, ring):
+    """
+    The parts of a flat line between k1 and k2 on axis (x 0, y 1), as a
+    list of flat lines. A ring is clipped as one closed ring instead of
+    being split.
+    """
+    parts = []
+    part = []
+    for i in range(0, len(flat) - 2, 2):
+        ax, ay, bx, by = flat[i], flat[i + 1], flat[i + 2], flat[i + 3]
+        a = flat[i + axis]
+        b = flat[i + 2 + axis]
+        exited = False
+        if a < k1:
+            if b > k1:
+                intersect(part, ax, ay, bx, by, k1, axis)
+        elif a > k2:
+            if b < k2:
+                intersect(part, ax, ay, bx, by, k2, axis)
+        else:
+            part += (ax, ay)
+        if b < k1 <= a:
+            intersect(part, ax, ay, bx, by, k1, axis)
+            exited = True
+        if b > k2 >= a:
+            intersect(part, ax, ay, bx, by, k2, axis)
+            exited = True
+        if exited and not ring:
+            parts.append(part)
+            part = []
+    if flat and k1 <= flat[-2 + axis] <= k2:
+        part += (flat[-2], flat[-1])
+    if ring and len(part) >= 6 and (part[-2] != part[0] or part[-1] != part[1]):
+        part += (part[0], part[1])
+    if part:
+        parts.append(part)
+    return [part for part in parts if len(part) >= (8 if ring else 4)]
+
+
+def clipGeometries(geometries, minX, minY, maxX, maxY):
+    """Projected geometries clipped to a box; parts outside it are dropped."""
+    clipped = []
+    for kind, parts in geometries:
+        if kind == POINT:
+            flat = parts[0]
+            if len(flat) == 2:
+                if minX <= flat[0] <= maxX and minY <= flat[1] <= maxY:
+                    clipped.append((kind, parts))
+                continue
+            inside = [value for i in range(0, len(flat), 2)
+                      if minX <= flat[i] <= maxX and minY <= flat[i + 1] <= maxY
+                      for value in (flat[i], flat[i + 1])]
+            if inside:
+                clipped.append((kind, [inside]))
+        elif kind == LINE:
+            lines = [across for flat in parts for along in clipLine(flat, minX, maxX, 0, False)
+                     for across in clipLine(along, minY, maxY, 1, False)]
+            if lines:
+                clipped.append((kind, lines))
+        else:
+            polygons = []
+            for polygon in parts:
+                rings = []
+                for ring in polygon:
+                    ring = [across for along in clipLine(ring, minX, maxX, 0, True)
+                            for across in clipLine(along, minY, maxY, 1, True)]
+                    if ring:
+                        rings.append(ring[0])
+                    elif not rings:
+                        # The exterior is gone, and its holes with it
+                        break
+                if rings:
+                    polygons.append(rings)
+            if polygons:
+                clipped.append((kind, polygons))
+    return clipped
+
+
+def quantize(flat, scale, tileX, tileY, extent):
+    """A flat line in tile coordinates, without repeated points."""
+    points = []
+    for i in range(0, len(flat), 2):
+        point = (round((flat[i] * scale - tileX) * extent), round((flat[i + 1] * scale - tileY) * extent))
+        if not points or point != points[-1]:
+            points.append(point)
+    return points
+
+
+def ringArea(points):
+    """Twice the signed area of a ring; positive if clockwise in tile coordinates (y down)."""
+    return sum(ax * by - bx * ay for (ax, ay), (bx, by) in zip(points, points[1:] + points[:1]))
+
+
+def varint(value, out):
+    if value < 0x80:
+        out.append(value)
+        return
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def zigzag(value):
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def field(number, data, out):
+    """Appends a length-delimited protobuf field."""
+    varint(number << 3 | 2, out)
+    varint(len(data), out)
+    out += data
+
+
+def packed(values):
+    out = bytearray()
+    for value in values:
+        varint(value, out)
+    return out
+
+
+def geometryCommands(kind, parts, scale, tileX, tileY, extent):
+    """The MVT command integers of one feature's parts, or None if nothing is left once quantized."""
+    commands = []
+    cursor = [0, 0]
+
+    def moveTo(points, command):
+        commands.append(command | len(points) << 3)
+        for x, y in points:
+            commands.append(zigzag(x - cursor[0]))
+            commands.append(zigzag(y - cursor[1]))
+            cursor[:] = x, y
+
+    if kind == POINT:
+        points = quantize(parts[0], scale, tileX, tileY, extent)
+        moveTo(points, 1)
+        return commands
+    if kind == LINE:
+        for flat in parts:
+            points = quantize(flat, scale, tileX, tileY, extent)
+            if len(points) >= 2:
+                moveTo(points[:1], 1)
+                moveTo(points[1:], 2)
+        return commands or None
+    for polygon in parts:
+        for ringNumber, flat in enumerate(polygon):
+            points = quantize(flat, scale, tileX, tileY, extent)[:-1]
+            area = ringArea(points) if len(points) >= 3 else 0
+            if not area:
+                if ringNumber == 0:
+                    break
+                continue
+            # Exterior rings clockwise, holes counter-clockwise
+            if (area > 0) != (ringNumber == 0):
+                points.reverse()
+            moveTo(points[:1], 1)
+            moveTo(points[1:], 2)
+            commands.append(7 | 1 << 3)
+    return commands or None
+
+
+def encodeValue(value):
+    """An MVT Value message."""
+    out = bytearray()
+    if isinstance(value, bool):
+        out += bytes((7 << 3, int(value)))
+    elif isinstance(value, int) and value >= 0:
+        varint(5 << 3, out)
+        varint(value, out)
+    elif isinstance(value, int):
+        varint(6 << 3, out)
+        varint(zigzag(value), out)
+    elif isinstance(value, float):
+        out += b"\x19" + struct.pack("<d", value)
+    else:
+        field(1, (value if isinstance(value, str) else ENCODER.encode(value)).encode("utf-8"), out)
+    return bytes(out)
+
+
+def encodeProperties(properties):
+    """(key, encoded Value) of the properties that are not null, done once per feature and worker."""
+    return [(key, encodeValue(value)) for key, value in properties.items() if value is not None]
+
+
+def encodeMvt(name, tileFeatures, settings, scale, tileX, tileY):
+    """
+    An MVT tile with one layer holding tileFeatures ((encodeProperties()
+    pairs, geometries)), or None if it is empty.
+    """
+    extent = settings["extent"]
+    keys = {}
+    values = {}
+    features = bytearray()
+    for properties, geometries in tileFeatures:
+        tags = []
+        for key, encoded in properties:
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault(encoded, len(values)))
+        for kind, parts in geometries:
+            commands = geometryCommands(kind, parts, scale, tileX, tileY, extent)
+            if commands is None:
+                continue
+            feature = bytearray()
+            field(2, packed(tags), feature)
+            feature += bytes((3 << 3, kind))
+            field(4, packed(commands), feature)
+            field(2, feature, features)
+    if not features:
+        return None
+    layer = bytearray(b"\x78\x02")  # version 2
+    field(1, name.encode("utf-8"), layer)
+    layer += features
+    for key in keys:
+        field(3, key.encode("utf-8"), layer)
+    for value in values:
+        field(4, value, layer)
+    varint(5 << 3, layer)
+    varint(extent, layer)
+    tile = bytearray()
+    field(3, layer, tile)
+    return tile
+
+
+def unprojectLine(flat, digits):
+    return [[round(value, digits) for value in unproject(flat[i], flat[i + 1])] for i in range(0, len(flat), 2)]
+
+
+def encodeGeoJson(name, tileFeatures, settings, scale, tileX, tileY):
+    """A GeoJSON FeatureCollection of tileFeatures in longitude and latitude, or None if it is empty."""
+    # Decimals that still tell tile pixels apart at this zoom
+    digits = max(0, math.ceil(math.log10(scale * settings["extent"] / 360)))
+    features = []
+    for properties, geometries in tileFeatures:
+        for kind, parts in geometries:
+            if kind == POINT:
+                points = unprojectLine(parts[0], digits)
+                geometry = {"type": "Point", "coordinates": points[0]} if len(points) == 1 else \
+                    {"type": "MultiPoint", "coordinates": points}
+            elif kind == LINE:
+                lines = [unprojectLine(flat, digits) for flat in parts]
+                geometry = {"type": "LineString", "coordinates": lines[0]} if len(lines) == 1 else \
+                    {"type": "MultiLineString", "coordinates": lines}
+            else:
+                polygons = [[unprojectLine(ring, digits) for ring in polygon] for polygon in parts]
+                geometry = {"type": "Polygon", "coordinates": polygons[0]} if len(polygons) == 1 else \
+                    {"type": "MultiPolygon", "coordinates": polygons}
+            features.append({"type": "Feature", "geometry": geometry, "properties": properties})
+    if not features:
+        return None
+    return ENCODER.encode({"type": "FeatureCollection", "name": name, "features": features}).encode("utf-8")
+
+
+# Tile format: (properties preparation, or None to use them as they are, tile encoder)
+ENCODERS = {"mvt": (encodeProperties, encodeMvt), "geojson": (None, encodeGeoJson)}
+
+
+def writeTile(path, data):
+    """Writes a tile through a temporary file, so a map never reads half of one."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tempPath = tempfile.mkstemp(prefix="temp-", dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.chmod(tempPath, defaultMode())
+    os.replace(tempPath, path)
+
+
+# The layer being cut, in every worker process
+LAYER = {}
+
+
+def loadLayer(features, name, folder, settings):
+    """Pool initializer: hands the prepared features and settings to the worker."""
+    LAYER.update(features=features, name=name, folder=folder, settings=settings, prepared={})
+
+
+def buildTiles(task):
+    """
+    Cuts, encodes and writes the tiles of one zoom in task (zoom,
+    [(x, y, feature numbers)]); a tile left with no features is deleted.
+    Returns (tiles written, bytes written, tiles deleted).
+    """
+    zoom, tiles = task
+    features, name, folder, settings = LAYER["features"], LAYER["name"], LAYER["folder"], LAYER["settings"]
+    scale = 1 << zoom
+    extent = settings["extent"]
+    sqTolerance = (settings["tolerance"] / (scale * extent)) ** 2
+    margin = settings["buffer"] / extent / scale
+    prepare, encode = ENCODERS[settings["format"]]
+    prepared = LAYER["prepared"]
+    extension = TILE_FORMATS[settings["format"]]
+    # Features spanning several tiles of the task are simplified once
+    simplified = {}
+    written = size = deleted = 0
+    for x, y, numbers in tiles:
+        minX, minY = x / scale - margin, y / scale - margin
+        maxX, maxY = (x + 1) / scale + margin, (y + 1) / scale + margin
+        tileFeatures = []
+        for number in numbers:
+            properties, geometries, _ = features[number]
+            if number not in simplified:
+                simplified[number] = simplifyGeometries(geometries, sqTolerance)
+            clipped = clipGeometries(simplified[number], minX, minY, maxX, maxY)
+            if not clipped:
+                continue
+            if prepare is not None:
+                if number not in prepared:
+                    prepared[number] = prepare(properties)
+                properties = prepared[number]
+            tileFeatures.append((properties, clipped))
+        path = os.path.join(folder, str(zoom), str(x), str(y) + extension)
+        data = encode(name, tileFeatures, settings, scale, x, y) if tileFeatures else None
+        if data is not None:
+            writeTile(path, data)
+            written += 1
+            size += len(data)
+        elif os.path.exists(path):
+            os.unlink(path)
+            deleted += 1
+    return written, size, deleted
+
+
+def loadState(folder, settings):
+    """Feature hash -> [count, bounds] from the last run, or None if it must be rebuilt in full."""
+    try:
+        with open(os.path.join(folder, STATE_NAME), encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get("version") != STATE_VERSION or state.get("settings") != settings:
+        return None
+    return {key: (count, tuple(bounds)) for key, (count, bounds) in state["features"].items()}
+
+
+def isCurrent(folder, settings=None):
+    """True if folder holds a pyramid cut with these settings, whatever its layer holds now."""
+    return loadState(folder, dict(DEFAULT_SETTINGS, **(settings or {}))) is not None
+
+
+def saveState(folder, settings, features, hashes):
+    state = {}
+    for (_, _, bounds), key in zip(features, hashes):
+        count = state[key][0] + 1 if key in state else 1
+        state[key] = (count, bounds)
+    fd, tempPath = tempfile.mkstemp(prefix="temp-", suffix=".json", dir=folder)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump({"version": STATE_VERSION, "settings": settings, "features": state}, f, separators=(",", ":"))
+    os.chmod(tempPath, defaultMode())
+    os.replace(tempPath, os.path.join(folder, STATE_NAME))
+
+
+def dirtyTiles(oldState, features, hashes, settings):
+    """Per zoom, the tiles touched by features that were added, removed or changed, at their old or new place."""
+    counts = {}
+    for key in hashes:
+        counts[key] = counts.get(key, 0) + 1
+    changed = [bounds for key, (count, bounds) in oldState.items() if counts.get(key) != count]
+    changed += [bounds for (_, _, bounds), key in zip(features, hashes)
+                if key not in oldState or oldState[key][0] != counts[key]]
+    dirty = {}
+    for zoom in range(settings["minZoom"], settings["maxZoom"] + 1):
+        margin = settings["buffer"] / settings["extent"] / (1 << zoom)
+        tiles = dirty[zoom] = set()
+        for bounds in changed:
+            x0, y0, x1, y1 = tileRange(bounds, zoom, margin)
+            tiles.update((x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1))
+    return dirty
+
+
+def buildPyramid(path, folder, settings=None, jobs=1, incremental=True):
+    """
+    Cuts the layer at path into tiles under folder, rebuilding only the
+    tiles that changed when incremental and a matching state file exists.
+    Returns a dict of counts for the summary.
+    """
+    settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+    start = time.perf_counter()
+    features, hashes = prepareFeatures(path)
+    oldState = loadState(folder, settings) if incremental else None
+    if oldState is None:
+        shutil.rmtree(folder, ignore_errors=True)
+        dirty = None
+    else:
+        dirty = dirtyTiles(oldState, features, hashes, settings)
+    os.makedirs(folder, exist_ok=True)
+
+    tasks = []
+    tileCount = 0
+    for zoom in range(settings["minZoom"], settings["maxZoom"] + 1):
+        margin = settings["buffer"] / settings["extent"] / (1 << zoom)
+        buckets = {tile: [] for tile in dirty[zoom]} if dirty is not None else {}
+        for number, (_, _, bounds) in enumerate(features):
+            x0, y0, x1, y1 = tileRange(bounds, zoom, margin)
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    if dirty is None:
+                        buckets.setdefault((x, y), []).append(number)
+                    elif (x, y) in buckets:
+                        buckets[x, y].append(number)
+        tiles = sorted((x, y, numbers) for (x, y), numbers in buckets.items())
+        tileCount += len(tiles)
+        tasks += [(zoom, tiles[i:i + TILES_PER_TASK]) for i in range(0, len(tiles), TILES_PER_TASK)]
+
+    layerArgs = (features, layerName(path), folder, settings)
+    if jobs <= 1 or tileCount < MIN_POOL_TILES:
+        loadLayer(*layerArgs)
+        results = [buildTiles(task) for task in tasks]
+        LAYER.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=loadLayer, initargs=layerArgs) as pool:
+            results = list(pool.map(buildTiles, tasks))
+    saveState(folder, settings, features, hashes)
+    return {
+        "features": len(features),
+        "tiles": tileCount,
+        "written": sum(written for written, _, _ in results),
+        "bytes": sum(size for _, size, _ in results),
+        "deleted": sum(deleted for _, _, deleted in results),
+        "incremental": dirty is not None,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cut a converted layer into a z/x/y tile pyramid")
+    parser.add_argument("layer", help=".geojson, .geojsons, .ndjson or .fgb file")
+    parser.add_argument("folder", help="folder for the z/x/y tiles")
+    parser.add_argument("--format", choices=TILE_FORMATS, default=DEFAULT_SETTINGS["format"])
+    parser.add_argument("--min-zoom", type=int, default=DEFAULT_SETTINGS["minZoom"])
+    parser.add_argument("--max-zoom", type=int, default=DEFAULT_SETTINGS["maxZoom"])
+    parser.add_argument("--extent", type=int, default=DEFAULT_SETTINGS["extent"], help="tile coordinates per side")
+    parser.add_argument("--buffer", type=int, default=DEFAULT_SETTINGS["buffer"], help="margin around tiles, in tile coordinates")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_SETTINGS["tolerance"],
+                        help="simplification tolerance, in tile coordinates")
+    parser.add_argument("--jobs", type=int, default=1, help="processes cutting tiles")
+    parser.add_argument("--full", action="store_true", help="rebuild every tile, not only the changed ones")
+    options = parser.parse_args()
+
+    settings = {"format": options.format, "minZoom": options.min_zoom, "maxZoom": options.max_zoom,
+                "extent": options.extent, "buffer": options.buffer, "tolerance": options.tolerance}
+    summary = buildPyramid(options.layer, options.folder, settings, options.jobs, not options.full)
+    print(f"{summary['features']:,} features: {summary['tiles']:,} tiles cut "
+          f"({'incremental' if summary['incremental'] else 'full'}), {summary['written']:,} written "
+          f"({summary['bytes']:,} bytes), {summary['deleted']:,} deleted in {summary['seconds']:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
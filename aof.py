@@ -0,0 +1,254 @@
+"""
+Append-only file (AOF) persistence.
+
+Every write command that succeeds is passed to AppendOnlyFile.feed() and
+added to a buffer in RESP form. flush() runs once per event loop iteration,
+before any reply is sent, and writes the whole batch with one write() call.
+How often the file is fsynced depends on appendfsync:
+
+- always: fsync after every such write, so no acknowledged write is lost.
+- everysec: a background thread fsyncs at most once a second, so the event
+  loop never waits for the disk.
+- no: leave it to the operating system.
+
+At startup load_aof() replays the file through RespParser. BGREWRITEAOF has
+a forked child write a compact file (one SET per key) while the server keeps
+appending to the old one. Writes that arrive in the meantime are also kept
+in a rewrite buffer and appended to the new file before it replaces the
+old one.
+"""
+import os
+import tempfile
+import threading
+import time
+
+from rdb import BackgroundSave, default_mode
+from resp import ProtocolError, RespParser, encode_command
+
+FSYNC_POLICIES = (b"always", b"everysec", b"no")
+
+# How much of the file load_aof() reads per chunk
+LOAD_CHUNK_SIZE = 1024 * 1024
+
+# How many bytes write_aof_base() buffers before each write() call
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+class AofError(Exception):
+    """Raised when the append-only file cannot be replayed."""
+
+
+def encode_key(key, value, expire_ms):
+    """The command that recreates one key, with its absolute expire time if it has one."""
+    if expire_ms is None:
+        return encode_command([b"SET", key, value])
+    return encode_command([b"SET", key, value, b"PXAT", str(expire_ms).encode()])
+
+
+def write_aof_base(path, database, expiry):
+    """
+    Writes the smallest AOF that recreates database and expiry at path.
+    Like write_rdb(), the file is fsynced and only replaces path once complete.
+    """
+    directory = os.path.dirname(path) or "."
+    fd, temp_path = tempfile.mkstemp(prefix="temp-", suffix=".aof", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            buf = bytearray()
+            for key, value in database.items():
+                buf += encode_key(key, value, expiry.get(key))
+                if len(buf) >= WRITE_BUFFER_SIZE:
+                    f.write(buf)
+                    buf.clear()
+            f.write(buf)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, default_mode())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+def load_aof(path, execute):
+    """
+    Replays the commands in the AOF at path by calling execute(args) for each
+    one and returns how many ran. The commands of a MULTI ... EXEC block run
+    once its EXEC is read. A command or transaction cut off at the end of the
+    file (e.g. by a crash during write()) is truncated away, as Redis does
+    with aof-load-truncated yes; anything else that does not parse is an
+    AofError.
+    """
+    parser = RespParser()
+    count = 0
+    offset = 0
+    multi = None
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(LOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            offset += len(chunk)
+            parser.feed(chunk)
+            try:
+                for args in parser.commands():
+                    if multi is not None:
+                        if args[0] == b"EXEC":
+                            for queued in multi:
+                                execute(queued)
+                            count += len(multi)
+                            multi = None
+                        else:
+                            multi.append(args)
+                    elif args[0] == b"MULTI":
+                        multi = []
+                    else:
+                        execute(args)
+                        count += 1
+            except ProtocolError as err:
+                raise AofError(f"Bad file format reading the append only file: {err}")
+    valid = offset - len(parser.buffer)
+    if multi is not None:
+        valid -= len(encode_command([b"MULTI"])) + sum(len(encode_command(args)) for args in multi)
+        print(f"AOF {path} ends with an incomplete transaction, truncating it to {valid} bytes")
+        os.truncate(path, valid)
+    elif parser.buffer:
+        print(f"AOF {path} ends with an incomplete command, truncating it to {valid} bytes")
+        os.truncate(path, valid)
+    return count
+
+
+class AppendOnlyFile:
+    """The open append-only file together with its write buffer and fsync state."""
+
+    def __init__(self, path, fsync_policy=b"everysec"):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"appendfsync must be one of always, everysec, no; got {fsync_policy!r}")
+        self.path = path
+        self.fsync_policy = fsync_policy
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.size = os.fstat(self.fd).st_size
+        self.base_size = self.size       # Size right after the last rewrite, for auto rewrites
+        self.buffer = bytearray()        # Commands fed since the last flush()
+        self.last_write_ok = True
+        self.unsynced = False            # Written but not yet handed to fsync
+        self.last_fsync = time.monotonic()
+        # Background rewrite state
+        self.rewrite = None              # BackgroundSave writing the new file, if any
+        self.rewrite_path = None
+        self.rewrite_buffer = None       # Commands fed since the rewrite started
+        self.last_rewrite_ok = True
+        # The fsync thread only touches self.fd under this lock, so it can be swapped safely
+        self.fd_lock = threading.Lock()
+        self.fsync_requested = threading.Event()
+        if fsync_policy == b"everysec":
+            threading.Thread(target=self._fsync_loop, daemon=True).start()
+
+    def feed(self, args):
+        """Queues one write command; it reaches the file on the next flush()."""
+        command = encode_command(args)
+        self.buffer += command
+        if self.rewrite_buffer is not None:
+            self.rewrite_buffer += command
+
+    def flush(self):
+        """Writes everything fed since the last call and fsyncs according to the policy."""
+        if self.buffer:
+            try:
+                while self.buffer:
+                    written = os.write(self.fd, self.buffer)
+                    del self.buffer[:written]
+                    self.size += written
+            except OSError as err:
+                # Keep the rest buffered and try again on the next iteration
+                if self.last_write_ok:
+                    print(f"Error writing to the AOF file: {err}")
+                self.last_write_ok = False
+                return
+            self.last_write_ok = True
+            self.unsynced = True
+            if self.fsync_policy == b"always":
+                os.fsync(self.fd)
+                self.unsynced = False
+        if self.unsynced and self.fsync_policy == b"everysec":
+            now = time.monotonic()
+            if now - self.last_fsync >= 1:
+                self.last_fsync = now
+                self.unsynced = False
+                self.fsync_requested.set()
+
+    def _fsync_loop(self):
+        """Background thread for everysec: fsyncs whenever flush() asks for it."""
+        while True:
+            self.fsync_requested.wait()
+            self.fsync_requested.clear()
+            with self.fd_lock:
+                if self.fd is None:
+                    return
+                try:
+                    os.fsync(self.fd)
+                except OSError as err:
+                    print(f"Error syncing the AOF file: {err}")
+
+    def start_rewrite(self, database, expiry):
+        """Starts a background rewrite unless one is already running."""
+        if self.rewrite is not None:
+            return False
+        directory = os.path.dirname(self.path) or "."
+        self.rewrite_path = os.path.join(directory, f"temp-rewriteaof-bg-{os.getpid()}.aof")
+        self.rewrite_buffer = bytearray()
+        self.rewrite = BackgroundSave(self.rewrite_path, database, expiry, write_aof_base)
+        return True
+
+    def rewrite_cron(self):
+        """
+        Finishes a background rewrite once its child is done.
+        Returns None while nothing finished, else whether the rewrite succeeded.
+        """
+        job = self.rewrite
+        if job is None:
+            return None
+        succeeded = job.poll()
+        if succeeded is None:
+            return None
+        self.rewrite = None
+        if succeeded:
+            succeeded = self._install_rewrite()
+        if not succeeded and os.path.exists(self.rewrite_path):
+            os.unlink(self.rewrite_path)
+        self.rewrite_buffer = None
+        self.last_rewrite_ok = succeeded
+        return succeeded
+
+    def _install_rewrite(self):
+        """Appends the writes made during the rewrite to the new file and switches to it."""
+        # Everything still buffered for the old file is also in rewrite_buffer
+        self.flush()
+        if self.buffer:
+            return False
+        try:
+            with open(self.rewrite_path, "ab") as f:
+                f.write(self.rewrite_buffer)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self.rewrite_path, self.path)
+            new_fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        except OSError as err:
+            print(f"Error installing the rewritten AOF file: {err}")
+            return False
+        with self.fd_lock:
+            old_fd, self.fd = self.fd, new_fd
+        os.close(old_fd)
+        self.size = self.base_size = os.fstat(new_fd).st_size
+        return True
+
+    def close(self):
+        """Writes what is buffered, fsyncs and closes the file."""
+        self.flush()
+        with self.fd_lock:
+            fd, self.fd = self.fd, None
+        # Wakes the fsync thread up so it sees fd is None and exits
+        self.fsync_requested.set()
+        os.fsync(fd)
+        os.close(fd)
@@ -0,0 +1,142 @@
+"""
+asyncio server core, selected with --engine asyncio.
+
+Runs the same command handlers as the selectors loop, but lets an
+asyncio.Protocol do the socket work: data_received() feeds the connection's
+RespParser and queues the replies. Once per loop iteration a ReplyQueue
+callback runs before_sleep() (which writes the AOF) and then sends each
+connection's replies with a single transport.write(), which buffers
+whatever the kernel does not take yet. The periodic server_cron() runs as
+a loop.call_later() timer. uvloop is used automatically when it is
+installed.
+"""
+import asyncio
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+from connection import client_stats
+from resp import ProtocolError, RespParser
+
+
+class ReplyQueue:
+    """Connections with replies to send, written once per loop iteration after before_sleep()."""
+
+    def __init__(self, loop, before_sleep):
+        self.loop = loop
+        self.before_sleep = before_sleep
+        self.protocols = set()
+        self.scheduled = False
+
+    def add(self, protocol):
+        """Marks protocol as having replies and makes sure a flush is scheduled."""
+        self.protocols.add(protocol)
+        if not self.scheduled:
+            self.scheduled = True
+            # Runs after every callback that is already ready in this iteration
+            self.loop.call_soon(self.flush)
+
+    def flush(self):
+        """Runs before_sleep() and sends the queued replies of every connection."""
+        self.scheduled = False
+        self.before_sleep()
+        protocols, self.protocols = self.protocols, set()
+        for protocol in protocols:
+            protocol.write_replies()
+
+
+class RespProtocol(asyncio.Protocol):
+    """One client connection. Passed to command handlers as the client."""
+
+    def __init__(self, handle_command, output_limit, reply_queue, on_close=None):
+        self.handle_command = handle_command
+        # Called with the protocol when the connection is lost, like Connection.on_close
+        self.on_close = on_close
+        self.output_limit = output_limit
+        self.reply_queue = reply_queue
+        self.parser = RespParser()
+        self.replies = []
+        # Set after a protocol error: send the queued replies, then hang up
+        self.close_after_write = False
+        self.transport = None
+        self.sock = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        # Lets handlers that look at client.sock (e.g. the slow log) work unchanged.
+        # asyncio and uvloop already turn on TCP_NODELAY for TCP transports.
+        self.sock = transport.get_extra_info("socket")
+        client_stats["connected_clients"] += 1
+        client_stats["total_connections_received"] += 1
+
+    def connection_lost(self, exc):
+        client_stats["connected_clients"] -= 1
+        if self.on_close is not None:
+            self.on_close(self)
+
+    def data_received(self, data):
+        """Runs every complete command in the buffer and queues the replies."""
+        if self.close_after_write:
+            return
+        self.parser.feed(data)
+        responses = []
+        try:
+            for args in self.parser.commands():
+                responses.append(self.handle_command(self, args))
+        except ProtocolError as err:
+            # Answer what was parsed, report the error and hang up like Redis does
+            responses.append(b'-ERR Protocol error: ' + str(err).encode() + b'\r\n')
+            self.close_after_write = True
+        if responses:
+            self.replies.append(b''.join(responses))
+            self.reply_queue.add(self)
+
+    def write_replies(self):
+        """Sends everything queued with one transport.write()."""
+        if self.transport.is_closing():
+            return
+        if self.replies:
+            self.transport.write(b''.join(self.replies))
+            self.replies.clear()
+        if self.close_after_write:
+            self.transport.close()
+        elif self.output_limit and self.transport.get_write_buffer_size() > self.output_limit:
+            print("Closing client over output buffer limit")
+            client_stats["client_output_buffer_limit_disconnections"] += 1
+            self.transport.abort()
+
+
+def new_event_loop():
+    """Returns a uvloop event loop when uvloop is installed, else a default one."""
+    if uvloop is not None:
+        return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+def run_server(host, port, handle_command, server_cron, before_sleep, cron_interval, output_limit,
+               on_close=None):
+    """Serves clients on host:port until interrupted. on_close(client) runs for every closed connection."""
+    loop = new_event_loop()
+    asyncio.set_event_loop(loop)
+    reply_queue = ReplyQueue(loop, before_sleep)
+
+    def cron():
+        server_cron()
+        # Also covers iterations without client writes, e.g. the everysec AOF fsync
+        before_sleep()
+        loop.call_later(cron_interval, cron)
+
+    server = loop.run_until_complete(loop.create_server(
+        lambda: RespProtocol(handle_command, output_limit, reply_queue, on_close), host, port, reuse_address=True
+    ))
+    engine = "uvloop" if uvloop is not None else "asyncio"
+    print(f"Server listening on {host}:{port} ({engine} engine)")
+    loop.call_later(cron_interval, cron)
+    try:
+        loop.run_forever()
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
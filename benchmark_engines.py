@@ -0,0 +1,38 @@
+"""
+Side-by-side benchmark of the selectors and asyncio server engines.
+
+Starts rdb_file_config.py once per engine and drives it with the same
+pipelined SET/GET mix as benchmark_workers.py, then prints the throughput of
+each. The asyncio row runs on uvloop when it is installed.
+Example: python benchmark_engines.py --clients 4 --pipeline 1
+"""
+import argparse
+
+from benchmark_workers import run_setup
+
+ENGINES = ("selectors", "asyncio")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the selectors and asyncio engines")
+    parser.add_argument("--clients", type=int, default=4, help="client connections")
+    parser.add_argument("--processes", type=int, default=4, help="client processes")
+    parser.add_argument("--pipeline", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=300000, help="requests per engine")
+    parser.add_argument("--keyspace", type=int, default=100000)
+    parser.add_argument("--set-ratio", type=float, default=0.5, help="share of SETs in the mix")
+    parser.add_argument("--value-size", type=int, default=32)
+    parser.add_argument("--port", type=int, default=6390)
+    options = parser.parse_args()
+
+    print(f"{'engine':>10} {'ops/sec':>12} {'relative':>9} {'p99 usec':>9}")
+    baseline = None
+    for engine in ENGINES:
+        result = run_setup(["--engine", engine], options)
+        rate = result["ops_per_sec"]
+        baseline = baseline or rate
+        print(f"{engine:>10} {rate:>12,.0f} {rate / baseline:>8.2f}x {result['latency_usec']['p99']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Pub/Sub fan-out benchmark.
+
+Starts rdb_file_config.py, connects N subscribers to one channel (or, with
+--patterns, to a pattern matching it) and publishes messages to it from one
+more connection, --pipeline PUBLISHes at a time, until every subscriber has
+received every message. Prints, for each subscriber count, the messages
+delivered per second end to end and the server-side cost of a PUBLISH
+from INFO commandstats, in total and per subscriber. The subscribers are
+read by this process, which competes with the server for the CPU.
+Example: python benchmark_pubsub.py --subscribers 10 100 1000 5000 --messages 2000
+"""
+import argparse
+import os
+import re
+import resource
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from benchmark_workers import wait_for_port
+from pubsub import MESSAGE_HEADER, PMESSAGE_HEADER
+from resp import encode_command, reply_end, resp_bulk_string
+
+CHANNEL = b"bench:invalidate"
+PATTERN = b"bench:*"
+
+
+def read_replies(sock, count):
+    """Blocks until count replies have arrived on sock and returns them."""
+    replies = []
+    buf = b""
+    while len(replies) < count:
+        end = reply_end(buf, 0)
+        if end < 0:
+            buf += sock.recv(65536)
+            continue
+        replies.append(buf[:end])
+        buf = buf[end:]
+    return replies
+
+
+def publish_stats(sock):
+    """(calls, usec) of PUBLISH so far, from INFO commandstats."""
+    sock.sendall(encode_command([b"INFO", b"commandstats"]))
+    match = re.search(rb"cmdstat_publish:calls=(\d+),usec=(\d+)", read_replies(sock, 1)[0])
+    return (int(match.group(1)), int(match.group(2))) if match else (0, 0)
+
+
+def run_fanout(port, subscribers, messages, pipeline, message_size, patterns):
+    """Publishes messages to subscribers connections and returns (seconds, PUBLISH usec per call)."""
+    message = b"m" * message_size
+    if patterns:
+        frame = PMESSAGE_HEADER + resp_bulk_string(PATTERN) + resp_bulk_string(CHANNEL) + resp_bulk_string(message)
+        subscribe = encode_command([b"PSUBSCRIBE", PATTERN])
+    else:
+        frame = MESSAGE_HEADER + resp_bulk_string(CHANNEL) + resp_bulk_string(message)
+        subscribe = encode_command([b"SUBSCRIBE", CHANNEL])
+    expected = len(frame) * messages
+
+    sel = selectors.DefaultSelector()
+    received = {}
+    socks = []
+    for _ in range(subscribers):
+        sock = socket.create_connection(("localhost", port))
+        sock.sendall(subscribe)
+        read_replies(sock, 1)
+        sock.setblocking(False)
+        sel.register(sock, selectors.EVENT_READ)
+        received[sock] = 0
+        socks.append(sock)
+
+    publisher = socket.create_connection(("localhost", port))
+    calls_before, usec_before = publish_stats(publisher)
+    batch = b"".join(encode_command([b"PUBLISH", CHANNEL, message]) for _ in range(pipeline))
+    publisher.setblocking(False)
+    sel.register(publisher, selectors.EVENT_READ)
+    pending_replies = b""
+    published = 0
+    in_flight = 0
+    done = 0
+
+    start = time.perf_counter()
+    while done < subscribers:
+        if not in_flight and published < messages:
+            in_flight = min(pipeline, messages - published)
+            publisher.sendall(batch if in_flight == pipeline else batch[:len(batch) // pipeline * in_flight])
+            published += in_flight
+        for key, _ in sel.select():
+            sock = key.fileobj
+            data = sock.recv(1024 * 1024)
+            if sock is publisher:
+                pending_replies += data
+                while in_flight:
+                    end = reply_end(pending_replies, 0)
+                    if end < 0:
+                        break
+                    pending_replies = pending_replies[end:]
+                    in_flight -= 1
+            else:
+                received[sock] += len(data)
+                if received[sock] == expected:
+                    done += 1
+    seconds = time.perf_counter() - start
+
+    publisher.setblocking(True)
+    calls, usec = publish_stats(publisher)
+    usec_per_call = (usec - usec_before) / (calls - calls_before)
+    for sock in socks + [publisher]:
+        sel.unregister(sock)
+        sock.close()
+    return seconds, usec_per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Pub/Sub fan-out to many subscribers")
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--messages", type=int, default=2000, help="messages published per run")
+    parser.add_argument("--pipeline", type=int, default=16, help="PUBLISHes in flight")
+    parser.add_argument("--message-size", type=int, default=64)
+    parser.add_argument("--patterns", action="store_true", help="subscribe with PSUBSCRIBE instead")
+    parser.add_argument("--port", type=int, default=6390)
+    options = parser.parse_args()
+
+    # Every subscriber is a socket in this process and in the server
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = max(options.subscribers) + 64
+    if soft < wanted <= hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+
+    server = subprocess.Popen(
+        [sys.executable, "rdb_file_config.py", "--port", str(options.port), "--save", ""],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(options.port)
+        print(f"{options.messages:,} messages of {options.message_size} bytes, pipeline {options.pipeline}")
+        print(f"{'subscribers':>11} {'deliveries/sec':>15} {'msgs/sec':>9} {'PUBLISH usec':>13} {'usec/subscriber':>16}")
+        for subscribers in options.subscribers:
+            seconds, usec_per_call = run_fanout(
+                options.port, subscribers, options.messages, options.pipeline, options.message_size,
+                options.patterns,
+            )
+            print(f"{subscribers:>11,} {subscribers * options.messages / seconds:>15,.0f} "
+                  f"{options.messages / seconds:>9,.0f} {usec_per_call:>13.1f} "
+                  f"{usec_per_call / subscribers:>16.3f}")
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
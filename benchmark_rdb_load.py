@@ -0,0 +1,73 @@
+"""
+Benchmark for the RDB snapshot loader.
+
+Writes a synthetic dump with a mix of plain, integer-encoded, LZF-compressed
+and expiring string keys, then times load_rdb() on it and reports keys loaded
+per second.
+Example: python benchmark_rdb_load.py --keys 1000000 --value-size 32
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from rdb import encode_length, encode_string, load_rdb
+
+
+def encode_lzf_literal(value):
+    """LZF-encoded string made only of literal runs (exercises the LZF path)."""
+    chunks = bytearray()
+    for i in range(0, len(value), 32):
+        chunk = value[i:i + 32]
+        chunks.append(len(chunk) - 1)
+        chunks += chunk
+    return b"\xc3" + encode_length(len(chunks)) + encode_length(len(value)) + bytes(chunks)
+
+
+def write_dump(path, keys, value_size):
+    """Writes a synthetic RDB file with `keys` string keys."""
+    value = b"v" * value_size
+    expire_at = (int(time.time()) + 3600) * 1000
+    with open(path, "wb") as f:
+        f.write(b"REDIS0011")
+        f.write(b"\xfe\x00\xfb" + encode_length(keys) + encode_length(keys // 4))
+        for i in range(keys):
+            key = encode_string(b"key:%d" % i)
+            kind = i % 4
+            if kind == 0:
+                f.write(b"\x00" + key + encode_string(value))
+            elif kind == 1:
+                # 32-bit integer-encoded value
+                f.write(b"\x00" + key + b"\xc2" + i.to_bytes(4, "little"))
+            elif kind == 2:
+                f.write(b"\x00" + key + encode_lzf_literal(value))
+            else:
+                f.write(b"\xfc" + expire_at.to_bytes(8, "little"))
+                f.write(b"\x00" + key + encode_string(value))
+        f.write(b"\xff" + b"\x00" * 8)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RDB loading speed")
+    parser.add_argument("--keys", type=int, default=500000)
+    parser.add_argument("--value-size", type=int, default=32)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.rdb")
+        write_dump(path, options.keys, options.value_size)
+        size_mb = os.path.getsize(path) / (1024 * 1024)
+
+        database, expiry = {}, {}
+        start = time.perf_counter()
+        loaded = load_rdb(path, database, expiry)
+        elapsed = time.perf_counter() - start
+
+    print(f"RDB size:    {size_mb:.1f} MB")
+    print(f"Keys loaded: {loaded} ({len(expiry)} with expiry)")
+    print(f"Load time:   {elapsed:.3f} s")
+    print(f"Throughput:  {loaded / elapsed:,.0f} keys/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Memory-per-key benchmark for the dict and compact storage engines.
+
+For each engine and value kind, a fresh child process fills the keyspace
+through keyspace.set_key() and reports how much its RSS grew per key, and
+how long the SETs and then the GETs through lookup_key() took. Keys look
+like redis-benchmark's (key:000000123456).
+Example: python benchmark_storage.py --keys 1000000 --value-size 16
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ENGINES = ("dict", "compact")
+
+# Value kinds: random-looking strings, small integers, strings with a TTL
+KINDS = ("string", "int", "volatile")
+
+
+def rss_bytes():
+    """Resident set size of this process (Linux)."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def make_value(kind, i, value_size):
+    """The value stored at key number i."""
+    if kind == "int":
+        return b"%d" % (i * 7919 % 100000)
+    return ((b"%016x" % (i * 2654435761)) * (value_size // 16 + 1))[:value_size]
+
+
+def run_child(engine, kind, keys, value_size):
+    """Fills the keyspace in this process and prints the measurements as JSON."""
+    import keyspace
+    keyspace.use_storage(engine)
+    expire_ms = keyspace.now_ms() + 3600 * 1000 if kind == "volatile" else None
+
+    # Keys and values are built inside the loops so the keyspace holds the
+    # only reference; the time spent building them is measured separately
+    start = time.perf_counter()
+    for i in range(keys):
+        b"key:%012d" % i, make_value(kind, i, value_size)
+    build_seconds = time.perf_counter() - start
+
+    before = rss_bytes()
+    start = time.perf_counter()
+    for i in range(keys):
+        keyspace.set_key(b"key:%012d" % i, make_value(kind, i, value_size), expire_ms)
+    set_seconds = time.perf_counter() - start - build_seconds
+    used = rss_bytes() - before
+
+    start = time.perf_counter()
+    for i in range(keys):
+        keyspace.lookup_key(b"key:%012d" % i)
+    get_seconds = time.perf_counter() - start
+    print(json.dumps({
+        "bytes_per_key": used / keys,
+        "set_usec": set_seconds / keys * 1e6,
+        "get_usec": get_seconds / keys * 1e6,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare memory per key of the storage engines")
+    parser.add_argument("--keys", type=int, default=1000000)
+    parser.add_argument("--value-size", type=int, default=16, help="bytes per string value")
+    parser.add_argument("--child", nargs=2, metavar=("ENGINE", "KIND"), help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.child:
+        run_child(options.child[0], options.child[1], options.keys, options.value_size)
+        return
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    print(f"{options.keys:,} keys, {options.value_size} byte string values")
+    print(f"{'kind':>9} {'engine':>8} {'bytes/key':>10} {'SET usec':>9} {'GET usec':>9} {'saving':>7}")
+    for kind in KINDS:
+        baseline = None
+        for engine in ENGINES:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--keys", str(options.keys),
+                 "--value-size", str(options.value_size), "--child", engine, kind],
+                cwd=here, check=True, capture_output=True, text=True,
+            ).stdout
+            result = json.loads(output)
+            baseline = baseline or result["bytes_per_key"]
+            print(f"{kind:>9} {engine:>8} {result['bytes_per_key']:>10.1f} {result['set_usec']:>9.2f} "
+                  f"{result['get_usec']:>9.2f} {baseline / result['bytes_per_key']:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
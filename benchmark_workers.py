@@ -0,0 +1,77 @@
+"""
+Benchmark for --workers mode.
+
+Starts rdb_file_config.py with 1, 2, ... N worker processes and drives each
+setup with the same loadgen.py SET/GET mix from several client processes,
+then prints the throughput for every worker count so the scaling is visible.
+The client processes compete with the server for cores, so run it on a
+machine with more cores than workers + clients for meaningful numbers.
+Example: python benchmark_workers.py --max-workers 4 --clients 8
+"""
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from loadgen import run_benchmark
+
+
+def wait_for_port(port, timeout=10.0):
+    """Blocks until something accepts connections on localhost:port."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("localhost", port)).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def run_setup(server_args, options):
+    """Starts a server with the extra command line `server_args`, loads it and returns the loadgen result."""
+    server = subprocess.Popen(
+        [sys.executable, "rdb_file_config.py", "--port", str(options.port), "--save", "",
+         *server_args],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(options.port)
+        return run_benchmark(
+            "mixed", port=options.port, clients=options.clients, pipeline=options.pipeline,
+            requests=options.requests, keyspace=options.keyspace, value_size=options.value_size,
+            set_ratio=options.set_ratio, processes=options.processes,
+        )
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark throughput scaling of --workers mode")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--clients", type=int, default=8, help="client connections")
+    parser.add_argument("--processes", type=int, default=8, help="client processes")
+    parser.add_argument("--pipeline", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=500000, help="requests per setup")
+    parser.add_argument("--keyspace", type=int, default=100000)
+    parser.add_argument("--set-ratio", type=float, default=0.5, help="share of SETs in the mix")
+    parser.add_argument("--value-size", type=int, default=32)
+    parser.add_argument("--port", type=int, default=6390)
+    options = parser.parse_args()
+
+    print(f"{'workers':>7} {'ops/sec':>12} {'speedup':>8} {'p99 usec':>9}")
+    baseline = None
+    for workers in range(1, options.max_workers + 1):
+        result = run_setup(["--workers", str(workers)], options)
+        rate = result["ops_per_sec"]
+        baseline = baseline or rate
+        print(f"{workers:>7} {rate:>12,.0f} {rate / baseline:>7.2f}x {result['latency_usec']['p99']:>9}")
+
+
+if __name__ == "__main__":
+    main()
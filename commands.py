@@ -0,0 +1,491 @@
+"""
+Command registry shared by the server scripts.
+
+Every command is registered once, at import time, with its handler, arity,
+flags and key positions. Dispatch is a single dict lookup and the arity is
+checked before the handler runs, so handlers only deal with their own
+option parsing. A script that should only understand some commands builds
+its own table with command_table().
+
+Arity follows the Redis convention: a positive number is the exact argument
+count including the command name, a negative one is the minimum count.
+Handlers take (client, args) and return the encoded reply; client is the
+Connection the command came from, or None when it is run internally.
+call_command() times each handler for the per-command stats and slow log.
+A handler that raises does not take the server down: the client gets an
+error reply, the call counts as failed, and the traceback is logged the
+first time each command fails this way.
+Before a command flagged 'denyoom' runs for a client, keys are evicted
+if the keyspace is over maxmemory; if that is not possible the command is
+refused with an OOM error. Internal calls such as the AOF replay are never
+refused.
+
+After a command flagged 'write' succeeds and changed the keyspace (the
+dirty counter moved), its args are passed to every function in
+write_listeners (e.g. the AOF); a DEL of missing keys is not propagated.
+A handler whose effect depends
+on when it runs rewrites args in place into a form that replays the same
+way, such as SET ... PX becoming SET ... PXAT.
+"""
+import traceback
+from decimal import Decimal
+from math import isfinite
+from time import perf_counter_ns
+
+import keyspace
+from compact_store import int_value
+from keyspace import (
+    delete_key, free_memory, key_exists, lookup_key, now_ms, over_maxmemory, scan_keys, set_key,
+    stats,
+)
+from latency import CommandStats, slowlog
+from resp import resp_array, resp_bulk_string, resp_integer
+from scan import MASK_64, compile_glob, is_literal
+
+# Every registered command, keyed by upper-case name
+COMMANDS = {}
+
+# Called with the args of every write command that succeeded
+write_listeners = []
+
+# Names of the commands whose handler raised, so each traceback is logged once
+crashed_commands = set()
+
+OOM_ERROR = b"-OOM command not allowed when used memory > 'maxmemory'.\r\n"
+NOT_INTEGER_ERROR = b'-ERR value is not an integer or out of range\r\n'
+NOT_FLOAT_ERROR = b'-ERR value is not a valid float\r\n'
+SYNTAX_ERROR = b'-ERR syntax error\r\n'
+INVALID_EXPIRE_ERROR = b"-ERR invalid expire time in 'set' command\r\n"
+
+
+class Command:
+    """One entry of the command table."""
+
+    __slots__ = ("name", "handler", "arity", "flags", "first_key", "last_key", "key_step", "stats")
+
+    def __init__(self, name, handler, arity, flags, first_key, last_key, key_step):
+        self.name = name
+        self.handler = handler
+        self.arity = arity
+        self.flags = flags
+        self.first_key = first_key
+        self.last_key = last_key
+        self.key_step = key_step
+        self.stats = CommandStats()
+
+    def keys(self, args):
+        """Returns the key arguments of a call to this command."""
+        if not self.first_key:
+            return []
+        last = self.last_key if self.last_key >= 0 else len(args) + self.last_key
+        return args[self.first_key:last + 1:self.key_step]
+
+
+def command(name, arity, *flags, first_key=0, last_key=None, key_step=1):
+    """
+    Decorator that registers a handler in COMMANDS.
+    Example: @command(b'GET', 2, 'readonly', 'fast', first_key=1)
+    last_key defaults to first_key; -1 means "up to the last argument".
+    """
+    if last_key is None:
+        last_key = first_key
+
+    def register(handler):
+        COMMANDS[name] = Command(name, handler, arity, frozenset(flags), first_key, last_key, key_step)
+        return handler
+    return register
+
+
+def command_table(*names):
+    """Returns a dispatch table restricted to the given command names."""
+    return {name: COMMANDS[name] for name in names}
+
+
+def lookup_command(name, table=COMMANDS):
+    """Finds a command by name, case-insensitively."""
+    cmd = table.get(name)
+    if cmd is None:
+        cmd = table.get(name.upper())
+    return cmd
+
+
+def wrong_arity(name):
+    """Standard error reply for a call with the wrong number of arguments."""
+    return b"-ERR wrong number of arguments for '" + name.lower() + b"' command\r\n"
+
+
+def internal_error(cmd, err):
+    """Error reply for a handler that raised err, logging the traceback the first time."""
+    if cmd.name not in crashed_commands:
+        crashed_commands.add(cmd.name)
+        print(f"Error running {cmd.name.decode()}:\n{traceback.format_exc()}", end="")
+    message = f"{type(err).__name__}: {err}".encode(errors="replace")
+    message = message.replace(b"\r", b" ").replace(b"\n", b" ")
+    return b"-ERR internal error in '" + cmd.name.lower() + b"' command: " + message + b"\r\n"
+
+
+def call_command(client, args, table=COMMANDS):
+    """Looks up args[0] in table, checks its arity and runs the handler."""
+    cmd = lookup_command(args[0], table)
+    if cmd is None:
+        return b'-ERR unknown command\r\n'
+    arity = cmd.arity
+    if (arity > 0 and len(args) != arity) or len(args) < -arity:
+        cmd.stats.rejected_calls += 1
+        return wrong_arity(cmd.name)
+    if client is not None and 'denyoom' in cmd.flags and over_maxmemory():
+        evicted = free_memory()
+        for key in evicted:
+            for listener in write_listeners:
+                listener([b'DEL', key])
+        if over_maxmemory():
+            cmd.stats.rejected_calls += 1
+            return OOM_ERROR
+    dirty = stats["dirty"]
+    start = perf_counter_ns()
+    try:
+        reply = cmd.handler(client, args)
+    except Exception as err:
+        reply = internal_error(cmd, err)
+    duration = perf_counter_ns() - start
+    failed = reply[:1] == b'-'
+    cmd.stats.record(duration, failed)
+    slowlog.maybe_add(client, args, duration)
+    if write_listeners and not failed and 'write' in cmd.flags and stats["dirty"] != dirty:
+        for listener in write_listeners:
+            listener(args)
+    return reply
+
+
+@command(b'PING', -1, 'fast')
+def ping_command(client, args):
+    """PING [message]"""
+    if len(args) > 1:
+        return resp_bulk_string(args[1])
+    return b'+PONG\r\n'
+
+
+@command(b'ECHO', 2, 'fast')
+def echo_command(client, args):
+    """ECHO message"""
+    return resp_bulk_string(args[1])
+
+
+@command(b'SET', -3, 'write', 'denyoom', first_key=1)
+def set_command(client, args):
+    """SET key value [PX milliseconds | PXAT unix-time-milliseconds]"""
+    expire_ms = None
+    option = args[3].upper() if len(args) >= 5 else None
+    if option == b'PX' or option == b'PXAT':
+        try:
+            expire_ms = int(args[4])
+        except ValueError:
+            return b'-ERR ' + option + b' value is not an integer\r\n'
+        now = now_ms() if option == b'PX' else 0
+        # Expire times are stored and saved as signed 64-bit milliseconds
+        if not 0 < expire_ms < (1 << 63) - now:
+            return INVALID_EXPIRE_ERROR
+        if option == b'PX':
+            expire_ms += now
+            # Propagate the absolute time so a replay does not extend the TTL
+            args[3:5] = [b'PXAT', str(expire_ms).encode()]
+    set_key(args[1], args[2], expire_ms)
+    return b'+OK\r\n'
+
+
+@command(b'GET', 2, 'readonly', 'fast', first_key=1)
+def get_command(client, args):
+    """GET key"""
+    value = lookup_key(args[1])
+    if value is None:
+        return b'$-1\r\n'
+    return resp_bulk_string(value)
+
+
+@command(b'MGET', -2, 'readonly', 'fast', first_key=1, last_key=-1)
+def mget_command(client, args):
+    """MGET key [key ...]"""
+    return resp_array([lookup_key(key) for key in args[1:]])
+
+
+@command(b'MSET', -3, 'write', 'denyoom', first_key=1, last_key=-1, key_step=2)
+def mset_command(client, args):
+    """MSET key value [key value ...]"""
+    if len(args) % 2 == 0:
+        return wrong_arity(args[0])
+    for i in range(1, len(args), 2):
+        set_key(args[i], args[i + 1])
+    return b'+OK\r\n'
+
+
+@command(b'MSETNX', -3, 'write', 'denyoom', first_key=1, last_key=-1, key_step=2)
+def msetnx_command(client, args):
+    """MSETNX key value [key value ...]: sets nothing if any of the keys exists"""
+    if len(args) % 2 == 0:
+        return wrong_arity(args[0])
+    for i in range(1, len(args), 2):
+        if key_exists(args[i]):
+            return b':0\r\n'
+    for i in range(1, len(args), 2):
+        set_key(args[i], args[i + 1])
+    return b':1\r\n'
+
+
+@command(b'DEL', -2, 'write', first_key=1, last_key=-1)
+def del_command(client, args):
+    """DEL key [key ...]"""
+    return resp_integer(sum(delete_key(key) for key in args[1:]))
+
+
+@command(b'UNLINK', -2, 'write', 'fast', first_key=1, last_key=-1)
+def unlink_command(client, args):
+    """
+    UNLINK key [key ...]
+    Redis frees the values in a background thread. Here a value is a single
+    bytes object (or a record in the compact arena), so this is DEL.
+    """
+    return del_command(client, args)
+
+
+@command(b'EXISTS', -2, 'readonly', 'fast', first_key=1, last_key=-1)
+def exists_command(client, args):
+    """EXISTS key [key ...]: a key given twice is counted twice"""
+    return resp_integer(sum(key_exists(key) for key in args[1:]))
+
+
+@command(b'TOUCH', -2, 'readonly', 'fast', first_key=1, last_key=-1)
+def touch_command(client, args):
+    """TOUCH key [key ...]: updates the access clocks, returns how many keys exist"""
+    return resp_integer(sum(lookup_key(key) is not None for key in args[1:]))
+
+
+def incr_by(key, increment):
+    """Adds increment to the integer at key, keeping its TTL. Returns the reply."""
+    value = lookup_key(key)
+    number = 0
+    if value is not None:
+        number = int_value(value)
+        if number is None:
+            return NOT_INTEGER_ERROR
+    number += increment
+    if not -(1 << 63) <= number < 1 << 63:
+        return b'-ERR increment or decrement would overflow\r\n'
+    set_key(key, str(number).encode(), keep_ttl=True)
+    return resp_integer(number)
+
+
+@command(b'INCR', 2, 'write', 'denyoom', 'fast', first_key=1)
+def incr_command(client, args):
+    """INCR key"""
+    return incr_by(args[1], 1)
+
+
+@command(b'DECR', 2, 'write', 'denyoom', 'fast', first_key=1)
+def decr_command(client, args):
+    """DECR key"""
+    return incr_by(args[1], -1)
+
+
+@command(b'INCRBY', 3, 'write', 'denyoom', 'fast', first_key=1)
+def incrby_command(client, args):
+    """INCRBY key increment"""
+    increment = int_value(args[2])
+    if increment is None:
+        return NOT_INTEGER_ERROR
+    return incr_by(args[1], increment)
+
+
+@command(b'DECRBY', 3, 'write', 'denyoom', 'fast', first_key=1)
+def decrby_command(client, args):
+    """DECRBY key decrement"""
+    decrement = int_value(args[2])
+    if decrement is None or decrement == -(1 << 63):
+        return NOT_INTEGER_ERROR
+    return incr_by(args[1], -decrement)
+
+
+def parse_float(value):
+    """Parses a finite float the way Redis does (no spaces, no NaN), or returns None."""
+    if not value or value[:1].isspace() or value[-1:].isspace() or b'_' in value:
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    return number if isfinite(number) else None
+
+
+def format_float(number):
+    """Shortest decimal form of number without an exponent, e.g. 10.5 or 3 or 0.0001."""
+    text = format(Decimal(repr(number)), 'f')
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    return text.encode()
+
+
+@command(b'INCRBYFLOAT', 3, 'write', 'denyoom', 'fast', first_key=1)
+def incrbyfloat_command(client, args):
+    """INCRBYFLOAT key increment"""
+    increment = parse_float(args[2])
+    if increment is None:
+        return NOT_FLOAT_ERROR
+    value = lookup_key(args[1])
+    number = 0.0
+    if value is not None:
+        number = parse_float(value)
+        if number is None:
+            return NOT_FLOAT_ERROR
+    number += increment
+    if not isfinite(number):
+        return b'-ERR increment would produce NaN or Infinity\r\n'
+    result = format_float(number)
+    set_key(args[1], result, keep_ttl=True)
+    return resp_bulk_string(result)
+
+
+@command(b'DBSIZE', 1, 'readonly', 'fast')
+def dbsize_command(client, args):
+    """DBSIZE: keys whose TTL passed count until the expire cycle removes them"""
+    return resp_integer(len(keyspace.database))
+
+
+@command(b'KEYS', 2, 'readonly')
+def keys_command(client, args):
+    """
+    KEYS pattern
+    Walks every key in one go, blocking the server meanwhile; SCAN is the
+    incremental way to do this on a large keyspace.
+    """
+    pattern = args[1]
+    if is_literal(pattern):
+        return resp_array([pattern] if key_exists(pattern) else [])
+    database, expiry = keyspace.database, keyspace.expiry
+    if pattern == b'*':
+        keys = list(database)
+    else:
+        match = compile_glob(pattern)
+        keys = [key for key in database if match(key)]
+    if expiry:
+        # Hide keys whose TTL passed and leave deleting them to the expire cycle
+        now = now_ms()
+        keys = [key for key in keys if expiry.get(key, now + 1) > now]
+    return resp_array(keys)
+
+
+@command(b'SCAN', -2, 'readonly')
+def scan_command(client, args):
+    """SCAN cursor [MATCH pattern] [COUNT count] [TYPE type]"""
+    if not args[1].isdigit() or int(args[1]) > MASK_64:
+        return b'-ERR invalid cursor\r\n'
+    cursor = int(args[1])
+    match = None
+    count = 10
+    wanted_type = b'string'
+    if len(args) % 2 != 0:
+        return SYNTAX_ERROR
+    for i in range(2, len(args), 2):
+        option = args[i].upper()
+        if option == b'MATCH':
+            if args[i + 1] != b'*':
+                match = compile_glob(args[i + 1])
+        elif option == b'COUNT':
+            count = int_value(args[i + 1])
+            if count is None:
+                return NOT_INTEGER_ERROR
+            if count < 1:
+                return SYNTAX_ERROR
+        elif option == b'TYPE':
+            wanted_type = args[i + 1].lower()
+        else:
+            return SYNTAX_ERROR
+    cursor, keys = scan_keys(cursor, count)
+    if wanted_type != b'string':
+        # Every value is a string
+        keys = []
+    keys = [key for key in keys if key_exists(key) and (match is None or match(key))]
+    return b'*2\r\n' + resp_bulk_string(str(cursor).encode()) + resp_array(keys)
+
+
+def command_info(cmd):
+    """COMMAND INFO entry: name, arity, flags, first key, last key, key step."""
+    flags = sorted(cmd.flags)
+    return (
+        b'*6\r\n'
+        + resp_bulk_string(cmd.name.lower())
+        + resp_integer(cmd.arity)
+        + b'*' + str(len(flags)).encode() + b'\r\n'
+        + b''.join(b'+' + flag.encode() + b'\r\n' for flag in flags)
+        + resp_integer(cmd.first_key)
+        + resp_integer(cmd.last_key)
+        + resp_integer(cmd.key_step if cmd.first_key else 0)
+    )
+
+
+@command(b'COMMAND', -1, 'admin')
+def command_command(client, args):
+    """COMMAND [COUNT | INFO name ...]"""
+    if len(args) == 1:
+        infos = [command_info(cmd) for cmd in COMMANDS.values()]
+    else:
+        sub = args[1].upper()
+        if sub == b'COUNT' and len(args) == 2:
+            return resp_integer(len(COMMANDS))
+        if sub != b'INFO':
+            return b'-ERR unknown subcommand for \'command\'\r\n'
+        infos = []
+        for name in args[2:]:
+            cmd = lookup_command(name)
+            infos.append(command_info(cmd) if cmd is not None else b'*-1\r\n')
+    return b'*' + str(len(infos)).encode() + b'\r\n' + b''.join(infos)
+
+
+@command(b'SLOWLOG', -2, 'admin')
+def slowlog_command(client, args):
+    """SLOWLOG GET [count] | LEN | RESET"""
+    sub = args[1].upper()
+    if sub == b'GET' and len(args) <= 3:
+        count = 10
+        if len(args) == 3:
+            try:
+                count = int(args[2])
+            except ValueError:
+                return b'-ERR value is not an integer or out of range\r\n'
+        entries = list(slowlog.entries)
+        if count >= 0:
+            entries = entries[:count]
+        reply = [b'*' + str(len(entries)).encode() + b'\r\n']
+        for entry_id, timestamp, usec, argv, address in entries:
+            reply.append(b'*6\r\n' + resp_integer(entry_id) + resp_integer(timestamp)
+                         + resp_integer(usec) + resp_array(argv)
+                         + resp_bulk_string(address) + resp_bulk_string(b''))
+        return b''.join(reply)
+    if sub == b'LEN' and len(args) == 2:
+        return resp_integer(len(slowlog.entries))
+    if sub == b'RESET' and len(args) == 2:
+        slowlog.reset()
+        return b'+OK\r\n'
+    return b'-ERR unknown subcommand or wrong number of arguments for \'slowlog\'\r\n'
+
+
+@command(b'LATENCY', -2, 'admin')
+def latency_command(client, args):
+    """LATENCY HISTOGRAM [command ...]"""
+    if args[1].upper() != b'HISTOGRAM':
+        return b'-ERR unknown subcommand for \'latency\'\r\n'
+    if len(args) > 2:
+        cmds = [lookup_command(name) for name in args[2:]]
+    else:
+        cmds = list(COMMANDS.values())
+    reply = []
+    for cmd in cmds:
+        if cmd is None or not cmd.stats.calls:
+            continue
+        buckets = cmd.stats.cumulative_histogram()
+        reply.append(
+            resp_bulk_string(cmd.name.lower())
+            + b'*4\r\n' + resp_bulk_string(b'calls') + resp_integer(cmd.stats.calls)
+            + resp_bulk_string(b'histogram_usec')
+            + b'*' + str(len(buckets) * 2).encode() + b'\r\n'
+            + b''.join(resp_integer(upper) + resp_integer(count) for upper, count in buckets)
+        )
+    return b'*' + str(len(reply) * 2).encode() + b'\r\n' + b''.join(reply)
@@ -0,0 +1,579 @@
+"""
+Compact key/value storage, selected with --storage compact.
+
+In the plain dict every small string key costs far more than its bytes: two
+bytes objects (33 bytes of header each) and a dict slot, and a volatile key
+also an int object and a slot in the expiry dict. CompactStore keeps all of
+that in a few flat buffers instead:
+
+- arena: a bytearray with one record per key. A record is a flags byte,
+  the key and value lengths (1 + 2 bytes, or 4 + 4 for large records), the
+  expire time (8 bytes, only for keys that ever had a TTL), the key and the
+  value. Values that are canonical integers such as b'1234' are stored
+  natively in 1, 2, 4 or 8 bytes.
+- slots: an open-addressing hash table (linear probing) of arena offsets,
+  with a parallel array of 16-bit hash tags so a probe only compares key
+  bytes when the tags match. Offsets are 32-bit until the arena outgrows
+  2 GiB.
+
+Overwritten and deleted records stay in the arena as garbage until it is
+half the arena, then the arena is compacted in one pass.
+
+CompactStore behaves like the database dict and its expiry attribute like
+the expiry dict, so the rest of the server works with either. Since expire
+times live in the records, CompactExpiryIndex replaces the expiry heap: the
+expire cycle walks the table with a cursor instead. Every access runs
+Python code instead of a C dict lookup, so it is slower; see
+benchmark_storage.py for the memory/CPU trade-off.
+"""
+import random
+import struct
+import time
+from array import array
+
+from expire import KEYS_PER_TIME_CHECK
+from scan import next_cursor
+
+# slots values that are not arena offsets
+EMPTY = -1
+DELETED = -2
+
+# Largest offset the 32-bit slots array can hold; past it the slots go 64-bit
+MAX_SMALL_OFFSET = (1 << 31) - 1
+
+MIN_CAPACITY = 8
+
+# Don't bother compacting arenas smaller than this
+MIN_COMPACT_SIZE = 64 * 1024
+
+# Record flags
+FLAG_LARGE = 1    # LARGE_HEADER instead of SMALL_HEADER
+FLAG_EXPIRE = 2   # An 8 byte expire time follows the header (0 = no TTL)
+FLAG_INT = 4      # The value is a little-endian signed integer
+
+SMALL_HEADER = struct.Struct("<BBH")   # flags, key length, value length
+LARGE_HEADER = struct.Struct("<BII")
+EXPIRE = struct.Struct("<q")
+
+# Largest expire time the field holds; 0 in the field means no TTL
+MAX_EXPIRE_MS = (1 << 63) - 1
+
+# Random slots looked at per wanted sample when sampling volatile keys
+VOLATILE_SAMPLE_TRIES = 10
+
+# Volatile keys per round of CompactExpiryIndex.expire_cycle(); it stops after
+# a round in which at most a quarter of them had expired
+EXPIRE_KEYS_PER_ROUND = 20
+
+# Keys sampled by CompactExpiryIndex.soonest() (volatile-ttl eviction)
+SOONEST_SAMPLES = 16
+
+_MISSING = object()
+
+
+def check_expire(expire_ms):
+    """Raises ValueError unless expire_ms fits the record's expire field."""
+    if not 0 < expire_ms <= MAX_EXPIRE_MS:
+        raise ValueError(f"expire time {expire_ms} is out of range")
+
+
+def hash_tag(h):
+    """16 bits of a key's hash that are not used to pick its slot."""
+    return (h >> 48) & 0xFFFF
+
+
+def int_value(value):
+    """Returns value as an int if it is the canonical form of a 64-bit integer, else None."""
+    if not 0 < len(value) <= 20 or not (value[0] == 45 or 48 <= value[0] <= 57):  # '-' or digit
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        return None
+    if -(1 << 63) <= number < 1 << 63 and str(number).encode() == value:
+        return number
+    return None
+
+
+def int_width(number):
+    """Smallest of 1, 2, 4 or 8 bytes that holds number as a signed integer."""
+    for width in (1, 2, 4):
+        if -(1 << (8 * width - 1)) <= number < 1 << (8 * width - 1):
+            return width
+    return 8
+
+
+class CompactStore:
+    """A dict-like bytes -> bytes mapping stored in flat buffers."""
+
+    def __init__(self, capacity=MIN_CAPACITY):
+        self.arena = bytearray()
+        self.slots = array("i", [EMPTY]) * capacity
+        self.tags = array("H", [0]) * capacity
+        self.mask = capacity - 1
+        self.count = 0       # Live keys
+        self.filled = 0      # Slots that are live or DELETED
+        self.volatile = 0    # Keys with a TTL
+        self.garbage = 0     # Arena bytes of dead records
+        self.expiry = ExpiryView(self)
+
+    # Records
+
+    def _layout(self, off):
+        """Returns (flags, key_start, key_length, value_length) of the record at off."""
+        arena = self.arena
+        flags = arena[off]
+        if flags & FLAG_LARGE:
+            _, key_len, value_len = LARGE_HEADER.unpack_from(arena, off)
+            start = off + LARGE_HEADER.size
+        else:
+            _, key_len, value_len = SMALL_HEADER.unpack_from(arena, off)
+            start = off + SMALL_HEADER.size
+        if flags & FLAG_EXPIRE:
+            start += EXPIRE.size
+        return flags, start, key_len, value_len
+
+    def _record_size(self, off):
+        """Total size in bytes of the record at off."""
+        _, start, key_len, value_len = self._layout(off)
+        return start - off + key_len + value_len
+
+    def _append(self, key, flags, raw_value, expire_ms):
+        """Writes a record at the end of the arena and returns its offset."""
+        arena = self.arena
+        off = len(arena)
+        if expire_ms is not None:
+            flags |= FLAG_EXPIRE
+        if len(key) < 256 and len(raw_value) < 65536:
+            arena += SMALL_HEADER.pack(flags, len(key), len(raw_value))
+        else:
+            arena += LARGE_HEADER.pack(flags | FLAG_LARGE, len(key), len(raw_value))
+        if expire_ms is not None:
+            arena += EXPIRE.pack(expire_ms)
+        arena += key
+        arena += raw_value
+        if off > MAX_SMALL_OFFSET and self.slots.typecode == "i":
+            self.slots = array("q", self.slots)
+        return off
+
+    def _free(self, off):
+        """Marks the record at off as dead; a record at the very end is cut off instead."""
+        size = self._record_size(off)
+        if off + size == len(self.arena):
+            del self.arena[off:]
+        else:
+            self.garbage += size
+
+    def _expire_at(self, off):
+        """The expire time stored in the record at off, or None."""
+        if not self.arena[off] & FLAG_EXPIRE:
+            return None
+        header = LARGE_HEADER if self.arena[off] & FLAG_LARGE else SMALL_HEADER
+        expire_ms = EXPIRE.unpack_from(self.arena, off + header.size)[0]
+        return expire_ms or None
+
+    def _value_at(self, off):
+        """Decodes the value of the record at off to bytes."""
+        flags, start, key_len, value_len = self._layout(off)
+        start += key_len
+        if flags & FLAG_INT:
+            number = int.from_bytes(self.arena[start:start + value_len], "little", signed=True)
+            return str(number).encode()
+        return bytes(self.arena[start:start + value_len])
+
+    def _raw_value(self, off):
+        """The value of the record at off as stored, with its FLAG_INT bit."""
+        flags, start, key_len, value_len = self._layout(off)
+        start += key_len
+        return flags & FLAG_INT, self.arena[start:start + value_len]
+
+    def _key_at(self, off):
+        """The key of the record at off."""
+        _, start, key_len, _ = self._layout(off)
+        return bytes(self.arena[start:start + key_len])
+
+    # Hash table
+
+    def _find(self, key):
+        """Slot index holding key, or -1."""
+        h = hash(key)
+        tag = hash_tag(h)
+        mask = self.mask
+        slots = self.slots
+        tags = self.tags
+        arena = self.arena
+        i = h & mask
+        while True:
+            off = slots[i]
+            if off == EMPTY:
+                return -1
+            if off >= 0 and tags[i] == tag:
+                _, start, key_len, _ = self._layout(off)
+                if key_len == len(key) and arena[start:start + key_len] == key:
+                    return i
+            i = (i + 1) & mask
+
+    def _insert_slot(self, key):
+        """Returns (slot index, found) where key is or should be stored."""
+        h = hash(key)
+        tag = hash_tag(h)
+        mask = self.mask
+        slots = self.slots
+        i = h & mask
+        reuse = -1
+        while True:
+            off = slots[i]
+            if off == EMPTY:
+                return (i if reuse < 0 else reuse), False
+            if off == DELETED:
+                if reuse < 0:
+                    reuse = i
+            elif self.tags[i] == tag:
+                _, start, key_len, _ = self._layout(off)
+                if key_len == len(key) and self.arena[start:start + key_len] == key:
+                    return i, True
+            i = (i + 1) & mask
+
+    def _resize(self, capacity):
+        """Rehashes every live slot into a table of the given capacity (a power of two)."""
+        old_slots, old_tags = self.slots, self.tags
+        self.slots = slots = array(old_slots.typecode, [EMPTY]) * capacity
+        self.tags = tags = array("H", [0]) * capacity
+        self.mask = mask = capacity - 1
+        for off, tag in zip(old_slots, old_tags):
+            if off < 0:
+                continue
+            # Tags are too short to place a key, so hash it again
+            i = hash(self._key_at(off)) & mask
+            while slots[i] != EMPTY:
+                i = (i + 1) & mask
+            slots[i] = off
+            tags[i] = tag
+        self.filled = self.count
+
+    def _compact(self):
+        """Copies the live records into a fresh arena, dropping the garbage."""
+        arena = self.arena
+        new_arena = bytearray()
+        slots = self.slots
+        for i, off in enumerate(slots):
+            if off < 0:
+                continue
+            size = self._record_size(off)
+            slots[i] = len(new_arena)
+            new_arena += arena[off:off + size]
+        self.arena = new_arena
+        self.garbage = 0
+
+    def _maybe_compact(self):
+        if self.garbage > MIN_COMPACT_SIZE and self.garbage * 2 > len(self.arena):
+            self._compact()
+
+    # Mapping interface
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def get(self, key, default=None):
+        i = self._find(key)
+        if i < 0:
+            return default
+        return self._value_at(self.slots[i])
+
+    def __getitem__(self, key):
+        i = self._find(key)
+        if i < 0:
+            raise KeyError(key)
+        return self._value_at(self.slots[i])
+
+    def __setitem__(self, key, value):
+        """Stores value at key. Like a dict store, this keeps the key's TTL."""
+        number = int_value(value)
+        if number is None:
+            flags, raw = 0, value
+        else:
+            flags, raw = FLAG_INT, number.to_bytes(int_width(number), "little", signed=True)
+        i, found = self._insert_slot(key)
+        if found:
+            old = self.slots[i]
+            old_flags, start, key_len, value_len = self._layout(old)
+            if value_len == len(raw) and old_flags & FLAG_INT == flags:
+                # Same size, e.g. a counter going from 41 to 42: overwrite in place
+                start += key_len
+                self.arena[start:start + value_len] = raw
+                return
+            had_expire_field = self.arena[old] & FLAG_EXPIRE
+            expire_ms = self._expire_at(old)
+            self._free(old)
+            if expire_ms is None and had_expire_field:
+                # Keep the (empty) expire field so a new TTL can be written in place
+                expire_ms = 0
+            self.slots[i] = self._append(key, flags, raw, expire_ms)
+            self._maybe_compact()
+            return
+        if self.slots[i] == EMPTY:
+            self.filled += 1
+        self.slots[i] = self._append(key, flags, raw, None)
+        self.tags[i] = hash_tag(hash(key))
+        self.count += 1
+        if self.filled * 4 > len(self.slots) * 3:
+            self._resize(max(MIN_CAPACITY, 1 << (self.count * 2).bit_length()))
+
+    def pop(self, key, default=_MISSING):
+        i = self._find(key)
+        if i < 0:
+            if default is _MISSING:
+                raise KeyError(key)
+            return default
+        off = self.slots[i]
+        value = self._value_at(off)
+        if self._expire_at(off) is not None:
+            self.volatile -= 1
+        self._free(off)
+        self.slots[i] = DELETED
+        self.count -= 1
+        self._maybe_compact()
+        return value
+
+    def __delitem__(self, key):
+        self.pop(key)
+
+    def __iter__(self):
+        for off in self.slots:
+            if off >= 0:
+                yield self._key_at(off)
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        for off in self.slots:
+            if off >= 0:
+                yield self._value_at(off)
+
+    def items(self):
+        for off in self.slots:
+            if off >= 0:
+                yield self._key_at(off), self._value_at(off)
+
+    def clear(self):
+        self.__init__()
+
+    # Expire times
+
+    def get_expire(self, key):
+        """Expire time of key in ms, or None if it has none or does not exist."""
+        i = self._find(key)
+        if i < 0:
+            return None
+        return self._expire_at(self.slots[i])
+
+    def set_expire(self, key, expire_ms):
+        """Sets the expire time of an existing key. Raises ValueError if it is out of range."""
+        check_expire(expire_ms)
+        i = self._find(key)
+        if i < 0:
+            raise KeyError(key)
+        off = self.slots[i]
+        if self._expire_at(off) is None:
+            self.volatile += 1
+        if self.arena[off] & FLAG_EXPIRE:
+            header = LARGE_HEADER if self.arena[off] & FLAG_LARGE else SMALL_HEADER
+            EXPIRE.pack_into(self.arena, off + header.size, expire_ms)
+            return
+        # No room for an expire time: rewrite the record with one
+        flags, raw = self._raw_value(off)
+        key = self._key_at(off)
+        self._free(off)
+        self.slots[i] = self._append(key, flags, raw, expire_ms)
+        self._maybe_compact()
+
+    def clear_expire(self, key):
+        """Removes the TTL of key in place and returns the old expire time, or None."""
+        i = self._find(key)
+        if i < 0:
+            return None
+        off = self.slots[i]
+        expire_ms = self._expire_at(off)
+        if expire_ms is not None:
+            header = LARGE_HEADER if self.arena[off] & FLAG_LARGE else SMALL_HEADER
+            EXPIRE.pack_into(self.arena, off + header.size, 0)
+            self.volatile -= 1
+        return expire_ms
+
+    # Iteration
+
+    def scan(self, cursor, count):
+        """
+        Returns (next cursor, keys) for SCAN. Visits home buckets (hash & mask)
+        in reverse-binary order until count keys were found or 10 * count
+        buckets were visited. A key is found in its home bucket's probe run,
+        which ends at the first EMPTY slot since slots never go back to
+        EMPTY until the table is resized.
+        """
+        if not self.count:
+            return 0, []
+        slots = self.slots
+        mask = self.mask
+        keys = []
+        for _ in range(10 * count):
+            bucket = cursor & mask
+            i = bucket
+            while slots[i] != EMPTY:
+                off = slots[i]
+                if off >= 0:
+                    key = self._key_at(off)
+                    if hash(key) & mask == bucket:
+                        keys.append(key)
+                i = (i + 1) & mask
+            cursor = next_cursor(cursor, mask)
+            if cursor == 0 or len(keys) >= count:
+                break
+        return cursor, keys
+
+    # Sampling
+
+    def _random_live(self):
+        """Offset of a live record found from a random slot onwards. The store must not be empty."""
+        slots = self.slots
+        mask = self.mask
+        i = random.randrange(len(slots))
+        while slots[i] < 0:
+            i = (i + 1) & mask
+        return slots[i]
+
+    def sample_keys(self, count):
+        """count random keys (with replacement), or [] if the store is empty."""
+        if not self.count:
+            return []
+        return [self._key_at(self._random_live()) for _ in range(count)]
+
+    def sample_volatile(self, count):
+        """Up to count random (expire_ms, key) pairs of keys with a TTL."""
+        picked = []
+        if not self.volatile:
+            return picked
+        for _ in range(count * VOLATILE_SAMPLE_TRIES):
+            off = self._random_live()
+            expire_ms = self._expire_at(off)
+            if expire_ms is not None:
+                picked.append((expire_ms, self._key_at(off)))
+                if len(picked) == count:
+                    break
+        return picked
+
+    def memory_usage(self):
+        """Bytes held by the arena and the hash table."""
+        return len(self.arena) + self.slots.itemsize * len(self.slots) + self.tags.itemsize * len(self.tags)
+
+
+class ExpiryView:
+    """Dict-like view of a CompactStore's expire times (key -> ms), like the expiry dict."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return self.store.volatile
+
+    def __contains__(self, key):
+        return self.store.get_expire(key) is not None
+
+    def get(self, key, default=None):
+        expire_ms = self.store.get_expire(key)
+        return default if expire_ms is None else expire_ms
+
+    def __getitem__(self, key):
+        expire_ms = self.store.get_expire(key)
+        if expire_ms is None:
+            raise KeyError(key)
+        return expire_ms
+
+    def __setitem__(self, key, expire_ms):
+        self.store.set_expire(key, expire_ms)
+
+    def pop(self, key, default=_MISSING):
+        expire_ms = self.store.clear_expire(key)
+        if expire_ms is None:
+            if default is _MISSING:
+                raise KeyError(key)
+            return default
+        return expire_ms
+
+    def __delitem__(self, key):
+        self.pop(key)
+
+    def items(self):
+        store = self.store
+        for off in store.slots:
+            if off >= 0:
+                expire_ms = store._expire_at(off)
+                if expire_ms is not None:
+                    yield store._key_at(off), expire_ms
+
+    def __iter__(self):
+        for key, _ in self.items():
+            yield key
+
+    def keys(self):
+        return iter(self)
+
+
+class CompactExpiryIndex:
+    """
+    Stands in for ExpiryIndex when the keyspace is a CompactStore. The expire
+    times are already in the records, so instead of keeping a heap the
+    expire cycle walks the table with a cursor, continuing where the last
+    cycle stopped. Like Redis' active expire cycle it looks at volatile keys
+    in rounds and stops once a round finds few of them expired.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.cursor = 0
+
+    def add(self, key, expire_ms):
+        """Nothing to do: the expire time is stored with the key."""
+
+    def rebuild(self, expiry):
+        self.cursor = 0
+
+    def soonest(self, expiry):
+        """The sampled volatile key that expires first, or None."""
+        picked = self.store.sample_volatile(SOONEST_SAMPLES)
+        return min(picked)[1] if picked else None
+
+    def sample(self, expiry, count):
+        return self.store.sample_volatile(count)
+
+    def expire_cycle(self, expiry, delete, now_ms, time_budget):
+        """Same contract as ExpiryIndex.expire_cycle()."""
+        store = self.store
+        slots = store.slots
+        deadline = time.perf_counter() + time_budget
+        expired = 0
+        round_seen = round_expired = 0
+        for checked in range(1, len(slots) + 1):
+            if not store.volatile:
+                break
+            i = self.cursor = (self.cursor + 1) & store.mask
+            off = slots[i]
+            # Deleting may compact the arena, so expire times are read fresh for every slot
+            if off >= 0:
+                expire_ms = store._expire_at(off)
+                if expire_ms is not None:
+                    round_seen += 1
+                    if expire_ms <= now_ms:
+                        delete(store._key_at(off))
+                        expired += 1
+                        round_expired += 1
+                    if round_seen == EXPIRE_KEYS_PER_ROUND:
+                        if round_expired * 4 <= round_seen:
+                            break
+                        round_seen = round_expired = 0
+            if checked % KEYS_PER_TIME_CHECK == 0 and time.perf_counter() >= deadline:
+                return expired, True
+        return expired, False
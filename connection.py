@@ -0,0 +1,196 @@
+"""
+Per-client state for the selectors-based servers.
+
+Replies are never pushed with sendall() on a non-blocking socket. They are
+queued on the connection and drained with send()/sendmsg() as far as the
+kernel accepts them; whatever is left goes out when the selector reports the
+socket writable. The connection only asks for EVENT_WRITE while it has
+pending output, and a client whose queue grows past the output buffer limit
+is disconnected, so one slow reader cannot stall or bloat the whole server.
+A client can also have a soft limit: it is disconnected once its queue has
+stayed above that for longer than soft_limit_seconds (see pubsub.py).
+
+A reply can also be a DeferredReply that another process fills in later
+(see workers.py). Replies written after it are held back until it arrives,
+so a pipelining client still gets its answers in order.
+"""
+import selectors
+import time
+from collections import deque
+from itertools import islice
+
+from resp import RespParser
+
+# Hard cap on queued reply bytes per client (0 disables the limit)
+DEFAULT_OUTPUT_BUFFER_LIMIT = 256 * 1024 * 1024
+
+# sendmsg() accepts at most IOV_MAX buffers per call (1024 on Linux)
+IOV_MAX = 1024
+
+# Client counters reported by INFO
+client_stats = {
+    "connected_clients": 0,
+    "total_connections_received": 0,
+    "client_output_buffer_limit_disconnections": 0,
+}
+
+
+class DeferredReply:
+    """Placeholder for a reply that is produced later, e.g. by another worker."""
+
+    __slots__ = ("client", "value")
+
+    def __init__(self, client):
+        self.client = client
+        self.value = None
+
+    def resolve(self, value):
+        """Fills in the reply and moves the client's held output to its queue (flush separately)."""
+        self.value = value
+        if self.client is not None:
+            self.client.release_held()
+
+
+class Connection:
+    """A client socket together with its input parser and queued output."""
+
+    def __init__(self, sock, sel, on_read, output_limit=DEFAULT_OUTPUT_BUFFER_LIMIT):
+        self.sock = sock
+        self.sel = sel
+        self.on_read = on_read
+        self.parser = RespParser()
+        self.output = deque()
+        self.output_size = 0
+        self.output_limit = output_limit
+        # Queued bytes the client may stay above for soft_limit_seconds (0 disables)
+        self.soft_limit = 0
+        self.soft_limit_seconds = 0
+        self.soft_limit_since = None
+        # Called with the connection when it is closed, e.g. to drop its subscriptions
+        self.on_close = None
+        # Replies waiting behind an unresolved DeferredReply, in order
+        self.held = deque()
+        # Set after a protocol error: send what is queued, then hang up
+        self.close_after_flush = False
+        self.closed = False
+        self.events = selectors.EVENT_READ
+        # The bound method is the selector callback, so no extra lookup table is needed
+        sel.register(sock, self.events, self.handle_event)
+        client_stats["connected_clients"] += 1
+        client_stats["total_connections_received"] += 1
+
+    def handle_event(self, sock, mask):
+        """Selector callback: drain pending output, then read new commands."""
+        if mask & selectors.EVENT_WRITE:
+            self.flush()
+        if mask & selectors.EVENT_READ and not self.closed and not self.close_after_flush:
+            self.on_read(self)
+
+    def write(self, data):
+        """Queue reply bytes (or a DeferredReply), disconnecting the client if it is over its output limit."""
+        if self.closed or not data:
+            return
+        if self.held or isinstance(data, DeferredReply):
+            self.held.append(data)
+            return
+        self._append(data)
+
+    def _append(self, data):
+        """Adds bytes to the output queue and enforces the output buffer limit."""
+        self.output.append(data)
+        self.output_size += len(data)
+        if self.output_limit and self.output_size > self.output_limit:
+            self._close_over_limit("output buffer limit")
+        elif self.soft_limit:
+            if self.output_size <= self.soft_limit:
+                self.soft_limit_since = None
+            elif self.soft_limit_since is None:
+                self.soft_limit_since = time.monotonic()
+            elif time.monotonic() - self.soft_limit_since > self.soft_limit_seconds:
+                self._close_over_limit("soft output buffer limit")
+
+    def _close_over_limit(self, limit):
+        """Disconnects a client whose queued output grew too large."""
+        print(f"Closing client over {limit} ({self.output_size} bytes)")
+        client_stats["client_output_buffer_limit_disconnections"] += 1
+        self.close()
+
+    def release_held(self):
+        """Moves held replies to the output queue up to the first one still pending."""
+        held = self.held
+        while held:
+            item = held[0]
+            if isinstance(item, DeferredReply):
+                if item.value is None:
+                    break
+                item = item.value
+            held.popleft()
+            if item and not self.closed:
+                self._append(item)
+
+    def flush(self):
+        """Send as much queued output as the socket takes without blocking."""
+        if self.closed:
+            return
+        output = self.output
+        try:
+            while output:
+                if len(output) == 1:
+                    chunk_size = len(output[0])
+                    sent = self.sock.send(output[0])
+                else:
+                    # Scatter write: hand the kernel many queued replies in one call
+                    chunks = list(islice(output, IOV_MAX))
+                    chunk_size = sum(len(chunk) for chunk in chunks)
+                    sent = self.sock.sendmsg(chunks)
+                self._consume(sent)
+                if sent < chunk_size:
+                    # The socket buffer is full, wait for EVENT_WRITE
+                    break
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            # Covers ConnectionResetError and BrokenPipeError
+            self.close()
+            return
+
+        if output:
+            self._set_events(selectors.EVENT_READ | selectors.EVENT_WRITE)
+        elif self.close_after_flush and not self.held:
+            self.close()
+        else:
+            self._set_events(selectors.EVENT_READ)
+
+    def close(self):
+        """Unregister the socket, drop any queued output and close it."""
+        if self.closed:
+            return
+        self.closed = True
+        client_stats["connected_clients"] -= 1
+        self.sel.unregister(self.sock)
+        self.sock.close()
+        self.output.clear()
+        self.held.clear()
+        self.output_size = 0
+        if self.on_close is not None:
+            self.on_close(self)
+
+    def _consume(self, sent):
+        """Drop the first `sent` bytes from the output queue."""
+        output = self.output
+        self.output_size -= sent
+        while sent:
+            chunk = output[0]
+            if sent >= len(chunk):
+                sent -= len(chunk)
+                output.popleft()
+            else:
+                # Keep the unsent tail without copying it
+                output[0] = memoryview(chunk)[sent:]
+                sent = 0
+
+    def _set_events(self, events):
+        """Change the selector interest set only when it actually differs."""
+        if events != self.events:
+            self.events = events
+            self.sel.modify(self.sock, events, self.handle_event)
@@ -0,0 +1,164 @@
+"""
+Approximate LRU/LFU eviction for maxmemory.
+
+As in Redis, no linked list keeps the keys in recency order. Each key only
+gets a compact access clock in AccessTracker.clocks:
+
+- LRU: the tracker's clock at the last access, in LRU_CLOCK_RESOLUTION_MS
+  steps. The clock is advanced from the cron, so every key touched within
+  one step shares one int object and the per-key cost is a single dict slot.
+- LFU: a 24-bit value packing the minute of the last decay (16 bits) with
+  a logarithmic access counter (8 bits) that decays while a key is idle.
+
+To evict, a few keys are sampled at random and the one that was idle the
+longest (LRU) or used the least (LFU) goes. A dict cannot be sampled, so
+the tracker also keeps an append-only list of keys. Entries go stale when
+keys are deleted and are skipped when sampled, and the list is rebuilt once
+stale entries dominate it, the same way ExpiryIndex handles its heap.
+A CompactStore can be sampled directly, so for it the list is switched off
+with keep_keys.
+"""
+import random
+import time
+
+POLICIES = (
+    b"noeviction",
+    b"allkeys-lru",
+    b"allkeys-lfu",
+    b"volatile-lru",
+    b"volatile-lfu",
+    b"volatile-ttl",
+)
+
+# Granularity of the LRU clock; the server cron ticks every 100 ms
+LRU_CLOCK_RESOLUTION_MS = 100
+
+# Rebuild the key list once it holds this many more entries than there are keys
+STALE_ENTRY_SLACK = 1024
+
+# Sampling rounds to try before giving up when every sampled entry is stale
+MAX_SAMPLE_ROUNDS = 16
+
+# LFU tuning, same defaults as Redis' lfu-log-factor and lfu-decay-time
+LFU_INIT_VAL = 5
+LFU_LOG_FACTOR = 10
+LFU_DECAY_MINUTES = 1
+
+
+def policy_mode(policy):
+    """Which access clock a policy needs: "lru", "lfu" or None."""
+    if policy.endswith(b"-lru"):
+        return "lru"
+    if policy.endswith(b"-lfu"):
+        return "lfu"
+    return None
+
+
+def lru_clock():
+    """Current LRU clock value."""
+    return int(time.monotonic() * 1000) // LRU_CLOCK_RESOLUTION_MS
+
+
+def lfu_minutes():
+    """Current time in minutes, truncated to the 16 bits kept per key."""
+    return int(time.time() // 60) & 0xFFFF
+
+
+def lfu_decayed_counter(packed):
+    """The LFU counter of a packed clock after the decay for the minutes since its last update."""
+    counter = packed & 0xFF
+    elapsed = (lfu_minutes() - (packed >> 8)) & 0xFFFF
+    periods = elapsed // LFU_DECAY_MINUTES
+    return max(0, counter - periods)
+
+
+def lfu_increment(counter):
+    """Logarithmic increment: the higher the counter, the less likely it grows."""
+    if counter == 255:
+        return counter
+    base = max(0, counter - LFU_INIT_VAL)
+    if random.random() < 1.0 / (base * LFU_LOG_FACTOR + 1):
+        counter += 1
+    return counter
+
+
+def sample(entries, count):
+    """Picks count random entries from a list (with replacement)."""
+    size = len(entries)
+    if not size:
+        return []
+    return [entries[random.randrange(size)] for _ in range(count)]
+
+
+class AccessTracker:
+    """Per-key access clocks and a sampleable key list for one keyspace."""
+
+    def __init__(self):
+        self.mode = None   # None while no policy needs clocks, else "lru" or "lfu"
+        self.clocks = {}
+        self.keys = []     # Every live key at least once, plus stale entries
+        self.keep_keys = True
+        self.clock = lru_clock()
+
+    def configure(self, mode, database):
+        """Switches to an access mode and starts every existing key with a fresh clock."""
+        self.mode = mode
+        self.clocks = {}
+        self.keys = []
+        if mode is not None:
+            initial = self.initial_clock()
+            self.clocks = dict.fromkeys(database, initial)
+            if self.keep_keys:
+                self.keys = list(database)
+
+    def initial_clock(self):
+        """Clock value given to a key when it is created."""
+        if self.mode == "lfu":
+            return (lfu_minutes() << 8) | LFU_INIT_VAL
+        return self.clock
+
+    def added(self, key):
+        """Called when a new key is stored."""
+        if self.keep_keys:
+            self.keys.append(key)
+        self.clocks[key] = self.initial_clock()
+
+    def touched(self, key):
+        """Called when an existing key is read or overwritten."""
+        if self.mode == "lru":
+            self.clocks[key] = self.clock
+        else:
+            packed = self.clocks.get(key)
+            if packed is None:
+                packed = self.initial_clock()
+            counter = lfu_increment(lfu_decayed_counter(packed))
+            self.clocks[key] = (lfu_minutes() << 8) | counter
+
+    def removed(self, key):
+        """Called when a key is deleted; its key list entry goes stale."""
+        self.clocks.pop(key, None)
+
+    def cron(self, database):
+        """Advances the LRU clock and drops stale key list entries when there are too many."""
+        self.clock = lru_clock()
+        if len(self.keys) > 2 * len(database) + STALE_ENTRY_SLACK:
+            self.keys = list(database)
+
+    def score(self, key):
+        """How good an eviction candidate key is; higher means evict sooner."""
+        packed = self.clocks.get(key)
+        if packed is None:
+            return 0
+        if self.mode == "lru":
+            return self.clock - packed
+        return 255 - lfu_decayed_counter(packed)
+
+    def best_candidate(self, candidates):
+        """The key among candidates with the highest score, or None."""
+        best = None
+        best_score = -1
+        for key in candidates:
+            score = self.score(key)
+            if score > best_score:
+                best, best_score = key, score
+        return best
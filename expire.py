@@ -0,0 +1,77 @@
+"""
+Active expiry of volatile keys.
+
+The expiry dict stays the source of truth; ExpiryIndex keeps a min-heap of
+(expire_ms, key) next to it so the cron can pop exactly the keys that are
+due instead of sampling at random. Entries go stale when a key is
+overwritten or its TTL changes, so each popped entry is checked against
+the dict before anything is deleted, and the heap is rebuilt when stale
+entries start to dominate it.
+"""
+import heapq
+import random
+import time
+
+# Look at the clock every this many popped entries
+KEYS_PER_TIME_CHECK = 64
+
+# Rebuild the heap once it holds this many more entries than there are volatile keys
+STALE_ENTRY_SLACK = 1024
+
+
+class ExpiryIndex:
+    """Min-heap over the expire times in an expiry dict."""
+
+    def __init__(self):
+        self.heap = []
+
+    def add(self, key, expire_ms):
+        """Record that key expires at expire_ms (milliseconds since epoch)."""
+        heapq.heappush(self.heap, (expire_ms, key))
+
+    def rebuild(self, expiry):
+        """Recreate the heap from the expiry dict, dropping stale entries."""
+        self.heap = [(expire_ms, key) for key, expire_ms in expiry.items()]
+        heapq.heapify(self.heap)
+
+    def soonest(self, expiry):
+        """Returns the volatile key that expires first, or None. Drops stale entries on the way."""
+        heap = self.heap
+        while heap:
+            expire_ms, key = heap[0]
+            if expiry.get(key) == expire_ms:
+                return key
+            heapq.heappop(heap)
+        return None
+
+    def sample(self, expiry, count):
+        """Up to count random (expire_ms, key) pairs of volatile keys; stale entries are skipped."""
+        heap = self.heap
+        if not heap:
+            return []
+        picked = (heap[random.randrange(len(heap))] for _ in range(count))
+        return [(expire_ms, key) for expire_ms, key in picked if expiry.get(key) == expire_ms]
+
+    def expire_cycle(self, expiry, delete, now_ms, time_budget):
+        """
+        Deletes keys whose expire time is at or before now_ms by calling
+        delete(key), spending at most time_budget seconds.
+        Returns (expired, timed_out): how many keys were removed and whether
+        the budget ran out before every due key was handled.
+        """
+        heap = self.heap
+        deadline = time.perf_counter() + time_budget
+        expired = 0
+        checked = 0
+        while heap and heap[0][0] <= now_ms:
+            expire_ms, key = heapq.heappop(heap)
+            # Skip entries for keys that were overwritten or given a new TTL
+            if expiry.get(key) == expire_ms:
+                delete(key)
+                expired += 1
+            checked += 1
+            if checked % KEYS_PER_TIME_CHECK == 0 and time.perf_counter() >= deadline:
+                return expired, True
+        if len(heap) > 2 * len(expiry) + STALE_ENTRY_SLACK:
+            self.rebuild(expiry)
+        return expired, False
@@ -2,8 +2,13 @@
 import socket
 import selectors
 
+from commands import call_command, command_table
+
 sel = selectors.DefaultSelector()
 
+# Commands this server understands
+COMMAND_TABLE = command_table(b"PING")
+
 
 def accept(sock):
     """Accept a new client connection and register it for reading."""
@@ -37,16 +42,10 @@ def handle_command(data):
     # RESP arrays start with '*'
     if data.startswith(b"*"):
         parts = data.split(b"\r\n")
-        if len(parts) >= 4:
-            cmd = parts[2].upper()
-            if cmd == b"PING":
-                # If there's an argument, echo it back as bulk string
-                if len(parts) > 4 and parts[4]:
-                    msg = parts[4]
-                    return b"$" + str(len(msg)).encode() + b"\r\n" + msg + b"\r\n"
-                else:
-                    # Simple string response for PING
-                    return b"+PONG\r\n"
+        # Every other line after the array header is an argument
+        args = parts[2:-1:2]
+        if args:
+            return call_command(None, args, COMMAND_TABLE)
     # Default error for unsupported input
     return b"-ERR unknown command\r\n"
 
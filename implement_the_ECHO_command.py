@@ -1,8 +1,13 @@
 import socket
 import selectors
 
+from commands import call_command, command_table
+
 sel = selectors.DefaultSelector()
 
+# Commands this server understands
+COMMAND_TABLE = command_table(b"PING", b"ECHO")
+
 
 def accept(sock):
     """Accept a new client connection and register it for reading."""
@@ -55,7 +60,8 @@ def parse_resp_array(data):
 
 def handle_command(data):
     """
-    Parses RESP input and handles PING and ECHO commands.
+    Parses RESP input and handles PING and ECHO commands through the
+    shared command table.
     Returns a RESP-compliant response.
     """
     # Parse the RESP array into a list of arguments
@@ -63,25 +69,8 @@ def handle_command(data):
     if not args or len(args) == 0:
         return b"-ERR unknown command\r\n"
 
-    # Command name is always the first argument, case-insensitive
-    cmd = args[0].upper()
-
-    if cmd == b"PING":
-        # If there's an argument, echo it back as bulk string
-        if len(args) > 1:
-            msg = args[1]
-            return b"$" + str(len(msg)).encode() + b"\r\n" + msg + b"\r\n"
-        else:
-            return b"+PONG\r\n"
-    elif cmd == b"ECHO":
-        # ECHO always returns its argument as a bulk string
-        if len(args) == 2:
-            msg = args[1]
-            return b"$" + str(len(msg)).encode() + b"\r\n" + msg + b"\r\n"
-        else:
-            return b"-ERR wrong number of arguments for 'echo' command\r\n"
-    else:
-        return b"-ERR unknown command\r\n"
+    # The command table checks the argument count and runs the handler
+    return call_command(None, args, COMMAND_TABLE)
 
 
 def main():
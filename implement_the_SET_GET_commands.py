@@ -2,34 +2,41 @@
 import socket
 import selectors
 
+from commands import call_command, command_table
+from connection import Connection
+
 sel = selectors.DefaultSelector()
 
-# This dictionary will store our key-value pairs in memory
-database = {}
+# Commands this server understands; SET and GET keep their data in keyspace.database
+COMMAND_TABLE = command_table(b"PING", b"ECHO", b"SET", b"GET")
 
 
-def accept(sock):
+def accept(sock, mask):
     """Accept a new client connection and register it for reading."""
     conn, addr = sock.accept()
     print(f"Accepted connection from {addr}")
     conn.setblocking(False)
-    sel.register(conn, selectors.EVENT_READ, read)
+    # The Connection registers itself with the selector
+    Connection(conn, sel, read)
 
 
-def read(conn):
-    """Read data from a client socket, process the command, and send a response."""
+def read(client):
+    """Read data from a client socket, process the command, and queue the response."""
     try:
-        data = conn.recv(1024)
+        data = client.sock.recv(1024)
         if data:
             response = handle_command(data)
-            conn.sendall(response)
+            # Queue the reply and send what the socket accepts right now;
+            # the rest goes out when the socket becomes writable
+            client.write(response)
+            client.flush()
         else:
             print("Closing connection")
-            sel.unregister(conn)
-            conn.close()
+            client.close()
+    except BlockingIOError:
+        pass
     except ConnectionResetError:
-        sel.unregister(conn)
-        conn.close()
+        client.close()
 
 
 def parse_resp_array(data):
@@ -62,7 +69,8 @@ def parse_resp_array(data):
 
 def handle_command(data):
     """
-    Parses RESP input and handles PING, ECHO, SET, and GET commands.
+    Parses RESP input and handles PING, ECHO, SET, and GET commands
+    through the shared command table.
     Returns a RESP-compliant response.
     """
     # Parse the RESP array into a list of arguments
@@ -70,52 +78,8 @@ def handle_command(data):
     if not args or len(args) == 0:
         return b"-ERR unknown command\r\n"
 
-    # The first argument is the command name (like PING, ECHO, SET, GET)
-    cmd = args[0].upper()
-
-    if cmd == b"PING":
-        # If there's an argument, echo it back as bulk string
-        if len(args) > 1:
-            msg = args[1]
-            return b"$" + str(len(msg)).encode() + b"\r\n" + msg + b"\r\n"
-        else:
-            return b"+PONG\r\n"
-    elif cmd == b"ECHO":
-        # ECHO returns its argument as a bulk string
-        if len(args) == 2:
-            msg = args[1]
-            return b"$" + str(len(msg)).encode() + b"\r\n" + msg + b"\r\n"
-        else:
-            return b"-ERR wrong number of arguments for 'echo' command\r\n"
-    elif cmd == b"SET":
-        # SET stores a value for a key
-        # It needs exactly 3 arguments: SET key value
-        if len(args) == 3:
-            key = args[1]
-            value = args[2]
-            # Store the value in the database dictionary
-            database[key] = value
-            # Respond with a simple string OK
-            return b"+OK\r\n"
-        else:
-            return b"-ERR wrong number of arguments for 'set' command\r\n"
-    elif cmd == b"GET":
-        # GET retrieves the value for a key
-        # It needs exactly 2 arguments: GET key
-        if len(args) == 2:
-            key = args[1]
-            # If the key exists, return its value as a bulk string
-            if key in database:
-                value = database[key]
-                return b"$" + str(len(value)).encode() + b"\r\n" + value + b"\r\n"
-            else:
-                # If the key does not exist, return a null bulk string
-                return b"$-1\r\n"
-        else:
-            return b"-ERR wrong number of arguments for 'get' command\r\n"
-    else:
-        # If the command is not recognized, return an error
-        return b"-ERR unknown command\r\n"
+    # The command table checks the argument count and runs the handler
+    return call_command(None, args, COMMAND_TABLE)
 
 
 def main():
@@ -140,7 +104,7 @@ def main():
         events = sel.select(timeout=None)
         for key, mask in events:
             callback = key.data
-            callback(key.fileobj)
+            callback(key.fileobj, mask)
 
 
 if __name__ == "__main__":
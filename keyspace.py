@@ -0,0 +1,310 @@
+"""
+The in-memory keyspace shared by the server scripts and command handlers.
+
+database maps keys to values and expiry maps volatile keys to their expire
+time in milliseconds since the epoch. Handlers go through lookup_key(),
+set_key() and delete_key() so lazy expiry, the write counters, the memory
+accounting and the eviction clocks stay in one place. They also bump the
+version counter of keys that a client WATCHes, so EXEC can tell whether a
+watched key changed; only watched keys have a counter, so this costs one
+empty-dict check when nobody watches anything.
+
+use_storage("compact") swaps both for a CompactStore and its expiry view,
+and the expiry heap for a CompactExpiryIndex (see compact_store.py). It
+must run before anything is loaded, and other modules should reach these
+through this module (keyspace.database) rather than keep their own
+reference.
+"""
+import sys
+import time
+
+from compact_store import CompactExpiryIndex, CompactStore, check_expire
+from evict import MAX_SAMPLE_ROUNDS, AccessTracker, policy_mode, sample
+from expire import ExpiryIndex
+from scan import KeyLog
+
+# This dictionary will store our key-value pairs in memory
+database = {}
+# This dictionary will store expiry times for keys (in milliseconds since epoch)
+expiry = {}
+# Min-heap over expiry so the cron can delete keys nobody reads again
+expiry_index = ExpiryIndex()
+# Access clocks and key samples for the LRU/LFU maxmemory policies
+access_tracker = AccessTracker()
+# Key list that SCAN walks when database is a dict
+key_log = KeyLog()
+# Modification counters of the keys clients WATCH: key -> [version, watchers]
+watched_keys = {}
+
+# Keyspace counters
+stats = {
+    "dirty": 0,                            # Writes since the last successful save
+    "expired_keys": 0,                     # Keys removed because their TTL passed
+    "expire_cycle_time_cap_reached": 0,    # Expire cycles that ran out of budget
+    "used_memory": 0,                      # Estimated bytes held by the keyspace
+    "evicted_keys": 0,                     # Keys removed to stay under maxmemory
+}
+
+# maxmemory settings, filled in from the server config
+eviction = {
+    "maxmemory": 0,                # Bytes; 0 means no limit
+    "policy": b"noeviction",
+    "samples": 5,                  # Keys sampled per eviction (maxmemory-samples)
+}
+
+STORAGE_ENGINES = ("dict", "compact")
+
+# Rough sizes used for the memory accounting: every key costs its two bytes
+# objects and a dict slot, a volatile key also an int, a dict slot and a heap entry
+DICT_ENTRY_SIZE = 40
+HEAP_ENTRY_SIZE = sys.getsizeof((0, b"")) + 8
+ENTRY_OVERHEAD = 2 * sys.getsizeof(b"") + DICT_ENTRY_SIZE
+EXPIRE_OVERHEAD = DICT_ENTRY_SIZE + sys.getsizeof(1 << 40) + HEAP_ENTRY_SIZE
+
+# The same for CompactStore: a record header and about two table slots per
+# key (4 byte offset + 2 byte tag), and 8 bytes of inline expire time
+COMPACT_ENTRY_OVERHEAD = 4 + 2 * 6
+COMPACT_EXPIRE_OVERHEAD = 8
+
+# Per-key overheads of the storage in use
+overhead = {"entry": ENTRY_OVERHEAD, "expire": EXPIRE_OVERHEAD}
+
+
+def now_ms():
+    """Current Unix time in milliseconds."""
+    return int(time.time() * 1000)
+
+
+def use_storage(engine):
+    """Selects the "dict" or "compact" storage engine for the (still empty) keyspace."""
+    global database, expiry, expiry_index
+    if engine not in STORAGE_ENGINES:
+        raise ValueError(f"storage must be one of {', '.join(STORAGE_ENGINES)}")
+    if engine == "compact":
+        database = CompactStore()
+        expiry = database.expiry
+        expiry_index = CompactExpiryIndex(database)
+        overhead["entry"], overhead["expire"] = COMPACT_ENTRY_OVERHEAD, COMPACT_EXPIRE_OVERHEAD
+    else:
+        database = {}
+        expiry = {}
+        expiry_index = ExpiryIndex()
+        overhead["entry"], overhead["expire"] = ENTRY_OVERHEAD, EXPIRE_OVERHEAD
+    access_tracker.keep_keys = engine == "dict"
+    key_log.keep_keys = engine == "dict"
+
+
+def entry_size(key, value):
+    """Estimated memory used by one key/value pair, not counting its expire time."""
+    return overhead["entry"] + len(key) + len(value)
+
+
+def watch_key(key):
+    """Starts tracking the versions of key for one more watcher. Returns its current version."""
+    entry = watched_keys.get(key)
+    if entry is None:
+        entry = watched_keys[key] = [0, 0]
+    entry[1] += 1
+    return entry[0]
+
+
+def unwatch_key(key):
+    """Drops one watcher of key, and its version counter with the last one."""
+    entry = watched_keys[key]
+    entry[1] -= 1
+    if not entry[1]:
+        del watched_keys[key]
+
+
+def key_version(key):
+    """Current version of a watched key."""
+    return watched_keys[key][0]
+
+
+def touch_watched_key(key):
+    """Marks key as modified for the clients that watch it."""
+    entry = watched_keys.get(key)
+    if entry is not None:
+        entry[0] += 1
+
+
+def remove_key(key):
+    """Deletes key from every structure. The caller makes sure it exists."""
+    if watched_keys:
+        touch_watched_key(key)
+    # The TTL goes first: the compact store keeps it inline and drops it with the value
+    if expiry.pop(key, None) is not None:
+        stats["used_memory"] -= overhead["expire"]
+    value = database.pop(key)
+    stats["used_memory"] -= entry_size(key, value)
+    if access_tracker.mode is not None:
+        access_tracker.removed(key)
+
+
+def expire_if_needed(key):
+    """Deletes key if its TTL has passed. Returns True if it did."""
+    expire_ms = expiry.get(key)
+    if expire_ms is None or now_ms() < expire_ms:
+        return False
+    remove_key(key)
+    stats["expired_keys"] += 1
+    stats["dirty"] += 1
+    return True
+
+
+def lookup_key(key):
+    """Returns the value stored at key, or None. Expired keys are deleted on access."""
+    if expire_if_needed(key):
+        return None
+    value = database.get(key)
+    if value is not None and access_tracker.mode is not None:
+        access_tracker.touched(key)
+    return value
+
+
+def key_exists(key):
+    """True if key exists. Unlike lookup_key() this does not count as an access."""
+    if expire_if_needed(key):
+        return False
+    return key in database
+
+
+def set_key(key, value, expire_ms=None, keep_ttl=False):
+    """
+    Stores value at key, replacing any previous value. The TTL is replaced too
+    unless keep_ttl is set. An expire time that does not fit in 64 bits
+    raises ValueError before anything is changed.
+    """
+    if expire_ms is not None:
+        check_expire(expire_ms)
+    if watched_keys:
+        touch_watched_key(key)
+    old = database.get(key)
+    database[key] = value
+    if old is None:
+        stats["used_memory"] += entry_size(key, value)
+        if access_tracker.mode is not None:
+            access_tracker.added(key)
+        key_log.added(key)
+    else:
+        stats["used_memory"] += len(value) - len(old)
+        if access_tracker.mode is not None:
+            access_tracker.touched(key)
+    if expire_ms is not None:
+        if key not in expiry:
+            stats["used_memory"] += overhead["expire"]
+        expiry[key] = expire_ms
+        expiry_index.add(key, expire_ms)
+    elif not keep_ttl and expiry.pop(key, None) is not None:
+        stats["used_memory"] -= overhead["expire"]
+    stats["dirty"] += 1
+
+
+def delete_key(key):
+    """Removes key. Returns True if it existed."""
+    if key not in database:
+        return False
+    remove_key(key)
+    stats["dirty"] += 1
+    return True
+
+
+def active_expire_cycle(time_budget):
+    """Deletes expired keys, spending at most time_budget seconds."""
+    expired, timed_out = expiry_index.expire_cycle(expiry, remove_key, now_ms(), time_budget)
+    stats["expired_keys"] += expired
+    stats["dirty"] += expired
+    if timed_out:
+        stats["expire_cycle_time_cap_reached"] += 1
+
+
+def rebuild_indexes():
+    """Recomputes everything derived from database and expiry, e.g. after loading a file."""
+    expiry_index.rebuild(expiry)
+    stats["used_memory"] = (
+        sum(entry_size(key, value) for key, value in database.items())
+        + len(expiry) * overhead["expire"]
+    )
+    access_tracker.configure(policy_mode(eviction["policy"]), database)
+    key_log.rebuild(database)
+
+
+def flush_keyspace():
+    """Empties the keyspace, keeping the storage engine."""
+    for entry in watched_keys.values():
+        entry[0] += 1
+    use_storage("compact" if isinstance(database, CompactStore) else "dict")
+    rebuild_indexes()
+
+
+def configure_eviction(maxmemory, policy, samples):
+    """Applies the maxmemory settings, starting access clocks if the policy needs them."""
+    eviction["maxmemory"] = maxmemory
+    eviction["samples"] = samples
+    if policy != eviction["policy"]:
+        eviction["policy"] = policy
+        access_tracker.configure(policy_mode(policy), database)
+
+
+def eviction_candidate():
+    """Picks the key the maxmemory policy wants to evict next, or None if there is none."""
+    policy = eviction["policy"]
+    if policy == b"volatile-ttl":
+        # The expiry heap knows exactly which key expires first; the compact index samples
+        return expiry_index.soonest(expiry)
+    volatile = policy.startswith(b"volatile-")
+    for _ in range(MAX_SAMPLE_ROUNDS):
+        if volatile:
+            picked = [key for _, key in expiry_index.sample(expiry, eviction["samples"])]
+        elif not access_tracker.keep_keys:
+            picked = database.sample_keys(eviction["samples"])
+        else:
+            picked = [key for key in sample(access_tracker.keys, eviction["samples"]) if key in database]
+        if picked:
+            return access_tracker.best_candidate(picked)
+        if not (expiry if volatile else database):
+            return None
+    return None
+
+
+def free_memory():
+    """
+    Evicts keys until the estimated memory use is within maxmemory.
+    Returns the evicted keys; the caller checks whether enough was freed.
+    """
+    evicted = []
+    limit = eviction["maxmemory"]
+    if eviction["policy"] == b"noeviction":
+        return evicted
+    while stats["used_memory"] > limit:
+        key = eviction_candidate()
+        if key is None:
+            break
+        remove_key(key)
+        evicted.append(key)
+    stats["evicted_keys"] += len(evicted)
+    stats["dirty"] += len(evicted)
+    return evicted
+
+
+def over_maxmemory():
+    """True if a limit is set and the keyspace is above it."""
+    return 0 < eviction["maxmemory"] < stats["used_memory"]
+
+
+def eviction_cron():
+    """Periodic upkeep of the access clocks."""
+    if access_tracker.mode is not None:
+        access_tracker.cron(database)
+
+
+def scan_keys(cursor, count):
+    """One SCAN step: returns (next cursor, keys), looking at roughly count keys."""
+    if isinstance(database, CompactStore):
+        return database.scan(cursor, count)
+    return key_log.scan(database, cursor, count)
+
+
+def scan_cron():
+    """Periodic upkeep of the SCAN key log."""
+    key_log.cron(database)
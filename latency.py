@@ -0,0 +1,125 @@
+"""
+Per-command latency statistics and the slow log.
+
+call_command() times every handler with perf_counter_ns() and feeds the
+result to the command's CommandStats: a call counter, the total time and a
+histogram with one bucket per power of two microseconds (the layout Redis
+uses for LATENCY HISTOGRAM). Recording a call is a couple of integer
+operations, so it stays on for every command. Calls slower than the
+configured threshold are also kept in a fixed-size SlowLog ring buffer.
+"""
+import itertools
+import time
+from collections import deque
+
+# Bucket i counts calls that took less than 2**i microseconds
+HISTOGRAM_BUCKETS = 40
+
+# Percentiles reported by INFO latencystats
+LATENCY_PERCENTILES = (50.0, 99.0, 99.9)
+
+# Like Redis, only keep this many arguments (and bytes per argument) per slow log entry
+SLOWLOG_ENTRY_MAX_ARGC = 32
+SLOWLOG_ENTRY_MAX_STRING = 128
+
+
+class CommandStats:
+    """Counters and latency histogram for one command."""
+
+    __slots__ = ("calls", "duration_ns", "rejected_calls", "failed_calls", "histogram")
+
+    def __init__(self):
+        self.calls = 0
+        self.duration_ns = 0
+        self.rejected_calls = 0  # Refused before running, e.g. wrong arity
+        self.failed_calls = 0    # Ran but replied with an error
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+
+    def record(self, duration_ns, failed):
+        """Adds one call that took duration_ns nanoseconds."""
+        self.calls += 1
+        self.duration_ns += duration_ns
+        if failed:
+            self.failed_calls += 1
+        usec = duration_ns // 1000
+        self.histogram[min(usec.bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+
+    @property
+    def usec(self):
+        """Total time spent in the command, in microseconds."""
+        return self.duration_ns // 1000
+
+    def percentile(self, p):
+        """Estimated latency in microseconds below which p percent of calls finished."""
+        if not self.calls:
+            return 0.0
+        rank = self.calls * p / 100.0
+        seen = 0
+        for index, count in enumerate(self.histogram):
+            if count and seen + count >= rank:
+                # Interpolate linearly inside the bucket [2**(index-1), 2**index)
+                low = 0 if index == 0 else 1 << (index - 1)
+                high = 1 << index
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+        return float(1 << (HISTOGRAM_BUCKETS - 1))
+
+    def cumulative_histogram(self):
+        """Returns [(bucket_upper_usec, calls_at_or_below)] for non-empty buckets."""
+        buckets = []
+        total = 0
+        for index, count in enumerate(self.histogram):
+            total += count
+            if count:
+                buckets.append((1 << index, total))
+        return buckets
+
+
+class SlowLog:
+    """Ring buffer of the most recent commands slower than a threshold."""
+
+    def __init__(self, threshold_usec=10000, max_len=128):
+        self.threshold_usec = threshold_usec  # Negative disables, 0 logs everything
+        self.entries = deque(maxlen=max_len)
+        self.next_id = 0
+
+    def configure(self, threshold_usec, max_len):
+        """Applies new settings, keeping the newest entries that still fit."""
+        self.threshold_usec = threshold_usec
+        if max_len != self.entries.maxlen:
+            # Newest entries are on the left, which a bounded deque(entries) would drop
+            self.entries = deque(itertools.islice(self.entries, max_len), maxlen=max_len)
+
+    def maybe_add(self, client, args, duration_ns):
+        """Records the call if it was slower than the threshold."""
+        usec = duration_ns // 1000
+        if self.threshold_usec < 0 or usec < self.threshold_usec:
+            return
+        argv = [arg[:SLOWLOG_ENTRY_MAX_STRING] for arg in args[:SLOWLOG_ENTRY_MAX_ARGC]]
+        if len(args) > SLOWLOG_ENTRY_MAX_ARGC:
+            argv[-1] = b"... (%d more arguments)" % (len(args) - SLOWLOG_ENTRY_MAX_ARGC + 1)
+        # Newest entries first, as SLOWLOG GET returns them
+        self.entries.appendleft((self.next_id, int(time.time()), usec, argv, client_address(client)))
+        self.next_id += 1
+
+    def reset(self):
+        """Drops every entry."""
+        self.entries.clear()
+
+
+def client_address(client):
+    """Returns 'ip:port' of a client connection, or b'' for internal calls and Unix sockets."""
+    if client is None:
+        return b""
+    try:
+        peer = client.sock.getpeername()
+    except OSError:
+        return b""
+    # AF_UNIX peers, like the --workers links, are a (usually empty) path
+    if not isinstance(peer, tuple):
+        return b""
+    return f"{peer[0]}:{peer[1]}".encode()
+
+
+# The server-wide slow log
+slowlog = SlowLog()
@@ -0,0 +1,243 @@
+"""
+RESP load generator, roughly what redis-benchmark does.
+
+Opens C connections to the server and keeps P pipelined requests in flight
+on each of them until N requests have been answered, for each of the
+selected workloads (PING, SET, GET, a SET/GET mix or MGET of MGET_KEYS
+keys). Keys are drawn at random from a keyspace of the given cardinality
+and SET values have a fixed size. Every reply's latency is measured from the moment its pipeline batch
+was sent, so with -P > 1 it includes the time spent queued behind the rest
+of the batch, as in redis-benchmark. Results are printed as JSON with
+ops/sec and p50/p99/p999 latencies in microseconds.
+
+The connections can be spread over several processes (--processes) so the
+client is not the bottleneck when the server runs with --workers.
+Example: python loadgen.py -c 50 -P 16 -n 200000 -t set,get -d 64 -r 100000
+"""
+import argparse
+import json
+import multiprocessing
+import random
+import selectors
+import socket
+import sys
+import time
+from collections import Counter
+
+from resp import encode_command, reply_end
+
+WORKLOADS = ("ping", "set", "get", "mixed", "mget")
+
+# Keys per MGET request, as in redis-benchmark's MSET test
+MGET_KEYS = 10
+
+RECV_SIZE = 64 * 1024
+
+PING_COMMAND = encode_command([b"PING"])
+
+
+class LoadClient:
+    """One benchmark connection and its in-flight pipeline batch."""
+
+    __slots__ = ("sock", "buffer", "remaining", "pending", "sent_at")
+
+    def __init__(self, sock, requests):
+        self.sock = sock
+        self.buffer = bytearray()
+        self.remaining = requests  # Requests not sent yet
+        self.pending = 0           # Replies still expected for the current batch
+        self.sent_at = 0.0
+
+
+def make_batch(workload, count, rng, keyspace, value, set_ratio):
+    """Returns `count` encoded commands of the given workload as one bytes object."""
+    if workload == "ping":
+        return PING_COMMAND * count
+    batch = []
+    if workload == "mget":
+        for _ in range(count):
+            keys = [b"key:%012d" % rng.randrange(keyspace) for _ in range(MGET_KEYS)]
+            batch.append(encode_command([b"MGET", *keys]))
+        return b"".join(batch)
+    for _ in range(count):
+        # Fixed width keys like redis-benchmark's key:__rand_int__
+        key = b"key:%012d" % rng.randrange(keyspace)
+        if workload == "set" or (workload == "mixed" and rng.random() < set_ratio):
+            batch.append(encode_command([b"SET", key, value]))
+        else:
+            batch.append(encode_command([b"GET", key]))
+    return b"".join(batch)
+
+
+def latency_bucket(usec):
+    """Rounds a latency down to 1 usec below 1 ms and to 3 significant digits above."""
+    usec = int(usec)
+    if usec < 1000:
+        return usec
+    scale = 10 ** (len(str(usec)) - 3)
+    return usec // scale * scale
+
+
+def run_connections(host, port, workload, connections, pipeline, requests,
+                    keyspace, value_size, set_ratio, seed):
+    """
+    Runs `requests` requests over `connections` connections from this process.
+    Returns a dict with the request and error counts, the elapsed seconds and
+    the latency histogram as {bucket_usec: count}.
+    """
+    rng = random.Random(seed)
+    value = b"x" * value_size
+    sel = selectors.DefaultSelector()
+    clients = []
+    for i in range(connections):
+        sock = socket.create_connection((host, port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        share = requests // connections + (1 if i < requests % connections else 0)
+        clients.append(LoadClient(sock, share))
+
+    def send_batch(client):
+        count = min(pipeline, client.remaining)
+        batch = make_batch(workload, count, rng, keyspace, value, set_ratio)
+        client.remaining -= count
+        client.pending = count
+        client.sent_at = time.perf_counter()
+        # Blocking send: a batch is small and the server is reading
+        client.sock.sendall(batch)
+
+    histogram = Counter()
+    errors = 0
+    active = 0
+    start = time.perf_counter()
+    for client in clients:
+        if client.remaining:
+            send_batch(client)
+            sel.register(client.sock, selectors.EVENT_READ, client)
+            active += 1
+        else:
+            client.sock.close()
+
+    while active:
+        for key, _ in sel.select():
+            client = key.data
+            data = client.sock.recv(RECV_SIZE)
+            if not data:
+                raise ConnectionError("server closed the connection")
+            usec = (time.perf_counter() - client.sent_at) * 1e6
+            buf = client.buffer
+            buf += data
+            pos = 0
+            while True:
+                end = reply_end(buf, pos)
+                if end < 0:
+                    break
+                if buf[pos] == 0x2d:  # b'-'
+                    errors += 1
+                histogram[latency_bucket(usec)] += 1
+                client.pending -= 1
+                pos = end
+            del buf[:pos]
+            if client.pending:
+                continue
+            if client.remaining:
+                send_batch(client)
+            else:
+                sel.unregister(client.sock)
+                client.sock.close()
+                active -= 1
+    elapsed = time.perf_counter() - start
+    sel.close()
+    return {"requests": requests, "errors": errors, "elapsed": elapsed, "histogram": dict(histogram)}
+
+
+def percentile(histogram, p):
+    """Latency in usec below which p percent of the requests in histogram finished."""
+    total = sum(histogram.values())
+    if not total:
+        return 0
+    rank = total * p / 100.0
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= rank:
+            return bucket
+    return max(histogram)
+
+
+def run_benchmark(workload, host="localhost", port=6379, clients=50, pipeline=1,
+                  requests=100000, keyspace=100000, value_size=3, set_ratio=0.5, processes=1):
+    """
+    Runs one workload and returns its result as a JSON-friendly dict. The
+    connections and requests are split evenly across `processes` processes.
+    """
+    if workload not in WORKLOADS:
+        raise ValueError(f"unknown workload {workload!r}, expected one of {', '.join(WORKLOADS)}")
+    processes = max(1, min(processes, clients))
+    connections = [clients // processes + (1 if i < clients % processes else 0) for i in range(processes)]
+    shares = [requests * count // clients for count in connections]
+    # Rounding leftovers go to the first process
+    shares[0] += requests - sum(shares)
+    jobs = [
+        (host, port, workload, count, pipeline, share, keyspace, value_size, set_ratio,
+         random.randrange(1 << 32))
+        for count, share in zip(connections, shares)
+    ]
+    if processes == 1:
+        parts = [run_connections(*jobs[0])]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            parts = pool.starmap(run_connections, jobs)
+
+    histogram = Counter()
+    for part in parts:
+        histogram.update(part["histogram"])
+    elapsed = max(part["elapsed"] for part in parts)
+    total = sum(part["requests"] for part in parts)
+    return {
+        "test": workload.upper(),
+        "clients": clients,
+        "pipeline": pipeline,
+        "requests": total,
+        "errors": sum(part["errors"] for part in parts),
+        "value_size": value_size,
+        "keyspace": keyspace,
+        "seconds": round(elapsed, 3),
+        "ops_per_sec": round(total / elapsed, 1) if elapsed else 0.0,
+        "latency_usec": {
+            "p50": percentile(histogram, 50.0),
+            "p99": percentile(histogram, 99.0),
+            "p999": percentile(histogram, 99.9),
+            "max": max(histogram, default=0),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RESP load generator (redis-benchmark equivalent)")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("-p", "--port", type=int, default=6379)
+    parser.add_argument("-c", "--clients", type=int, default=50, help="concurrent connections")
+    parser.add_argument("-P", "--pipeline", type=int, default=1, help="requests in flight per connection")
+    parser.add_argument("-n", "--requests", type=int, default=100000, help="requests per workload")
+    parser.add_argument("-t", "--tests", default=",".join(WORKLOADS),
+                        help="comma separated workloads: " + ", ".join(WORKLOADS))
+    parser.add_argument("-d", "--data-size", type=int, default=3, help="SET value size in bytes")
+    parser.add_argument("-r", "--keyspace", type=int, default=100000, help="number of distinct keys")
+    parser.add_argument("--set-ratio", type=float, default=0.5, help="share of SETs in the mixed workload")
+    parser.add_argument("--processes", type=int, default=1, help="client processes to spread connections over")
+    options = parser.parse_args()
+
+    workloads = options.tests.lower().split(",")
+    for workload in workloads:
+        if workload not in WORKLOADS:
+            sys.exit(f"unknown workload {workload!r}, expected one of {', '.join(WORKLOADS)}")
+    results = [
+        run_benchmark(workload, options.host, options.port, options.clients, options.pipeline,
+                      options.requests, options.keyspace, options.data_size, options.set_ratio,
+                      options.processes)
+        for workload in workloads
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
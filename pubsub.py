@@ -0,0 +1,237 @@
+"""
+Pub/Sub for the selectors server: SUBSCRIBE, PSUBSCRIBE and PUBLISH.
+
+channels maps each channel to the clients subscribed to it, a dict used as
+an insertion-ordered set. Pattern subscriptions are indexed by their literal
+prefix (the part before the first wildcard), so PUBLISH only runs the
+compiled globs of patterns whose prefix the channel starts with: one dict
+lookup per distinct prefix length instead of one match per pattern.
+
+PUBLISH encodes the message frame once per channel and once per matching
+pattern, and appends that same bytes object to every subscriber's output
+queue, so fanning out to N subscribers costs N deque appends and no copies
+until the kernel takes the data. The subscribers are flushed together in
+before_sleep() like any other client with replies.
+
+A subscriber that does not read would make its queue grow without bound, so
+subscribed clients get their own output limits, like Redis'
+"client-output-buffer-limit pubsub 32mb 8mb 60": they are disconnected as
+soon as more than the hard limit is queued, or once they have stayed over
+the soft limit for longer than the soft limit seconds.
+"""
+from resp import resp_array, resp_bulk_string, resp_integer
+from scan import GLOB_SPECIAL, compile_glob
+
+MESSAGE_HEADER = b"*3\r\n$7\r\nmessage\r\n"
+PMESSAGE_HEADER = b"*4\r\n$8\r\npmessage\r\n"
+
+# The commands a client may send while it has subscriptions
+SUBSCRIBED_COMMANDS = frozenset((b"SUBSCRIBE", b"UNSUBSCRIBE", b"PSUBSCRIBE", b"PUNSUBSCRIBE", b"PING"))
+
+
+def literal_prefix(pattern):
+    """The part of a glob pattern before its first special character."""
+    for i, byte in enumerate(pattern):
+        if byte in GLOB_SPECIAL:
+            return pattern[:i]
+    return pattern
+
+
+def subscription_reply(kind, name, count):
+    """One (un)subscribe confirmation: [kind, channel or pattern (None: nil), subscriptions left]."""
+    name = b"$-1\r\n" if name is None else resp_bulk_string(name)
+    return b"*3\r\n" + resp_bulk_string(kind) + name + resp_integer(count)
+
+
+class PatternSubscription:
+    """The clients subscribed to one glob pattern."""
+
+    __slots__ = ("pattern", "match", "clients")
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.match = compile_glob(pattern)
+        self.clients = {}
+
+
+class PubSub:
+    """Channel and pattern subscriptions of every client, and message fan-out."""
+
+    def __init__(self, pending_write, normal_limit, hard_limit, soft_limit, soft_seconds):
+        # Subscribers that got a message are added here to be flushed in before_sleep()
+        self.pending_write = pending_write
+        self.normal_limit = normal_limit
+        self.hard_limit = hard_limit
+        self.soft_limit = soft_limit
+        self.soft_seconds = soft_seconds
+        self.channels = {}
+        self.patterns = {}
+        # Literal prefix -> {pattern: PatternSubscription}
+        self.prefixes = {}
+        # Length of the literal prefixes in use -> number of patterns with it
+        self.prefix_lengths = {}
+        # Client -> the channels and patterns it is subscribed to
+        self.client_channels = {}
+        self.client_patterns = {}
+
+    def is_subscribed(self, client):
+        """True if client has at least one channel or pattern subscription."""
+        return client in self.client_channels or client in self.client_patterns
+
+    def subscription_count(self, client):
+        """Number of channels and patterns client is subscribed to."""
+        return len(self.client_channels.get(client, ())) + len(self.client_patterns.get(client, ()))
+
+    def _enter(self, client):
+        """Switches a client that had no subscriptions to the subscriber output limits."""
+        if not self.is_subscribed(client):
+            client.output_limit = self.hard_limit
+            client.soft_limit = self.soft_limit
+            client.soft_limit_seconds = self.soft_seconds
+
+    def _leave(self, client):
+        """Restores the normal output limits once a client has no subscriptions left."""
+        if not self.is_subscribed(client):
+            client.output_limit = self.normal_limit
+            client.soft_limit = 0
+            client.soft_limit_since = None
+
+    def subscribe(self, client, channels):
+        """SUBSCRIBE: returns one confirmation per channel."""
+        self._enter(client)
+        subscribed = self.client_channels.setdefault(client, set())
+        replies = []
+        for channel in channels:
+            if channel not in subscribed:
+                subscribed.add(channel)
+                self.channels.setdefault(channel, {})[client] = None
+            replies.append(subscription_reply(b"subscribe", channel, self.subscription_count(client)))
+        return b"".join(replies)
+
+    def unsubscribe(self, client, channels):
+        """UNSUBSCRIBE: from the given channels, or from all of them when none are given."""
+        subscribed = self.client_channels.get(client, set())
+        if not channels:
+            channels = list(subscribed)
+            if not channels:
+                return subscription_reply(b"unsubscribe", None, self.subscription_count(client))
+        replies = []
+        for channel in channels:
+            if channel in subscribed:
+                subscribed.discard(channel)
+                clients = self.channels[channel]
+                del clients[client]
+                if not clients:
+                    del self.channels[channel]
+            if not subscribed:
+                self.client_channels.pop(client, None)
+            replies.append(subscription_reply(b"unsubscribe", channel, self.subscription_count(client)))
+        self._leave(client)
+        return b"".join(replies)
+
+    def psubscribe(self, client, patterns):
+        """PSUBSCRIBE: returns one confirmation per pattern."""
+        self._enter(client)
+        subscribed = self.client_patterns.setdefault(client, set())
+        replies = []
+        for pattern in patterns:
+            if pattern not in subscribed:
+                subscribed.add(pattern)
+                subscription = self.patterns.get(pattern)
+                if subscription is None:
+                    subscription = self.patterns[pattern] = PatternSubscription(pattern)
+                    prefix = literal_prefix(pattern)
+                    self.prefixes.setdefault(prefix, {})[pattern] = subscription
+                    self.prefix_lengths[len(prefix)] = self.prefix_lengths.get(len(prefix), 0) + 1
+                subscription.clients[client] = None
+            replies.append(subscription_reply(b"psubscribe", pattern, self.subscription_count(client)))
+        return b"".join(replies)
+
+    def punsubscribe(self, client, patterns):
+        """PUNSUBSCRIBE: from the given patterns, or from all of them when none are given."""
+        subscribed = self.client_patterns.get(client, set())
+        if not patterns:
+            patterns = list(subscribed)
+            if not patterns:
+                return subscription_reply(b"punsubscribe", None, self.subscription_count(client))
+        replies = []
+        for pattern in patterns:
+            if pattern in subscribed:
+                subscribed.discard(pattern)
+                subscription = self.patterns[pattern]
+                del subscription.clients[client]
+                if not subscription.clients:
+                    self._drop_pattern(pattern)
+            if not subscribed:
+                self.client_patterns.pop(client, None)
+            replies.append(subscription_reply(b"punsubscribe", pattern, self.subscription_count(client)))
+        self._leave(client)
+        return b"".join(replies)
+
+    def _drop_pattern(self, pattern):
+        """Removes a pattern nobody is subscribed to any more from the indexes."""
+        del self.patterns[pattern]
+        prefix = literal_prefix(pattern)
+        by_pattern = self.prefixes[prefix]
+        del by_pattern[pattern]
+        if not by_pattern:
+            del self.prefixes[prefix]
+        length = len(prefix)
+        self.prefix_lengths[length] -= 1
+        if not self.prefix_lengths[length]:
+            del self.prefix_lengths[length]
+
+    def client_closed(self, client):
+        """Drops every subscription of a disconnected client."""
+        self.unsubscribe(client, None)
+        self.punsubscribe(client, None)
+
+    def publish(self, channel, message):
+        """Queues message for every subscriber of channel and of matching patterns. Returns how many got it."""
+        receivers = 0
+        clients = self.channels.get(channel)
+        if clients:
+            frame = MESSAGE_HEADER + resp_bulk_string(channel) + resp_bulk_string(message)
+            receivers += self._deliver(clients, frame)
+        if self.prefix_lengths:
+            payload = None
+            # A copy too: the last pattern of a length can go with such a client
+            for length in tuple(self.prefix_lengths):
+                by_pattern = self.prefixes.get(channel[:length])
+                if by_pattern is None:
+                    continue
+                # Copied, since a client closed for its output limit leaves its patterns
+                for subscription in list(by_pattern.values()):
+                    if subscription.match(channel):
+                        if payload is None:
+                            payload = resp_bulk_string(channel) + resp_bulk_string(message)
+                        frame = PMESSAGE_HEADER + resp_bulk_string(subscription.pattern) + payload
+                        receivers += self._deliver(subscription.clients, frame)
+        return receivers
+
+    def _deliver(self, clients, frame):
+        """Appends the shared frame to the output queue of each client."""
+        # A copy, since a client closed for its output limit unsubscribes itself
+        clients = tuple(clients)
+        for client in clients:
+            client.write(frame)
+        self.pending_write.update(clients)
+        return len(clients)
+
+    def ping(self, args):
+        """PING from a subscribed client, which gets a ["pong", message] array instead of +PONG."""
+        return resp_array([b"pong", args[1] if len(args) > 1 else b""])
+
+    def channel_list(self, pattern=None):
+        """PUBSUB CHANNELS [pattern]: the channels with subscribers."""
+        if pattern is None:
+            return list(self.channels)
+        match = compile_glob(pattern)
+        return [channel for channel in self.channels if match(channel)]
+
+    def numsub(self, channels):
+        """PUBSUB NUMSUB: the reply [channel, subscriber count, ...] for the given channels."""
+        parts = [b"*%d\r\n" % (2 * len(channels))]
+        for channel in channels:
+            parts.append(resp_bulk_string(channel) + resp_integer(len(self.channels.get(channel, ()))))
+        return b"".join(parts)
@@ -0,0 +1,397 @@
+"""
+Streaming reader and writer for Redis RDB snapshot files.
+
+The file is memory-mapped and decoded in place, one entry at a time, so a
+multi-GB dump is never copied into a single Python bytes object. Only string
+values are loaded into the keyspace; other value types are skipped over.
+
+Snapshots are written to a temporary file in the target directory and moved
+into place with an atomic rename, so a crash mid-save never leaves a torn
+dump behind. BackgroundSave does this from a forked child, whose copy-on-write
+view of the keyspace stays frozen while the parent keeps serving clients.
+"""
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+# Opcodes that can appear where a value type is expected
+OPCODE_FUNCTION2 = 0xF5
+OPCODE_MODULE_AUX = 0xF7
+OPCODE_IDLE = 0xF8
+OPCODE_FREQ = 0xF9
+OPCODE_AUX = 0xFA
+OPCODE_RESIZEDB = 0xFB
+OPCODE_EXPIRETIME_MS = 0xFC
+OPCODE_EXPIRETIME = 0xFD
+OPCODE_SELECTDB = 0xFE
+OPCODE_EOF = 0xFF
+
+# Value types
+TYPE_STRING = 0
+TYPE_LIST = 1
+TYPE_SET = 2
+TYPE_ZSET = 3
+TYPE_HASH = 4
+TYPE_ZSET_2 = 5
+TYPE_LIST_QUICKLIST = 14
+TYPE_LIST_QUICKLIST_2 = 18
+# Types whose whole payload is a single (ziplist/intset/listpack) string.
+# Streams (15, 19 and 21) and module values (6, 7) are not, and are rejected.
+SINGLE_STRING_TYPES = {9, 10, 11, 12, 13, 16, 17, 20}
+
+# Version written into the header of the snapshots we produce
+RDB_VERSION = b"0011"
+
+# Flush the write buffer to the file every this many bytes
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Special string encodings (length byte with the top two bits set)
+ENC_INT8 = 0
+ENC_INT16 = 1
+ENC_INT32 = 2
+ENC_LZF = 3
+
+
+class RdbError(Exception):
+    """Raised when an RDB file is truncated or uses an unsupported feature."""
+
+
+class RdbReader:
+    """Cursor over the bytes of an RDB file (an mmap or any bytes-like object)."""
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+        self.size = len(buf)
+
+    def read(self, n):
+        """Return the next n bytes."""
+        end = self.pos + n
+        if end > self.size:
+            raise RdbError("unexpected end of RDB file")
+        data = self.buf[self.pos:end]
+        self.pos = end
+        return data
+
+    def read_byte(self):
+        """Return the next byte as an int."""
+        if self.pos >= self.size:
+            raise RdbError("unexpected end of RDB file")
+        byte = self.buf[self.pos]
+        self.pos += 1
+        return byte
+
+    def read_uint_le(self, n):
+        """Return an n-byte little-endian unsigned integer."""
+        return int.from_bytes(self.read(n), "little")
+
+    def read_length(self):
+        """
+        Decodes RDB length encoding.
+        Returns (length, is_encoded): when is_encoded is True the "length" is
+        one of the ENC_* special string encodings instead.
+        """
+        first = self.read_byte()
+        kind = first >> 6
+        if kind == 0:
+            return first & 0x3F, False
+        if kind == 1:
+            return ((first & 0x3F) << 8) | self.read_byte(), False
+        if kind == 3:
+            return first & 0x3F, True
+        if first == 0x80:
+            return int.from_bytes(self.read(4), "big"), False
+        if first == 0x81:
+            return int.from_bytes(self.read(8), "big"), False
+        raise RdbError(f"invalid length encoding 0x{first:02x}")
+
+    def read_plain_length(self):
+        """Reads a length that must not use a special encoding."""
+        length, is_encoded = self.read_length()
+        if is_encoded:
+            raise RdbError("unexpected string encoding where a length was expected")
+        return length
+
+    def read_string(self):
+        """Reads a length-prefixed, integer-encoded or LZF-compressed string."""
+        length, is_encoded = self.read_length()
+        if not is_encoded:
+            return self.read(length)
+        if length == ENC_INT8:
+            return str(int.from_bytes(self.read(1), "little", signed=True)).encode()
+        if length == ENC_INT16:
+            return str(int.from_bytes(self.read(2), "little", signed=True)).encode()
+        if length == ENC_INT32:
+            return str(int.from_bytes(self.read(4), "little", signed=True)).encode()
+        if length == ENC_LZF:
+            compressed_len = self.read_plain_length()
+            uncompressed_len = self.read_plain_length()
+            return lzf_decompress(self.read(compressed_len), uncompressed_len)
+        raise RdbError(f"unknown string encoding {length}")
+
+    def skip_value(self, value_type):
+        """Steps over a value of a type the keyspace cannot hold."""
+        if value_type in SINGLE_STRING_TYPES:
+            self.read_string()
+        elif value_type in (TYPE_LIST, TYPE_SET, TYPE_LIST_QUICKLIST):
+            for _ in range(self.read_plain_length()):
+                self.read_string()
+        elif value_type == TYPE_HASH:
+            for _ in range(self.read_plain_length() * 2):
+                self.read_string()
+        elif value_type == TYPE_ZSET:
+            for _ in range(self.read_plain_length()):
+                self.read_string()
+                # Score stored as a string with a one-byte length
+                score_len = self.read_byte()
+                if score_len < 253:
+                    self.read(score_len)
+        elif value_type == TYPE_ZSET_2:
+            for _ in range(self.read_plain_length()):
+                self.read_string()
+                self.read(8)  # Binary double score
+        elif value_type == TYPE_LIST_QUICKLIST_2:
+            for _ in range(self.read_plain_length()):
+                self.read_plain_length()  # Container type
+                self.read_string()
+        else:
+            raise RdbError(f"unsupported value type {value_type}")
+
+
+def lzf_decompress(data, expected_len):
+    """
+    Decompresses an LZF block as written by Redis.
+    Literal runs are copied as slices, back-references byte by byte when
+    they overlap the output they are copying from.
+    """
+    out = bytearray()
+    i = 0
+    n = len(data)
+    while i < n:
+        ctrl = data[i]
+        i += 1
+        if ctrl < 32:
+            # Literal run of ctrl + 1 bytes
+            length = ctrl + 1
+            out += data[i:i + length]
+            i += length
+        else:
+            # Back-reference: 3 high bits are the length, the rest the offset
+            length = ctrl >> 5
+            if length == 7:
+                length += data[i]
+                i += 1
+            length += 2
+            start = len(out) - ((ctrl & 0x1F) << 8) - data[i] - 1
+            i += 1
+            if start < 0:
+                raise RdbError("invalid LZF back-reference")
+            if start + length <= len(out):
+                out += out[start:start + length]
+            else:
+                for k in range(length):
+                    out.append(out[start + k])
+    if len(out) != expected_len:
+        raise RdbError("LZF data does not match its uncompressed length")
+    return bytes(out)
+
+
+def iter_rdb(buf):
+    """
+    Yields (db_number, key, value, expire_ms) for every string key in an RDB
+    image. expire_ms is None for keys without an expiry.
+    """
+    reader = RdbReader(buf)
+    magic = reader.read(9)
+    if magic[:5] != b"REDIS" or not magic[5:].isdigit():
+        raise RdbError("not an RDB file")
+
+    db_number = 0
+    expire_ms = None
+    while True:
+        opcode = reader.read_byte()
+        if opcode == OPCODE_EOF:
+            # An 8-byte CRC64 checksum may follow; it is not verified here
+            return
+        if opcode == OPCODE_SELECTDB:
+            db_number = reader.read_plain_length()
+        elif opcode == OPCODE_RESIZEDB:
+            # Table size hints; Python dicts cannot be presized, so skip them
+            reader.read_plain_length()
+            reader.read_plain_length()
+        elif opcode == OPCODE_AUX:
+            reader.read_string()
+            reader.read_string()
+        elif opcode == OPCODE_EXPIRETIME_MS:
+            expire_ms = reader.read_uint_le(8)
+        elif opcode == OPCODE_EXPIRETIME:
+            expire_ms = reader.read_uint_le(4) * 1000
+        elif opcode == OPCODE_IDLE:
+            reader.read_plain_length()
+        elif opcode == OPCODE_FREQ:
+            reader.read_byte()
+        elif opcode in (OPCODE_MODULE_AUX, OPCODE_FUNCTION2):
+            raise RdbError("module and function data is not supported")
+        else:
+            # Anything else is the value type of a key/value pair
+            key = reader.read_string()
+            if opcode == TYPE_STRING:
+                yield db_number, key, reader.read_string(), expire_ms
+            else:
+                reader.skip_value(opcode)
+            expire_ms = None
+
+
+def load_rdb(path, database, expiry, key_filter=None):
+    """
+    Loads the string keys of database 0 from the RDB file at path into the
+    database and expiry dictionaries. Keys that have already expired are
+    dropped, and so are keys for which key_filter (if given) returns False.
+    Returns the number of keys loaded (0 if the file does not exist).
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return 0
+    now = int(time.time() * 1000)
+    loaded = 0
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for db_number, key, value, expire_ms in iter_rdb(mm):
+                if db_number != 0:
+                    continue
+                if key_filter is not None and not key_filter(key):
+                    continue
+                if expire_ms is not None and expire_ms <= now:
+                    continue
+                database[key] = value
+                if expire_ms is not None:
+                    expiry[key] = expire_ms
+                loaded += 1
+    return loaded
+
+
+def encode_length(n):
+    """RDB length encoding for a plain (non-negative) length."""
+    if n < 1 << 6:
+        return bytes([n])
+    if n < 1 << 14:
+        return bytes([0x40 | (n >> 8), n & 0xFF])
+    if n < 1 << 32:
+        return b"\x80" + n.to_bytes(4, "big")
+    return b"\x81" + n.to_bytes(8, "big")
+
+
+def encode_string(value):
+    """
+    Encodes a string the way Redis does: small canonical integers such as
+    b'1234' are stored as 1, 2 or 4 byte integers, everything else is
+    length-prefixed.
+    """
+    if 0 < len(value) <= 11 and (value[0] == 45 or 48 <= value[0] <= 57):  # '-' or digit
+        try:
+            number = int(value)
+        except ValueError:
+            number = None
+        if number is not None and str(number).encode() == value:
+            if -(1 << 7) <= number < 1 << 7:
+                return bytes([0xC0 | ENC_INT8]) + number.to_bytes(1, "little", signed=True)
+            if -(1 << 15) <= number < 1 << 15:
+                return bytes([0xC0 | ENC_INT16]) + number.to_bytes(2, "little", signed=True)
+            if -(1 << 31) <= number < 1 << 31:
+                return bytes([0xC0 | ENC_INT32]) + number.to_bytes(4, "little", signed=True)
+    return encode_length(len(value)) + value
+
+
+def default_mode():
+    """Permissions of a new file under the current umask (mkstemp makes them owner-only)."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def write_rdb(path, database, expiry):
+    """
+    Writes database and expiry as an RDB snapshot at path.
+    Entries are batched into a large buffer before each write() call, the
+    file is fsynced, and it only replaces path once it is complete.
+    """
+    directory = os.path.dirname(path) or "."
+    fd, temp_path = tempfile.mkstemp(prefix="temp-", suffix=".rdb", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            buf = bytearray(b"REDIS" + RDB_VERSION)
+            buf += bytes([OPCODE_AUX]) + encode_string(b"redis-ver") + encode_string(b"7.2.0")
+            buf += bytes([OPCODE_AUX]) + encode_string(b"ctime") + encode_string(str(int(time.time())).encode())
+            if database:
+                buf += bytes([OPCODE_SELECTDB]) + encode_length(0)
+                buf += bytes([OPCODE_RESIZEDB]) + encode_length(len(database)) + encode_length(len(expiry))
+            for key, value in database.items():
+                expire_ms = expiry.get(key)
+                if expire_ms is not None:
+                    buf += bytes([OPCODE_EXPIRETIME_MS]) + expire_ms.to_bytes(8, "little")
+                buf += b"\x00"  # TYPE_STRING
+                buf += encode_string(key)
+                buf += encode_string(value)
+                if len(buf) >= WRITE_BUFFER_SIZE:
+                    f.write(buf)
+                    buf.clear()
+            # EOF marker and a zero checksum, which readers treat as "not computed"
+            buf += bytes([OPCODE_EOF]) + bytes(8)
+            f.write(buf)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, default_mode())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+class BackgroundSave:
+    """
+    A snapshot being written in the background.
+    Uses a forked child where os.fork exists; elsewhere the keyspace is
+    copied (a fast C-level dict copy) and written from a thread.
+    write is the function that writes the file, write_rdb by default.
+    """
+
+    def __init__(self, path, database, expiry, write=write_rdb):
+        self.pid = None
+        self.thread = None
+        self.succeeded = None  # None while running, then True or False
+        if hasattr(os, "fork"):
+            self.pid = os.fork()
+            if self.pid == 0:
+                # Child process: never return into the parent's event loop
+                status = 1
+                try:
+                    write(path, database, expiry)
+                    status = 0
+                except Exception as err:
+                    print(f"Background save failed: {err}")
+                finally:
+                    os._exit(status)
+        else:
+            self.thread = threading.Thread(
+                target=self._run, args=(write, path, dict(database), dict(expiry)), daemon=True
+            )
+            self.thread.start()
+
+    def _run(self, write, path, database, expiry):
+        """Thread body for platforms without fork."""
+        try:
+            write(path, database, expiry)
+            self.succeeded = True
+        except Exception as err:
+            print(f"Background save failed: {err}")
+            self.succeeded = False
+
+    def poll(self):
+        """Returns None while the save is running, then whether it succeeded."""
+        if self.succeeded is None and self.pid is not None:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid:
+                self.succeeded = os.waitstatus_to_exitcode(status) == 0
+        return self.succeeded
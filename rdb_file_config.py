@@ -2,171 +2,743 @@ import socket
 import selectors
 import time
 import sys  # For reading command-line arguments
+import os
+import platform
+
+try:
+    import resource  # Peak memory for INFO; not available on Windows
+except ImportError:
+    resource = None
+
+import asyncio_server
+from aof import FSYNC_POLICIES, AofError, AppendOnlyFile, load_aof, write_aof_base
+from commands import COMMANDS, call_command, command, lookup_command, write_listeners
+from connection import Connection, DeferredReply, DEFAULT_OUTPUT_BUFFER_LIMIT, client_stats
+from evict import POLICIES
+import keyspace
+from keyspace import (
+    STORAGE_ENGINES, active_expire_cycle, configure_eviction, eviction, eviction_cron,
+    flush_keyspace, rebuild_indexes, scan_cron, stats, use_storage,
+)
+from latency import LATENCY_PERCENTILES, slowlog
+from pubsub import SUBSCRIBED_COMMANDS, PubSub
+from rdb import BackgroundSave, load_rdb, write_rdb
+from replication import READONLY_ERROR, Follower, Leader
+import transactions
+from resp import ProtocolError, resp_array, resp_bulk_string, resp_integer
+from workers import CROSSSLOT_ERROR, Cluster, run_workers
 
 sel = selectors.DefaultSelector()
 
-# This dictionary will store our key-value pairs in memory
-database = {}
-# This dictionary will store expiry times for keys (in milliseconds since epoch)
-expiry = {}
+HOST = 'localhost'
+
+# Used for uptime in INFO
+start_time = time.time()
+
+# Set in --workers mode: which keys this process owns and links to the other workers
+cluster = None
+
+# The open AppendOnlyFile when appendonly is enabled
+aof = None
+
+# Replication stream and backlog for our followers (selectors engine, single process)
+leader = None
+
+# Link to our leader when started with --replicaof
+follower = None
+
+# Channel and pattern subscriptions (selectors engine, single process)
+pubsub = None
+
+# Clients with new replies; flushed in before_sleep() after the AOF is written
+clients_pending_write = set()
+
+# How many bytes to pull off a socket per read event
+RECV_SIZE = 64 * 1024
+
+# How often (in seconds) the event loop runs server_cron() for background jobs
+CRON_INTERVAL = 0.1
+
+# Share of each cron tick the active expire cycle may use (Redis uses 25%)
+ACTIVE_EXPIRE_CYCLE_BUDGET = CRON_INTERVAL * 0.25
 
-# Default values for dir and dbfilename
+# Default values for dir, dbfilename and the other server settings
 config = {
     b"dir": b".",           # Default directory is current directory
-    b"dbfilename": b"dump.rdb"  # Default filename
+    b"dbfilename": b"dump.rdb",  # Default filename
+    b"port": b"6379",
+    # Number of SO_REUSEPORT worker processes sharing the keyspace (1 = single process)
+    b"workers": b"1",
+    # Event loop implementation: "selectors" or "asyncio" (uses uvloop when installed)
+    b"engine": b"selectors",
+    # Keyspace storage: "dict" or "compact" (less memory per key, more CPU per command)
+    b"storage": b"dict",
+    # Disconnect a client once this many reply bytes are queued for it (0 = no limit)
+    b"client-output-buffer-limit": str(DEFAULT_OUTPUT_BUFFER_LIMIT).encode(),
+    # "<hard> <soft> <seconds>" limits for Pub/Sub subscribers: disconnect one with more
+    # than <hard> bytes queued, or with more than <soft> for over <seconds> seconds
+    b"client-output-buffer-limit-pubsub": b"32mb 8mb 60",
+    # Snapshot after <seconds> if at least <changes> writes happened ("" disables)
+    b"save": b"3600 1 300 100 60 10000",
+    # Log commands slower than this many microseconds (negative disables)
+    b"slowlog-log-slower-than": b"10000",
+    # Number of entries kept by the slow log
+    b"slowlog-max-len": b"128",
+    # Log every write command to the append-only file ("yes" or "no")
+    b"appendonly": b"no",
+    b"appendfilename": b"appendonly.aof",
+    # When to fsync the AOF: "always", "everysec" or "no"
+    b"appendfsync": b"everysec",
+    # Rewrite the AOF once it grew by this percentage since the last rewrite (0 disables)...
+    b"auto-aof-rewrite-percentage": b"100",
+    # ...and is at least this many bytes
+    b"auto-aof-rewrite-min-size": str(64 * 1024 * 1024).encode(),
+    # Evict keys (or refuse writes) once the keyspace uses more than this, e.g. 100mb (0 = no limit)
+    b"maxmemory": b"0",
+    # noeviction, allkeys-lru, allkeys-lfu, volatile-lru, volatile-lfu or volatile-ttl
+    b"maxmemory-policy": b"noeviction",
+    # Keys sampled to pick each LRU/LFU victim; more is closer to exact but slower
+    b"maxmemory-samples": b"5",
+    # "<host> <port>" of the leader to replicate from ("" = we are a leader)
+    b"replicaof": b"",
+    # Stream bytes kept so a follower that reconnects can continue without a full resync
+    b"repl-backlog-size": b"1mb",
+    # A follower drops the link after this many seconds without data from its leader
+    b"repl-timeout": b"60",
+}
+
+# Snapshot bookkeeping
+persistence = {
+    "lastsave": int(time.time()),    # Unix time of the last successful save
+    "lastsave_ok": True,             # Whether the last save attempt succeeded
+    "lastsave_try": 0,               # Unix time of the last save attempt
+    "bgsave": None,                  # BackgroundSave in progress, if any
+    "dirty_at_bgsave": 0,            # Value of dirty when the running BGSAVE started
+    "aof_rewrite_scheduled": False,  # BGREWRITEAOF waiting for a BGSAVE to finish
 }
 
 def parse_args():
     """
-    Parses command-line arguments to set config['dir'] and config['dbfilename'].
+    Parses command-line arguments of the form --<name> <value> into config.
     Example: --dir /tmp/redis-files --dbfilename dump.rdb
     """
     args = sys.argv[1:]  # Skip the script name
     i = 0
     while i < len(args):
-        if args[i] == "--dir" and i + 1 < len(args):
-            config[b"dir"] = args[i + 1].encode()
-            i += 2
-        elif args[i] == "--dbfilename" and i + 1 < len(args):
-            config[b"dbfilename"] = args[i + 1].encode()
+        name = args[i][2:].encode()
+        if name == b"replicaof" and i + 2 < len(args) and args[i + 2].isdigit():
+            # --replicaof <host> <port>, also accepted as one "<host> <port>" value
+            config[name] = f"{args[i + 1]} {args[i + 2]}".encode()
+            i += 3
+        elif args[i].startswith("--") and name in config and i + 1 < len(args):
+            config[name] = args[i + 1].encode()
             i += 2
         else:
             i += 1
 
-def accept(sock):
+def memory_to_bytes(value):
+    """Parses a memory amount like b'100mb' or b'1g' the way redis.conf does."""
+    units = {b"b": 1, b"k": 1000, b"kb": 1024, b"m": 1000 ** 2, b"mb": 1024 ** 2,
+             b"g": 1000 ** 3, b"gb": 1024 ** 3}
+    value = value.strip().lower()
+    digits = value.rstrip(b"kmgb")
+    unit = value[len(digits):] or b"b"
+    if unit not in units:
+        raise ValueError(f"unknown memory unit {unit.decode()!r}")
+    return int(digits) * units[unit]
+
+def apply_config():
+    """Pushes config values into the modules that use them."""
+    storage = config[b"storage"].decode()
+    if storage not in STORAGE_ENGINES:
+        sys.exit(f"storage must be one of {', '.join(STORAGE_ENGINES)}")
+    use_storage(storage)
+    slowlog.configure(int(config[b"slowlog-log-slower-than"]), int(config[b"slowlog-max-len"]))
+    policy = config[b"maxmemory-policy"].lower()
+    if policy not in POLICIES:
+        sys.exit(f"maxmemory-policy must be one of {', '.join(p.decode() for p in POLICIES)}")
+    try:
+        maxmemory = memory_to_bytes(config[b"maxmemory"])
+    except ValueError:
+        sys.exit(f"Invalid maxmemory value {config[b'maxmemory'].decode()!r}")
+    configure_eviction(maxmemory, policy, int(config[b"maxmemory-samples"]))
+
+def rdb_path():
+    """Full path of the RDB file named by config['dir'] and config['dbfilename']."""
+    return os.fsdecode(os.path.join(config[b"dir"], config[b"dbfilename"]))
+
+def load_snapshot(path=None, key_filter=None):
+    """Populate database and expiry from the RDB file, if there is one."""
+    path = path or rdb_path()
+    start = time.perf_counter()
+    loaded = load_rdb(path, keyspace.database, keyspace.expiry, key_filter)
+    rebuild_indexes()
+    if loaded:
+        elapsed = time.perf_counter() - start
+        print(f"Loaded {loaded} keys from {path} in {elapsed:.3f} seconds")
+
+def aof_path():
+    """Full path of the append-only file named by config['dir'] and config['appendfilename']."""
+    return os.fsdecode(os.path.join(config[b"dir"], config[b"appendfilename"]))
+
+def load_append_only_file(path):
+    """Rebuild the keyspace by replaying every command in the AOF."""
+    start = time.perf_counter()
+    try:
+        count = load_aof(path, lambda args: call_command(None, args))
+    except AofError as err:
+        sys.exit(f"{err} ({path})")
+    rebuild_indexes()
+    # The replayed writes are already on disk
+    stats["dirty"] = 0
+    elapsed = time.perf_counter() - start
+    print(f"Replayed {count} commands from {path} in {elapsed:.3f} seconds")
+
+def load_data(path=None, key_filter=None):
+    """
+    Loads the keyspace at startup and opens the AOF when appendonly is on.
+    With an AOF it is the only source; without one the RDB file is loaded and
+    written out as the first AOF, so no data is lost on the next start.
+    """
+    global aof
+    if config[b"appendonly"] != b"yes":
+        load_snapshot(path, key_filter)
+        return
+    if config[b"appendfsync"] not in FSYNC_POLICIES:
+        sys.exit("appendfsync must be one of always, everysec, no")
+    append_path = aof_path()
+    if os.path.exists(append_path):
+        load_append_only_file(append_path)
+    else:
+        load_snapshot(path, key_filter)
+        write_aof_base(append_path, keyspace.database, keyspace.expiry)
+    aof = AppendOnlyFile(append_path, config[b"appendfsync"])
+    write_listeners.append(aof.feed)
+
+def load_full_sync(path):
+    """Replaces the keyspace with the snapshot our leader sent."""
+    flush_keyspace()
+    load_rdb(path, keyspace.database, keyspace.expiry)
+    rebuild_indexes()
+    stats["dirty"] = 0
+    if aof is not None:
+        # The AOF still describes the old keyspace
+        rewrite_aof()
+
+def setup_replication():
+    """Prepares the leader side and, with --replicaof, the link to our leader."""
+    global leader, follower
+    try:
+        backlog_size = memory_to_bytes(config[b"repl-backlog-size"])
+    except ValueError:
+        sys.exit(f"Invalid repl-backlog-size value {config[b'repl-backlog-size'].decode()!r}")
+    sync_path = os.fsdecode(os.path.join(config[b"dir"], b"temp-repl-%d.rdb" % os.getpid()))
+    leader = Leader(backlog_size, sync_path)
+    write_listeners.append(leader.feed)
+    if config[b"replicaof"]:
+        try:
+            host, port = config[b"replicaof"].decode().split()
+            port = int(port)
+        except ValueError:
+            sys.exit("replicaof must be given as <host> <port>")
+        follower = Follower(
+            host, port, sel, int(config[b"port"]), rdb_path(), int(config[b"repl-timeout"]),
+            lambda args: call_command(None, args), load_full_sync,
+        )
+
+def setup_pubsub():
+    """Enables Pub/Sub with the subscriber output limits from the config."""
+    global pubsub
+    try:
+        hard, soft, seconds = config[b"client-output-buffer-limit-pubsub"].split()
+        limits = memory_to_bytes(hard), memory_to_bytes(soft), int(seconds)
+    except ValueError:
+        sys.exit("client-output-buffer-limit-pubsub must be given as <hard> <soft> <seconds>")
+    pubsub = PubSub(clients_pending_write, int(config[b"client-output-buffer-limit"]), *limits)
+
+def replication_cron():
+    """Sends snapshots and pings to followers, and keeps the link to our leader up."""
+    if leader is not None:
+        leader.cron()
+    if follower is not None:
+        follower.cron()
+
+def save_params():
+    """Parses config['save'] into a list of (seconds, changes) pairs."""
+    numbers = [int(n) for n in config[b"save"].split()]
+    return list(zip(numbers[::2], numbers[1::2]))
+
+def save():
+    """Synchronous SAVE: write the snapshot from inside the event loop."""
+    persistence["lastsave_try"] = int(time.time())
+    try:
+        write_rdb(rdb_path(), keyspace.database, keyspace.expiry)
+    except Exception as err:
+        print(f"Save failed: {err}")
+        persistence["lastsave_ok"] = False
+        return False
+    stats["dirty"] = 0
+    persistence["lastsave"] = int(time.time())
+    persistence["lastsave_ok"] = True
+    return True
+
+def bgsave():
+    """Starts a background snapshot unless a snapshot or AOF rewrite is running."""
+    if persistence["bgsave"] is not None or (aof is not None and aof.rewrite is not None):
+        return False
+    persistence["lastsave_try"] = int(time.time())
+    persistence["dirty_at_bgsave"] = stats["dirty"]
+    persistence["bgsave"] = BackgroundSave(rdb_path(), keyspace.database, keyspace.expiry)
+    print("Background saving started")
+    return True
+
+def snapshot_cron():
+    """Finish a running BGSAVE and start a new one when a save rule fires."""
+    job = persistence["bgsave"]
+    if job is not None:
+        succeeded = job.poll()
+        if succeeded is None:
+            return
+        persistence["bgsave"] = None
+        persistence["lastsave_ok"] = succeeded
+        if succeeded:
+            # Writes that arrived during the save still need to be persisted
+            stats["dirty"] -= persistence["dirty_at_bgsave"]
+            persistence["lastsave"] = int(time.time())
+            print("Background saving terminated with success")
+
+    now = int(time.time())
+    # After a failed save, wait a little before trying again
+    if not persistence["lastsave_ok"] and now - persistence["lastsave_try"] < 5:
+        return
+    for seconds, changes in save_params():
+        if stats["dirty"] >= changes and now - persistence["lastsave"] >= seconds:
+            print(f"{changes} changes in {seconds} seconds. Saving...")
+            bgsave()
+            break
+
+def rewrite_aof():
+    """Starts a background AOF rewrite, or schedules it while a BGSAVE runs."""
+    if persistence["bgsave"] is not None:
+        persistence["aof_rewrite_scheduled"] = True
+        return
+    persistence["aof_rewrite_scheduled"] = False
+    if aof.start_rewrite(keyspace.database, keyspace.expiry):
+        print("Background append only file rewriting started")
+
+def aof_cron():
+    """Finish a running AOF rewrite and start one when scheduled or the file grew enough."""
+    if aof is None:
+        return
+    finished = aof.rewrite_cron()
+    if finished is not None:
+        print("Background AOF rewrite " + ("finished successfully" if finished else "failed"))
+    if aof.rewrite is not None or persistence["bgsave"] is not None:
+        return
+    if persistence["aof_rewrite_scheduled"]:
+        rewrite_aof()
+        return
+    percentage = int(config[b"auto-aof-rewrite-percentage"])
+    if percentage and aof.size >= int(config[b"auto-aof-rewrite-min-size"]):
+        base = aof.base_size or 1
+        growth = (aof.size - base) * 100 // base
+        if growth >= percentage:
+            print(f"Starting automatic rewriting of AOF on {growth}% growth")
+            rewrite_aof()
+
+def server_cron():
+    """Periodic work run from the event loop: expire keys and handle snapshots and the AOF."""
+    active_expire_cycle(ACTIVE_EXPIRE_CYCLE_BUDGET)
+    eviction_cron()
+    scan_cron()
+    snapshot_cron()
+    aof_cron()
+    replication_cron()
+
+def accept(sock, mask):
     """Accept a new client connection and register it for reading."""
     conn, addr = sock.accept()
     print(f"Accepted connection from {addr}")
     conn.setblocking(False)
-    sel.register(conn, selectors.EVENT_READ, read)
+    if conn.family != socket.AF_UNIX:
+        # Replies can go out in several writes (e.g. around forwarded commands),
+        # so don't let Nagle's algorithm hold them back
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    client = Connection(conn, sel, read, int(config[b"client-output-buffer-limit"]))
+    client.on_close = client_closed
+
+def client_closed(client):
+    """Forgets the subscriptions, queued commands and watched keys of a closed connection."""
+    if pubsub is not None and pubsub.is_subscribed(client):
+        pubsub.client_closed(client)
+    if client in transactions.clients:
+        transactions.reset(client)
 
-def read(conn):
-    """Read data from a client socket, process the command, and send a response."""
+def read(client):
+    """
+    Read data from a client socket, process every complete command in the
+    connection buffer, and queue all of the replies as one write.
+    """
     try:
-        data = conn.recv(1024)
-        if data:
-            response = handle_command(data)
-            conn.sendall(response)
-        else:
-            print("Closing connection")
-            sel.unregister(conn)
-            conn.close()
+        data = client.sock.recv(RECV_SIZE)
+    except BlockingIOError:
+        return
     except ConnectionResetError:
-        sel.unregister(conn)
-        conn.close()
+        client.close()
+        return
+    if not data:
+        print("Closing connection")
+        client.close()
+        return
 
-def parse_resp_array(data):
+    client.parser.feed(data)
+    responses = []
+    try:
+        for args in client.parser.commands():
+            reply = handle_command(client, args)
+            if isinstance(reply, DeferredReply):
+                # Keep replies in order around the one another worker will send
+                client.write(b''.join(responses))
+                client.write(reply)
+                responses = []
+            else:
+                responses.append(reply)
+    except ProtocolError as err:
+        # Answer what was parsed, report the error and hang up like Redis does
+        responses.append(b'-ERR Protocol error: ' + str(err).encode() + b'\r\n')
+        client.close_after_flush = True
+    if responses:
+        client.write(b''.join(responses))
+    # Sent from before_sleep(), after the writes made here are in the AOF
+    clients_pending_write.add(client)
+
+def handle_command(client, args):
     """
-    Parses a RESP array from bytes and returns a list of byte strings.
-    Example input: b'*2\r\n$4\r\nECHO\r\n$3\r\nhey\r\n'
-    Output: [b'ECHO', b'hey']
+    Runs one parsed command through the shared command table.
+    Returns a RESP-compliant response, or a DeferredReply when the keys
+    belong to another worker and the command was forwarded there.
     """
-    parts = data.split(b'\r\n')
-    parts = [p for p in parts if p != b'']
-    if not parts or not parts[0].startswith(b'*'):
-        return None
-    items = []
-    idx = 1
-    while idx < len(parts):
-        if parts[idx].startswith(b'$'):
-            length = int(parts[idx][1:])
-            value = parts[idx + 1]
-            items.append(value)
-            idx += 2
+    if cluster is not None:
+        owner = cluster.route(args)
+        if owner is not None:
+            if owner < 0:
+                return CROSSSLOT_ERROR
+            return cluster.forward(owner, client, args)
+    if pubsub is not None and pubsub.is_subscribed(client):
+        # As in Redis (RESP2), a subscribed client can only manage its subscriptions
+        name = args[0].upper()
+        if name not in SUBSCRIBED_COMMANDS:
+            return (b"-ERR Can't execute '" + args[0].lower() + b"': only (P)SUBSCRIBE / "
+                    b"(P)UNSUBSCRIBE / PING are allowed in this context\r\n")
+        if name == b'PING':
+            return pubsub.ping(args)
+    error = None
+    if follower is not None:
+        # Our data comes from the leader; clients may only read
+        cmd = lookup_command(args[0])
+        if cmd is not None and 'write' in cmd.flags:
+            error = READONLY_ERROR
+    if transactions.clients and transactions.in_multi(client):
+        if args[0].upper() not in transactions.IMMEDIATE_COMMANDS:
+            return transactions.queue(client, args, error)
+    if error is not None:
+        return error
+    return call_command(client, args)
+
+@command(b'CONFIG', -2, 'admin')
+def config_command(client, args):
+    """CONFIG GET <parameter>"""
+    if len(args) == 3 and args[1].upper() == b'GET':
+        param = args[2].lower()
+        if param in config:
+            # Return RESP array: [param, value]
+            return resp_array([param, config[param]])
         else:
-            idx += 1
-    return items
+            # If unknown parameter, return empty array
+            return b'*0\r\n'
+    else:
+        return b'-ERR wrong number of arguments for \'config get\' command\r\n'
 
-def resp_bulk_string(value):
-    """Helper to encode a value as a RESP bulk string."""
-    return b'$' + str(len(value)).encode() + b'\r\n' + value + b'\r\n'
+def human_bytes(n):
+    """Formats a byte count the way INFO does, e.g. 1.50M."""
+    for unit in ("B", "K", "M", "G"):
+        if n < 1024 or unit == "G":
+            return f"{n}{unit}" if unit == "B" else f"{n:.2f}{unit}"
+        n /= 1024
 
-def resp_array(items):
-    """Helper to encode a list of RESP bulk strings as a RESP array."""
-    resp = b'*' + str(len(items)).encode() + b'\r\n'
-    for item in items:
-        resp += resp_bulk_string(item)
-    return resp
+def memory_usage():
+    """Returns (rss_bytes, peak_rss_bytes) of this process, 0 where unknown."""
+    rss = 0
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    peak = 0
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        if sys.platform != "darwin":
+            peak *= 1024
+    return rss, max(peak, rss)
 
-def handle_command(data):
-    """
-    Parses RESP input and handles PING, ECHO, SET, GET, and CONFIG GET commands.
-    Also supports PX expiry for SET.
-    Returns a RESP-compliant response.
-    """
-    args = parse_resp_array(data)
-    if not args or len(args) == 0:
-        return b'-ERR unknown command\r\n'
+def info_sections():
+    """Builds every INFO section as {name: [(field, value), ...]}."""
+    uptime = int(time.time() - start_time)
+    rss, peak = memory_usage()
+    sections = {}
+    sections["server"] = [
+        ("redis_version", "7.2.0"),
+        ("redis_mode", "standalone"),
+        ("os", f"{platform.system()} {platform.release()} {platform.machine()}"),
+        ("python_version", platform.python_version()),
+        ("process_id", os.getpid()),
+        ("tcp_port", int(config[b"port"])),
+        ("server_time_usec", time.time_ns() // 1000),
+        ("uptime_in_seconds", uptime),
+        ("uptime_in_days", uptime // 86400),
+    ]
+    if cluster is not None:
+        sections["server"] += [("worker_id", cluster.worker_id), ("workers", cluster.num_workers)]
+    sections["clients"] = [
+        ("connected_clients", client_stats["connected_clients"]),
+    ]
+    sections["memory"] = [
+        ("used_memory", stats["used_memory"]),
+        ("used_memory_human", human_bytes(stats["used_memory"])),
+        ("used_memory_rss", rss),
+        ("used_memory_rss_human", human_bytes(rss)),
+        ("used_memory_peak", peak),
+        ("used_memory_peak_human", human_bytes(peak)),
+        ("maxmemory", eviction["maxmemory"]),
+        ("maxmemory_human", human_bytes(eviction["maxmemory"])),
+        ("maxmemory_policy", eviction["policy"].decode()),
+    ]
+    sections["persistence"] = [
+        ("rdb_changes_since_last_save", stats["dirty"]),
+        ("rdb_bgsave_in_progress", int(persistence["bgsave"] is not None)),
+        ("rdb_last_save_time", persistence["lastsave"]),
+        ("rdb_last_bgsave_status", "ok" if persistence["lastsave_ok"] else "err"),
+        ("aof_enabled", int(aof is not None)),
+        ("aof_rewrite_in_progress", int(aof is not None and aof.rewrite is not None)),
+        ("aof_rewrite_scheduled", int(persistence["aof_rewrite_scheduled"])),
+    ]
+    if aof is not None:
+        sections["persistence"] += [
+            ("aof_last_bgrewrite_status", "ok" if aof.last_rewrite_ok else "err"),
+            ("aof_last_write_status", "ok" if aof.last_write_ok else "err"),
+            ("aof_current_size", aof.size),
+            ("aof_base_size", aof.base_size),
+            ("aof_buffer_length", len(aof.buffer)),
+        ]
+    sections["replication"] = [("role", "slave" if follower is not None else "master")]
+    if follower is not None:
+        sections["replication"] += follower.info()
+    if leader is not None:
+        sections["replication"] += leader.info()
+    sections["stats"] = [
+        ("total_connections_received", client_stats["total_connections_received"]),
+        ("total_commands_processed", sum(cmd.stats.calls for cmd in COMMANDS.values())),
+        ("expired_keys", stats["expired_keys"]),
+        ("expire_cycle_time_cap_reached_count", stats["expire_cycle_time_cap_reached"]),
+        ("evicted_keys", stats["evicted_keys"]),
+        ("client_output_buffer_limit_disconnections", client_stats["client_output_buffer_limit_disconnections"]),
+        ("pubsub_channels", len(pubsub.channels) if pubsub is not None else 0),
+        ("pubsub_patterns", len(pubsub.patterns) if pubsub is not None else 0),
+    ]
+    sections["keyspace"] = []
+    if keyspace.database:
+        keys, expires = len(keyspace.database), len(keyspace.expiry)
+        sections["keyspace"].append(("db0", f"keys={keys},expires={expires},avg_ttl=0"))
+    sections["commandstats"] = []
+    sections["latencystats"] = []
+    for cmd in COMMANDS.values():
+        cs = cmd.stats
+        if not cs.calls and not cs.rejected_calls:
+            continue
+        name = cmd.name.lower().decode()
+        per_call = cs.duration_ns / 1000 / cs.calls if cs.calls else 0.0
+        sections["commandstats"].append((
+            f"cmdstat_{name}",
+            f"calls={cs.calls},usec={cs.usec},usec_per_call={per_call:.2f},"
+            f"rejected_calls={cs.rejected_calls},failed_calls={cs.failed_calls}",
+        ))
+        if cs.calls:
+            percentiles = ",".join(f"p{p:g}={cs.percentile(p):.3f}" for p in LATENCY_PERCENTILES)
+            sections["latencystats"].append((f"latency_percentiles_usec_{name}", percentiles))
+    return sections
 
-    cmd = args[0].upper()
+# Sections INFO returns without arguments (commandstats and latencystats need "all")
+DEFAULT_INFO_SECTIONS = ("server", "clients", "memory", "persistence", "stats", "replication", "keyspace")
 
-    if cmd == b'PING':
-        if len(args) > 1:
-            msg = args[1]
-            return resp_bulk_string(msg)
-        else:
-            return b'+PONG\r\n'
-    elif cmd == b'ECHO':
-        if len(args) == 2:
-            msg = args[1]
-            return resp_bulk_string(msg)
-        else:
-            return b'-ERR wrong number of arguments for \'echo\' command\r\n'
-    elif cmd == b'SET':
-        if len(args) >= 3:
-            key = args[1]
-            value = args[2]
-            database[key] = value
-            if key in expiry:
-                del expiry[key]
-            if len(args) >= 5 and args[3].upper() == b'PX':
-                try:
-                    px_ms = int(args[4])
-                    expiry[key] = int(time.time() * 1000) + px_ms
-                except ValueError:
-                    return b'-ERR PX value is not an integer\r\n'
-            return b'+OK\r\n'
-        else:
-            return b'-ERR wrong number of arguments for \'set\' command\r\n'
-    elif cmd == b'GET':
-        if len(args) == 2:
-            key = args[1]
-            if key in expiry:
-                now = int(time.time() * 1000)
-                if now >= expiry[key]:
-                    if key in database:
-                        del database[key]
-                    del expiry[key]
-                    return b'$-1\r\n'
-            if key in database:
-                value = database[key]
-                return resp_bulk_string(value)
-            else:
-                return b'$-1\r\n'
-        else:
-            return b'-ERR wrong number of arguments for \'get\' command\r\n'
-    elif cmd == b'CONFIG':
-        # Handle CONFIG GET <parameter>
-        if len(args) == 3 and args[1].upper() == b'GET':
-            param = args[2].lower()
-            # Only support "dir" and "dbfilename"
-            if param in config:
-                # Return RESP array: [param, value]
-                return resp_array([param, config[param]])
-            else:
-                # If unknown parameter, return empty array
-                return b'*0\r\n'
-        else:
-            return b'-ERR wrong number of arguments for \'config get\' command\r\n'
-    else:
-        return b'-ERR unknown command\r\n'
+@command(b'INFO', -1, 'admin')
+def info_command(client, args):
+    """INFO [section ...]"""
+    sections = info_sections()
+    wanted = [arg.lower().decode(errors="replace") for arg in args[1:]]
+    if not wanted or wanted == ["default"]:
+        wanted = DEFAULT_INFO_SECTIONS
+    elif "all" in wanted or "everything" in wanted:
+        wanted = list(sections)
+    lines = []
+    for name in wanted:
+        if name not in sections:
+            continue
+        if lines:
+            lines.append("")
+        lines.append(f"# {name.capitalize()}")
+        lines.extend(f"{field}:{value}" for field, value in sections[name])
+    return resp_bulk_string("\r\n".join(lines).encode() + b"\r\n")
 
-def main():
-    # Parse command-line arguments for dir and dbfilename
-    parse_args()
-    host, port = 'localhost', 6379
+@command(b'SAVE', 1, 'admin')
+def save_command(client, args):
+    """SAVE: write the snapshot synchronously."""
+    if persistence["bgsave"] is not None:
+        return b'-ERR Background save already in progress\r\n'
+    if save():
+        return b'+OK\r\n'
+    return b'-ERR Error saving DB on disk\r\n'
+
+@command(b'BGSAVE', 1, 'admin')
+def bgsave_command(client, args):
+    """BGSAVE: write the snapshot from a background process."""
+    if aof is not None and aof.rewrite is not None:
+        return b'-ERR Another child process is active (AOF?): can\'t BGSAVE right now\r\n'
+    if bgsave():
+        return b'+Background saving started\r\n'
+    return b'-ERR Background save already in progress\r\n'
+
+@command(b'BGREWRITEAOF', 1, 'admin')
+def bgrewriteaof_command(client, args):
+    """BGREWRITEAOF: compact the append-only file from a background process."""
+    if aof is None:
+        return b'-ERR The append only file is not enabled (appendonly no)\r\n'
+    if aof.rewrite is not None:
+        return b'-ERR Background append only file rewriting already in progress\r\n'
+    rewrite_aof()
+    if persistence["aof_rewrite_scheduled"]:
+        return b'+Background append only file rewriting scheduled\r\n'
+    return b'+Background append only file rewriting started\r\n'
+
+@command(b'REPLCONF', -2, 'admin')
+def replconf_command(client, args):
+    """REPLCONF listening-port <port> | ACK <offset>: sent by followers."""
+    if leader is None:
+        return b'-ERR Replication needs the selectors engine in single-process mode\r\n'
+    return leader.replconf(client, args)
+
+@command(b'PSYNC', 3, 'admin')
+def psync_command(client, args):
+    """PSYNC <replid> <offset>: a follower asks for the stream from offset on."""
+    if leader is None:
+        return b'-ERR Replication needs the selectors engine in single-process mode\r\n'
+    try:
+        offset = int(args[2])
+    except ValueError:
+        return b'-ERR value is not an integer or out of range\r\n'
+    return leader.psync(client, args[1], offset)
+
+TRANSACTIONS_UNSUPPORTED_ERROR = b'-ERR Transactions are not supported with --workers\r\n'
+
+@command(b'MULTI', 1, 'fast')
+def multi_command(client, args):
+    """MULTI: queue the following commands until EXEC."""
+    if cluster is not None or client is None:
+        return TRANSACTIONS_UNSUPPORTED_ERROR
+    return transactions.multi(client)
+
+@command(b'EXEC', 1)
+def exec_command(client, args):
+    """EXEC: run the queued commands as one atomic batch."""
+    if cluster is not None or client is None:
+        return TRANSACTIONS_UNSUPPORTED_ERROR
+    return transactions.exec_transaction(client)
+
+@command(b'DISCARD', 1, 'fast')
+def discard_command(client, args):
+    """DISCARD: drop the queued commands."""
+    if cluster is not None or client is None:
+        return TRANSACTIONS_UNSUPPORTED_ERROR
+    return transactions.discard(client)
+
+@command(b'WATCH', -2, 'fast', first_key=1, last_key=-1)
+def watch_command(client, args):
+    """WATCH key [key ...]: make the next EXEC fail if any of the keys changes first."""
+    if cluster is not None or client is None:
+        return TRANSACTIONS_UNSUPPORTED_ERROR
+    return transactions.watch(client, args[1:])
+
+@command(b'UNWATCH', 1, 'fast')
+def unwatch_command(client, args):
+    """UNWATCH: forget every watched key."""
+    if cluster is not None or client is None:
+        return TRANSACTIONS_UNSUPPORTED_ERROR
+    return transactions.unwatch(client)
+
+PUBSUB_UNSUPPORTED_ERROR = b'-ERR Pub/Sub needs the selectors engine in single-process mode\r\n'
+
+@command(b'SUBSCRIBE', -2, 'pubsub')
+def subscribe_command(client, args):
+    """SUBSCRIBE channel [channel ...]"""
+    if pubsub is None or client is None:
+        return PUBSUB_UNSUPPORTED_ERROR
+    return pubsub.subscribe(client, args[1:])
+
+@command(b'UNSUBSCRIBE', -1, 'pubsub')
+def unsubscribe_command(client, args):
+    """UNSUBSCRIBE [channel ...]"""
+    if pubsub is None or client is None:
+        return PUBSUB_UNSUPPORTED_ERROR
+    return pubsub.unsubscribe(client, args[1:])
+
+@command(b'PSUBSCRIBE', -2, 'pubsub')
+def psubscribe_command(client, args):
+    """PSUBSCRIBE pattern [pattern ...]"""
+    if pubsub is None or client is None:
+        return PUBSUB_UNSUPPORTED_ERROR
+    return pubsub.psubscribe(client, args[1:])
+
+@command(b'PUNSUBSCRIBE', -1, 'pubsub')
+def punsubscribe_command(client, args):
+    """PUNSUBSCRIBE [pattern ...]"""
+    if pubsub is None or client is None:
+        return PUBSUB_UNSUPPORTED_ERROR
+    return pubsub.punsubscribe(client, args[1:])
+
+@command(b'PUBLISH', 3, 'pubsub', 'fast')
+def publish_command(client, args):
+    """PUBLISH channel message: returns the number of clients that received it."""
+    if pubsub is None:
+        return PUBSUB_UNSUPPORTED_ERROR
+    return resp_integer(pubsub.publish(args[1], args[2]))
+
+@command(b'PUBSUB', -2, 'pubsub')
+def pubsub_command(client, args):
+    """PUBSUB CHANNELS [pattern] | NUMSUB [channel ...] | NUMPAT"""
+    if pubsub is None:
+        return PUBSUB_UNSUPPORTED_ERROR
+    sub = args[1].upper()
+    if sub == b'CHANNELS' and len(args) <= 3:
+        return resp_array(pubsub.channel_list(args[2] if len(args) == 3 else None))
+    if sub == b'NUMSUB':
+        return pubsub.numsub(args[2:])
+    if sub == b'NUMPAT' and len(args) == 2:
+        return resp_integer(len(pubsub.patterns))
+    return b'-ERR unknown subcommand or wrong number of arguments for \'pubsub\'\r\n'
+
+@command(b'LASTSAVE', 1, 'fast')
+def lastsave_command(client, args):
+    """LASTSAVE: Unix time of the last successful save."""
+    return resp_integer(persistence["lastsave"])
+
+def listen(reuse_port=False):
+    """Creates the client listening socket and registers it with the selector."""
+    host, port = HOST, int(config[b"port"])
     server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        # Every worker binds the same port; the kernel balances connections
+        server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     server_sock.bind((host, port))
     server_sock.listen()
     server_sock.setblocking(False)
@@ -174,11 +746,89 @@ def main():
 
     print(f"Server listening on {host}:{port}")
 
+def before_sleep():
+    """Work done right before the event loop waits for new events."""
+    if aof is not None:
+        # One write() for every command of this iteration, before any client sees a reply
+        aof.flush()
+    if clients_pending_write:
+        for client in clients_pending_write:
+            client.flush()
+        clients_pending_write.clear()
+    if cluster is not None:
+        # Send everything forwarded during this iteration in one write per worker
+        cluster.flush()
+    if leader is not None:
+        # The AOF is written by now, so followers never get ahead of it
+        leader.flush()
+
+def event_loop():
+    """Dispatches selector events and runs server_cron() every CRON_INTERVAL."""
+    next_cron = time.monotonic()
     while True:
-        events = sel.select(timeout=None)
+        before_sleep()
+        # Wake up at least every CRON_INTERVAL so background jobs make progress
+        events = sel.select(timeout=CRON_INTERVAL)
         for key, mask in events:
             callback = key.data
-            callback(key.fileobj)
+            callback(key.fileobj, mask)
+        if time.monotonic() >= next_cron:
+            server_cron()
+            next_cron = time.monotonic() + CRON_INTERVAL
+
+def start_worker(worker_id, num_workers, peer_listener, peer_paths):
+    """Entry point of one --workers process: load its shard and serve clients."""
+    global cluster, sel
+    # The parent's epoll instance is shared with every forked worker, so each needs its own
+    sel.close()
+    sel = selectors.DefaultSelector()
+    cluster = Cluster(worker_id, num_workers, peer_paths, sel)
+
+    # Each worker snapshots its own shard, e.g. dump-0-of-4.rdb and appendonly-0-of-4.aof
+    base, ext = os.path.splitext(config[b"dbfilename"])
+    config[b"dbfilename"] = b"%s-%d-of-%d%s" % (base, worker_id, num_workers, ext)
+    aof_base, aof_ext = os.path.splitext(config[b"appendfilename"])
+    config[b"appendfilename"] = b"%s-%d-of-%d%s" % (aof_base, worker_id, num_workers, aof_ext)
+    if os.path.exists(rdb_path()):
+        load_data()
+    else:
+        # First start in this layout: take our keys from the single-process dump
+        unsharded = os.fsdecode(os.path.join(config[b"dir"], base + ext))
+        load_data(unsharded, cluster.owns)
+
+    peer_listener.setblocking(False)
+    sel.register(peer_listener, selectors.EVENT_READ, accept)
+    listen(reuse_port=True)
+    event_loop()
+
+def main():
+    # Parse command-line arguments for dir, dbfilename and the other settings
+    parse_args()
+    apply_config()
+    engine = config[b"engine"]
+    if engine not in (b"selectors", b"asyncio"):
+        sys.exit(f"Unknown engine {engine.decode()!r}, expected selectors or asyncio")
+    num_workers = int(config[b"workers"])
+    if num_workers > 1:
+        if engine != b"selectors":
+            sys.exit("--workers is only supported by the selectors engine")
+        if config[b"replicaof"]:
+            sys.exit("--replicaof is not supported with --workers")
+        run_workers(num_workers, start_worker)
+        return
+    if config[b"replicaof"] and engine != b"selectors":
+        sys.exit("--replicaof is only supported by the selectors engine")
+    load_data()
+    if engine == b"asyncio":
+        asyncio_server.run_server(
+            HOST, int(config[b"port"]), handle_command, server_cron, before_sleep, CRON_INTERVAL,
+            int(config[b"client-output-buffer-limit"]), client_closed,
+        )
+        return
+    setup_replication()
+    setup_pubsub()
+    listen()
+    event_loop()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,490 @@
+"""
+Leader/follower replication (--replicaof host port).
+
+The stream a leader sends its followers is simply every write command
+that changed the keyspace, RESP-encoded once (the same args the AOF gets
+through write_listeners). Its position is the replication offset: the
+number of stream bytes produced so far.
+
+A follower connects, sends PSYNC with the leader's replication id and the
+offset it has applied, and either gets
+
+- +CONTINUE: the leader still has everything after that offset in its
+  backlog, a fixed-size ring buffer of the latest stream bytes, and sends
+  it followed by the live stream; or
+- +FULLRESYNC <replid> <offset>: the leader forks a snapshot (an RDB file
+  in its dir), buffers the stream from that offset on, and sends the file
+  as one $<length> bulk followed by the buffered stream. Followers that
+  ask while a snapshot is being written share it. The file is streamed
+  from disk a chunk at a time as the link drains, and the follower writes
+  it to disk as it arrives, so neither side holds it in memory.
+
+Followers are read-only for their clients, apply the stream with
+call_command(), answer nothing back except REPLCONF ACK <offset> once a
+second, and reconnect with PSYNC after a broken link or a silent leader.
+The leader PINGs its followers every REPL_PING_PERIOD seconds so a quiet
+keyspace is not mistaken for a dead link. Follower links are exempt from
+the client output buffer limit, which is meant for clients that stop
+reading replies. Only the selectors engine in single-process mode can
+replicate.
+"""
+import os
+import socket
+import time
+
+import keyspace
+from compact_store import int_value
+from connection import Connection
+from rdb import BackgroundSave
+from resp import CRLF, ProtocolError, RespParser, encode_command, reply_end
+
+# Follower states as shown by INFO, same names as Redis uses
+WAIT_BGSAVE = "wait_bgsave"
+SEND_BULK = "send_bulk"
+ONLINE = "online"
+
+# How often the leader pings its followers, and followers ack their offset
+REPL_PING_PERIOD = 10
+REPL_ACK_PERIOD = 1
+
+# Snapshot bytes read from disk at a time; more are read once the link drains
+REPL_SEND_CHUNK = 64 * 1024
+
+# Seconds a follower waits between connection attempts
+REPL_RETRY_PERIOD = 1
+
+# Timeout of the (blocking) connect to the leader
+REPL_CONNECT_TIMEOUT = 2
+
+READONLY_ERROR = b"-READONLY You can't write against a read only replica.\r\n"
+
+
+class Backlog:
+    """The last `size` bytes of the replication stream in a ring buffer."""
+
+    def __init__(self, size, offset):
+        self.buffer = bytearray(size)
+        self.size = size
+        self.end = offset   # Replication offset just past the newest byte
+        self.length = 0     # Bytes of history held, at most size
+
+    @property
+    def start(self):
+        """Replication offset of the oldest byte held."""
+        return self.end - self.length
+
+    def append(self, data):
+        """Adds stream bytes, overwriting the oldest ones once the buffer is full."""
+        size = self.size
+        self.end += len(data)
+        if len(data) >= size:
+            data = data[-size:]
+        pos = (self.end - len(data)) % size
+        first = min(len(data), size - pos)
+        self.buffer[pos:pos + first] = data[:first]
+        self.buffer[:len(data) - first] = data[first:]
+        self.length = min(size, self.length + len(data))
+
+    def read_from(self, offset):
+        """The stream bytes from offset to the end. The caller checks start <= offset <= end."""
+        count = self.end - offset
+        pos = offset % self.size
+        first = min(count, self.size - pos)
+        return bytes(self.buffer[pos:pos + first]) + bytes(self.buffer[:count - first])
+
+
+class Replica:
+    """A follower attached to this leader."""
+
+    __slots__ = ("conn", "state", "address", "listening_port", "ack_offset", "ack_time",
+                 "snapshot", "pending")
+
+    def __init__(self, conn, state, listening_port):
+        self.conn = conn
+        self.state = state
+        # A full sync queues far more than a client reply would
+        conn.output_limit = 0
+        conn.soft_limit = 0
+        try:
+            self.address = conn.sock.getpeername()[0]
+        except OSError:
+            self.address = "?"
+        self.listening_port = listening_port
+        self.ack_offset = 0
+        self.ack_time = time.monotonic()
+        self.snapshot = None   # Open snapshot file while in SEND_BULK
+        self.pending = []      # Stream produced while the snapshot is being sent
+
+    def close_snapshot(self):
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+
+class Leader:
+    """Replication stream, backlog and followers of this server."""
+
+    def __init__(self, backlog_size, sync_path):
+        self.replid = os.urandom(20).hex().encode()
+        self.offset = 0            # master_repl_offset
+        self.backlog_size = backlog_size
+        self.backlog = None        # Created when the first follower attaches
+        self.replicas = {}         # Connection -> Replica
+        self.listening_ports = {}  # REPLCONF listening-port seen before PSYNC, per connection
+        self.sync_path = sync_path
+        self.sync_job = None       # BackgroundSave writing the snapshot for a full sync
+        self.sync_offset = 0       # Replication offset the snapshot corresponds to
+        self.sync_buffer = []      # Stream produced since the snapshot was forked
+        self.last_ping = time.monotonic()
+
+    def feed(self, args):
+        """write_listeners hook: appends one write command to the stream."""
+        if self.backlog is None:
+            return
+        data = encode_command(args)
+        self.offset += len(data)
+        self.backlog.append(data)
+        if self.sync_job is not None:
+            self.sync_buffer.append(data)
+        for replica in self.replicas.values():
+            if replica.state == ONLINE:
+                replica.conn.write(data)
+            elif replica.state == SEND_BULK:
+                replica.pending.append(data)
+
+    def replconf(self, conn, args):
+        """REPLCONF from a follower. Returns the reply; ACK gets none."""
+        option = args[1].lower()
+        if option == b"ack" and len(args) == 3:
+            replica = self.replicas.get(conn)
+            offset = int_value(args[2])
+            # A malformed ACK is ignored, like any other ACK it gets no reply
+            if replica is not None and offset is not None:
+                replica.ack_offset = offset
+                replica.ack_time = time.monotonic()
+            return b""
+        if option == b"listening-port" and len(args) == 3:
+            port = int_value(args[2])
+            if port is None:
+                return b"-ERR value is not an integer or out of range\r\n"
+            self.listening_ports[conn] = port
+        return b"+OK\r\n"
+
+    def psync(self, conn, replid, offset):
+        """
+        PSYNC from a follower: the reply, plus the missing stream when it can
+        continue. A full resync gets its snapshot from cron() once it is written.
+        """
+        listening_port = self.listening_ports.pop(conn, 0)
+        if self.backlog is None:
+            self.backlog = Backlog(self.backlog_size, self.offset)
+        backlog = self.backlog
+        if replid == self.replid and backlog.start <= offset <= backlog.end:
+            self.replicas[conn] = Replica(conn, ONLINE, listening_port)
+            print(f"Partial resynchronization accepted, sending {backlog.end - offset} bytes of backlog")
+            return b"+CONTINUE " + self.replid + CRLF + backlog.read_from(offset)
+        self.replicas[conn] = Replica(conn, WAIT_BGSAVE, listening_port)
+        if self.sync_job is None:
+            self.sync_offset = self.offset
+            self.sync_buffer = []
+            self.sync_job = BackgroundSave(self.sync_path, keyspace.database, keyspace.expiry)
+            print("Starting BGSAVE for full resynchronization")
+        return b"+FULLRESYNC " + self.replid + b" " + str(self.sync_offset).encode() + CRLF
+
+    def cron(self):
+        """Sends finished snapshots, drops closed followers and pings the rest."""
+        for conn in [conn for conn in self.replicas if conn.closed]:
+            print("Connection with replica lost")
+            self.replicas.pop(conn).close_snapshot()
+        for conn in [conn for conn in self.listening_ports if conn.closed]:
+            del self.listening_ports[conn]
+        if self.sync_job is not None:
+            succeeded = self.sync_job.poll()
+            if succeeded is not None:
+                self._finish_sync(succeeded)
+        if self.replicas and time.monotonic() - self.last_ping >= REPL_PING_PERIOD:
+            self.last_ping = time.monotonic()
+            self.feed([b"PING"])
+
+    def _finish_sync(self, succeeded):
+        """Starts sending the snapshot, then the stream buffered since, to every waiting follower."""
+        self.sync_job = None
+        waiting = [r for r in self.replicas.values() if r.state == WAIT_BGSAVE]
+        if succeeded:
+            size = os.path.getsize(self.sync_path)
+            print(f"Background save for full resynchronization succeeded ({size} bytes), "
+                  f"sending it to {len(waiting)} replica(s)")
+        else:
+            print("Background save for full resynchronization failed")
+        for replica in waiting:
+            if not succeeded:
+                # The follower reconnects and asks again
+                replica.conn.close()
+                continue
+            # Each follower reads its own handle, which stays valid once the file is unlinked
+            replica.snapshot = open(self.sync_path, "rb")
+            replica.pending = list(self.sync_buffer)
+            replica.state = SEND_BULK
+            replica.conn.write(b"$" + str(size).encode() + CRLF)
+            self._send_snapshot(replica)
+        self.sync_buffer = []
+        try:
+            os.unlink(self.sync_path)
+        except OSError:
+            pass
+
+    def _send_snapshot(self, replica):
+        """
+        Queues snapshot chunks while the link keeps up, so at most about one
+        chunk waits in memory. Once the file is sent, the stream buffered
+        meanwhile follows and the follower is online.
+        """
+        conn = replica.conn
+        while not conn.closed and conn.output_size < REPL_SEND_CHUNK:
+            chunk = replica.snapshot.read(REPL_SEND_CHUNK)
+            if not chunk:
+                replica.close_snapshot()
+                for data in replica.pending:
+                    conn.write(data)
+                replica.pending = []
+                replica.state = ONLINE
+                print("Synchronization with replica succeeded")
+                return
+            conn.write(chunk)
+            conn.flush()
+
+    def flush(self):
+        """Pushes the stream queued during this loop iteration, and more snapshot, to the followers."""
+        for replica in self.replicas.values():
+            if replica.state == SEND_BULK:
+                self._send_snapshot(replica)
+            replica.conn.flush()
+
+    def info(self):
+        """Fields for the replication section of INFO."""
+        fields = [("connected_slaves", len(self.replicas))]
+        now = time.monotonic()
+        for i, replica in enumerate(self.replicas.values()):
+            fields.append((f"slave{i}", f"ip={replica.address},port={replica.listening_port},"
+                                        f"state={replica.state},offset={replica.ack_offset},"
+                                        f"lag={int(now - replica.ack_time)}"))
+        backlog = self.backlog
+        fields += [
+            ("master_replid", self.replid.decode()),
+            ("master_repl_offset", self.offset),
+            ("repl_backlog_active", int(backlog is not None)),
+            ("repl_backlog_size", self.backlog_size),
+            ("repl_backlog_first_byte_offset", backlog.start if backlog else 0),
+            ("repl_backlog_histlen", backlog.length if backlog else 0),
+        ]
+        return fields
+
+
+class Follower:
+    """
+    The link to our leader. execute(args) applies a streamed command and
+    load_snapshot(path) replaces the keyspace with a received snapshot.
+    """
+
+    def __init__(self, host, port, sel, listening_port, snapshot_path, timeout,
+                 execute, load_snapshot):
+        self.host = host
+        self.port = port
+        self.sel = sel
+        self.listening_port = listening_port
+        self.snapshot_path = snapshot_path
+        self.timeout = timeout
+        self.execute = execute
+        self.load_snapshot = load_snapshot
+        self.link = None
+        self.state = "connect"     # connect, handshake, transfer or connected
+        self.replid = b"?"
+        self.offset = -1           # Stream bytes applied; -1 before the first sync
+        self.buffer = bytearray()  # Handshake replies and stream bytes not yet applied
+        self.handshake_replies = 0
+        self.transfer_size = -1
+        self.transfer_left = 0     # Snapshot bytes still to come
+        self.transfer_file = None  # Temp file the snapshot is written to as it arrives
+        self.parser = None
+        # Commands streamed after a MULTI, run once its EXEC arrives
+        self.multi = None
+        self.last_io = 0.0
+        self.last_attempt = 0.0
+        self.last_ack = 0.0
+
+    def connect(self):
+        """Opens the link and sends the whole handshake in one go."""
+        self.last_attempt = time.monotonic()
+        if self.multi is not None:
+            # The link dropped inside a transaction: ask for all of it again
+            self.offset -= len(encode_command([b"MULTI"])) + sum(len(encode_command(args)) for args in self.multi)
+            self.multi = None
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=REPL_CONNECT_TIMEOUT)
+        except OSError as err:
+            print(f"Error connecting to leader {self.host}:{self.port}: {err}")
+            return
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.link = Connection(sock, self.sel, self.read, output_limit=0)
+        self.state = "handshake"
+        self.handshake_replies = 0
+        self.buffer = bytearray()
+        self.last_io = time.monotonic()
+        print(f"Connected to leader {self.host}:{self.port}, sending PSYNC {self.replid.decode()} {self.offset}")
+        self.link.write(
+            encode_command([b"PING"])
+            + encode_command([b"REPLCONF", b"listening-port", str(self.listening_port).encode()])
+            + encode_command([b"PSYNC", self.replid, str(self.offset).encode()])
+        )
+        self.link.flush()
+
+    def disconnect(self, reason):
+        """Closes the link; cron() reconnects and asks to continue where we stopped."""
+        print(f"Leader link lost: {reason}")
+        if self.link is not None:
+            self.link.close()
+        self.link = None
+        self.state = "connect"
+        if self.transfer_file is not None:
+            # Half a snapshot is no use: the next sync starts over
+            self.transfer_file.close()
+            os.unlink(self.transfer_file.name)
+            self.transfer_file = None
+
+    def read(self, conn):
+        """Selector callback for the link."""
+        try:
+            data = conn.sock.recv(64 * 1024)
+        except BlockingIOError:
+            return
+        except OSError as err:
+            self.disconnect(str(err))
+            return
+        if not data:
+            self.disconnect("connection closed by leader")
+            return
+        self.last_io = time.monotonic()
+        try:
+            self.received(data)
+        except (ProtocolError, ValueError, OSError) as err:
+            self.disconnect(str(err))
+
+    def received(self, data):
+        """Feeds bytes from the leader through the handshake, the snapshot and the stream."""
+        if self.state == "connected":
+            self.apply(data)
+            return
+        self.buffer += data
+        if self.state == "handshake":
+            # PING and REPLCONF get one reply each, then the PSYNC reply
+            while True:
+                end = reply_end(self.buffer)
+                if end < 0:
+                    return
+                reply = bytes(self.buffer[:end - 2])
+                del self.buffer[:end]
+                if reply.startswith(b"-"):
+                    raise ValueError(f"leader refused the handshake: {reply.decode(errors='replace')}")
+                self.handshake_replies += 1
+                if self.handshake_replies == 3:
+                    break
+            if not self.psync_reply(reply):
+                return
+        if self.state == "transfer":
+            if self.transfer_size < 0:
+                eol = self.buffer.find(CRLF)
+                if eol < 0:
+                    return
+                self.transfer_size = self.transfer_left = int(self.buffer[1:eol])
+                del self.buffer[:eol + 2]
+                self.transfer_file = open(f"{self.snapshot_path}.{os.getpid()}.tmp", "wb")
+            take = min(len(self.buffer), self.transfer_left)
+            self.transfer_file.write(self.buffer[:take])
+            del self.buffer[:take]
+            self.transfer_left -= take
+            if self.transfer_left:
+                return
+            self.finish_transfer()
+        if self.buffer:
+            rest, self.buffer = bytes(self.buffer), bytearray()
+            self.apply(rest)
+
+    def psync_reply(self, reply):
+        """Handles +FULLRESYNC or +CONTINUE. Returns False if the reply is not understood."""
+        words = reply.split()
+        if words[0] == b"+FULLRESYNC":
+            self.replid, self.offset = words[1], int(words[2])
+            self.state = "transfer"
+            self.transfer_size = -1
+            print(f"Full resync from leader: {self.replid.decode()}:{self.offset}")
+            return True
+        if words[0] == b"+CONTINUE":
+            self.state = "connected"
+            self.parser = RespParser()
+            print("Partial resynchronization accepted by leader")
+            return True
+        self.disconnect(f"unexpected PSYNC reply {reply.decode(errors='replace')}")
+        return False
+
+    def finish_transfer(self):
+        """Makes the received snapshot our RDB file and loads it."""
+        temp_path = self.transfer_file.name
+        self.transfer_file.close()
+        self.transfer_file = None
+        os.replace(temp_path, self.snapshot_path)
+        start = time.perf_counter()
+        self.load_snapshot(self.snapshot_path)
+        elapsed = time.perf_counter() - start
+        print(f"Loaded {self.transfer_size} byte snapshot from leader in {elapsed:.3f} seconds")
+        self.state = "connected"
+        self.parser = RespParser()
+
+    def apply(self, data):
+        """
+        Runs every complete streamed command and advances the offset by the
+        bytes consumed. A MULTI ... EXEC block is run when its EXEC arrives.
+        """
+        parser = self.parser
+        parser.feed(data)
+        before = len(parser.buffer)
+        for args in parser.commands():
+            if self.multi is not None:
+                if args[0] == b"EXEC":
+                    for queued in self.multi:
+                        self.execute(queued)
+                    self.multi = None
+                else:
+                    self.multi.append(args)
+            elif args[0] == b"MULTI":
+                self.multi = []
+            else:
+                self.execute(args)
+        self.offset += before - len(parser.buffer)
+
+    def cron(self):
+        """Connects or reconnects, acks our offset and notices a silent leader."""
+        now = time.monotonic()
+        if self.link is None or self.link.closed:
+            self.link = None
+            if now - self.last_attempt >= REPL_RETRY_PERIOD:
+                self.connect()
+            return
+        if now - self.last_io > self.timeout:
+            self.disconnect(f"no data from leader for {self.timeout} seconds")
+            return
+        if self.state == "connected" and now - self.last_ack >= REPL_ACK_PERIOD:
+            self.last_ack = now
+            self.link.write(encode_command([b"REPLCONF", b"ACK", str(self.offset).encode()]))
+            self.link.flush()
+
+    def info(self):
+        """Fields for the replication section of INFO."""
+        return [
+            ("master_host", self.host),
+            ("master_port", self.port),
+            ("master_link_status", "up" if self.state == "connected" else "down"),
+            ("master_last_io_seconds_ago", int(time.monotonic() - self.last_io) if self.link else -1),
+            ("master_sync_in_progress", int(self.state == "transfer")),
+            ("slave_repl_offset", self.offset),
+        ]
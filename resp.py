@@ -0,0 +1,196 @@
+"""
+Incremental RESP (REdis Serialization Protocol) parser.
+
+Every client connection owns one RespParser. Bytes read from the socket are
+appended with feed(), and commands() yields every complete command that is
+sitting in the buffer. A frame that has only partly arrived stays in the
+buffer until the next read completes it, so pipelined batches, values
+containing \r\n and commands split across TCP segments all work.
+"""
+
+CRLF = b"\r\n"
+
+# Limits borrowed from Redis so a bad client cannot make us buffer forever
+MAX_MULTIBULK_LENGTH = 1024 * 1024
+MAX_BULK_LENGTH = 512 * 1024 * 1024
+MAX_INLINE_LENGTH = 64 * 1024
+
+
+class ProtocolError(Exception):
+    """Raised when a client sends bytes that are not valid RESP."""
+
+
+class RespParser:
+    """Per-connection buffer that turns a byte stream into argument lists."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        # Smallest buffer size that could complete the pending frame, so a
+        # large value arriving in many segments is not re-parsed every time
+        self.needed = 0
+
+    def feed(self, data):
+        """Append freshly received bytes to the buffer."""
+        self.buffer += data
+
+    def commands(self):
+        """
+        Yields each complete command in the buffer as a list of byte strings.
+        Example buffer: b'*1\r\n$4\r\nPING\r\n*2\r\n$4\r\nECHO\r\n$2\r\nhi\r\n'
+        Yields: [b'PING'], then [b'ECHO', b'hi']
+        Consumed bytes are dropped from the buffer once the caller stops iterating.
+        """
+        buf = self.buffer
+        if len(buf) < self.needed:
+            return
+        self.needed = 0
+        view = memoryview(buf)
+        pos = 0
+        try:
+            while pos < len(buf):
+                if buf[pos] == 42:  # b'*'
+                    args, end = self._parse_multibulk(buf, view, pos)
+                else:
+                    args, end = self._parse_inline(buf, pos)
+                if args is None:
+                    # Incomplete frame: remember how much more we need
+                    self.needed = end - pos
+                    break
+                pos = end
+                if args:
+                    yield args
+        finally:
+            # The view has to be released before the bytearray can shrink
+            view.release()
+            if pos:
+                del buf[:pos]
+
+    def _parse_multibulk(self, buf, view, pos):
+        """
+        Parses one '*<count>' array of '$<len>' bulk strings starting at pos.
+        Returns (args, end) on success or (None, needed) if more data is required.
+        """
+        eol = buf.find(CRLF, pos)
+        if eol < 0:
+            if len(buf) - pos > MAX_INLINE_LENGTH:
+                raise ProtocolError("too big mbulk count string")
+            return None, len(buf) + 1
+        count = _parse_length(buf, pos + 1, eol, "invalid multibulk length")
+        if count > MAX_MULTIBULK_LENGTH:
+            raise ProtocolError("invalid multibulk length")
+        pos = eol + 2
+
+        args = []
+        for _ in range(count):
+            if pos >= len(buf):
+                return None, pos + 1
+            if buf[pos] != 36:  # b'$'
+                raise ProtocolError(f"expected '$', got '{chr(buf[pos])}'")
+            eol = buf.find(CRLF, pos)
+            if eol < 0:
+                if len(buf) - pos > MAX_INLINE_LENGTH:
+                    raise ProtocolError("too big bulk count string")
+                return None, len(buf) + 1
+            length = _parse_length(buf, pos + 1, eol, "invalid bulk length")
+            if length < 0 or length > MAX_BULK_LENGTH:
+                raise ProtocolError("invalid bulk length")
+            start = eol + 2
+            stop = start + length
+            if stop + 2 > len(buf):
+                # Wait until the whole value and its trailing CRLF are here
+                return None, stop + 2
+            if buf[stop] != 13 or buf[stop + 1] != 10:
+                raise ProtocolError("bulk string is not terminated by CRLF")
+            # Single copy straight out of the receive buffer
+            args.append(bytes(view[start:stop]))
+            pos = stop + 2
+        return args, pos
+
+    def _parse_inline(self, buf, pos):
+        """
+        Parses a plain-text command such as b'PING\r\n' (what telnet sends).
+        Returns (args, end) on success or (None, needed) if more data is required.
+        """
+        eol = buf.find(b"\n", pos)
+        if eol < 0:
+            if len(buf) - pos > MAX_INLINE_LENGTH:
+                raise ProtocolError("too big inline request")
+            return None, len(buf) + 1
+        return bytes(buf[pos:eol]).split(), eol + 1
+
+
+def _parse_length(buf, start, stop, message):
+    """Parses the decimal number of a '*' or '$' header."""
+    try:
+        return int(buf[start:stop])
+    except ValueError:
+        raise ProtocolError(message) from None
+
+
+def resp_bulk_string(value):
+    """Helper to encode a value as a RESP bulk string."""
+    return b'$' + str(len(value)).encode() + b'\r\n' + value + b'\r\n'
+
+
+def resp_array(items):
+    """
+    Helper to encode a list of values as a RESP array of bulk strings, with
+    None items as nil. The parts are collected first and joined once, so the
+    reply is allocated a single time at its final size instead of being
+    copied again for every item.
+    """
+    parts = [b'*' + str(len(items)).encode() + b'\r\n']
+    append = parts.append
+    for item in items:
+        if item is None:
+            append(b'$-1\r\n')
+        else:
+            append(b'$' + str(len(item)).encode() + b'\r\n')
+            append(item)
+            append(b'\r\n')
+    return b''.join(parts)
+
+
+def resp_integer(number):
+    """Helper to encode a RESP integer."""
+    return b':' + str(number).encode() + b'\r\n'
+
+
+def encode_command(args):
+    """Encodes an argument list as a RESP array of bulk strings, as clients send it."""
+    parts = [b'*' + str(len(args)).encode() + b'\r\n']
+    for arg in args:
+        parts.append(b'$' + str(len(arg)).encode() + b'\r\n')
+        parts.append(arg)
+        parts.append(b'\r\n')
+    return b''.join(parts)
+
+
+def reply_end(buf, pos=0):
+    """
+    Returns the index just past the complete RESP reply that starts at pos,
+    or -1 if the reply has not fully arrived yet. Used to split a stream of
+    replies without decoding them.
+    """
+    eol = buf.find(CRLF, pos)
+    if eol < 0:
+        return -1
+    kind = buf[pos]
+    if kind in b'+-:':
+        return eol + 2
+    length = _parse_length(buf, pos + 1, eol, "invalid reply length")
+    if kind == 36:  # b'$'
+        if length < 0:
+            return eol + 2
+        end = eol + 2 + length + 2
+        return end if end <= len(buf) else -1
+    if kind == 42:  # b'*'
+        pos = eol + 2
+        for _ in range(max(length, 0)):
+            if pos >= len(buf):
+                return -1
+            pos = reply_end(buf, pos)
+            if pos < 0:
+                return -1
+        return pos
+    raise ProtocolError(f"unexpected reply type '{chr(kind)}'")
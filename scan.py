@@ -0,0 +1,177 @@
+"""
+Keyspace iteration for SCAN and KEYS.
+
+A SCAN cursor has to stay valid while keys are added and removed between
+calls. The compact store is a power-of-two hash table, so it is scanned
+the way Redis does it, bucket by bucket in reverse-binary order (see
+CompactStore.scan()). A Python dict does not expose its buckets, so for
+the dict engine KeyLog keeps an append-only list of the keys, filled in as
+keys are created: the cursor is a position in that list, new keys are
+appended behind every cursor and deleted keys leave stale entries that are
+skipped. Either way a key that exists for the whole scan is returned at
+least once, and possibly more than once, which is what Redis promises too.
+
+Copying every key of a large keyspace at once would stall the event loop,
+so the list is never built by a SCAN; stale entries are dropped by a
+compaction that the cron runs a bounded number of entries at a time.
+"""
+import re
+import time
+from functools import lru_cache
+
+# A dict engine cursor is (generation << POSITION_BITS) | position
+POSITION_BITS = 40
+POSITION_MASK = (1 << POSITION_BITS) - 1
+GENERATION_MASK = (1 << (64 - POSITION_BITS)) - 1
+
+# Compact the log once it holds this many more entries than there are keys...
+STALE_ENTRY_SLACK = 1024
+# ...but not while a scan may still be running, as that restarts it
+REBUILD_IDLE_SECONDS = 10
+# Log entries a compaction looks at per cron tick
+COMPACT_ENTRIES_PER_CRON = 20000
+
+MASK_64 = (1 << 64) - 1
+
+# Every byte value with its bits in reverse order, for reverse_bits()
+REVERSED_BYTES = bytes(int(format(byte, "08b")[::-1], 2) for byte in range(256))
+
+GLOB_SPECIAL = frozenset(b"*?[\\")
+
+
+def reverse_bits(value):
+    """value with its 64 bits in reverse order."""
+    return int.from_bytes(value.to_bytes(8, "big").translate(REVERSED_BYTES), "little")
+
+
+def next_cursor(cursor, mask):
+    """
+    The reverse-binary increment Redis uses for SCAN: increments the bits of
+    cursor covered by mask starting from the highest one. After a table
+    grows or shrinks, the buckets already visited map onto buckets that sort
+    before the cursor, so no bucket is skipped (a few may be visited again).
+    Returns 0 once every bucket has been visited.
+    """
+    cursor |= ~mask & MASK_64
+    cursor = reverse_bits(cursor) + 1
+    return reverse_bits(cursor & MASK_64)
+
+
+def is_literal(pattern):
+    """True if pattern contains no glob wildcards, so it can only match itself."""
+    return GLOB_SPECIAL.isdisjoint(pattern)
+
+
+@lru_cache(maxsize=64)
+def compile_glob(pattern):
+    """
+    Compiles a Redis glob pattern (*, ?, [abc], [^a-z], backslash escapes)
+    into a function that returns a true value for the keys it matches.
+    """
+    parts = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i:i + 1]
+        i += 1
+        if c == b"*":
+            parts.append(b".*")
+        elif c == b"?":
+            parts.append(b".")
+        elif c == b"\\" and i < n:
+            parts.append(re.escape(pattern[i:i + 1]))
+            i += 1
+        elif c == b"[":
+            negate = pattern[i:i + 1] == b"^"
+            if negate:
+                i += 1
+            members = []
+            while i < n and pattern[i:i + 1] != b"]":
+                if pattern[i:i + 1] == b"\\" and i + 1 < n:
+                    members.append(re.escape(pattern[i + 1:i + 2]))
+                    i += 2
+                elif i + 2 < n and pattern[i + 1:i + 2] == b"-" and pattern[i + 2:i + 3] != b"]":
+                    low, high = sorted((pattern[i], pattern[i + 2]))
+                    members.append(b"\\x%02x-\\x%02x" % (low, high))
+                    i += 3
+                else:
+                    members.append(re.escape(pattern[i:i + 1]))
+                    i += 1
+            i += 1  # The closing ']'
+            if members:
+                parts.append(b"[" + (b"^" if negate else b"") + b"".join(members) + b"]")
+            else:
+                # [] matches nothing and [^] any character, as in Redis
+                parts.append(b"." if negate else b"(?!)")
+        else:
+            parts.append(re.escape(c))
+    return re.compile(b"".join(parts), re.DOTALL).fullmatch
+
+
+class KeyLog:
+    """Append-only key list that the dict engine is scanned with."""
+
+    def __init__(self):
+        self.keys = []         # Every live key at least once, plus stale entries
+        self.keep_keys = True  # Only the dict engine needs the list
+        self.generation = 0    # Bumped whenever the list is replaced, invalidating cursors
+        self.last_scan = 0.0
+        # Compaction in progress: the live keys copied so far (None when idle),
+        # the same keys as a set so a key that is in the list twice is copied
+        # once, and the position in keys it has reached
+        self.compacted = None
+        self.compacted_keys = None
+        self.compact_position = 0
+
+    def added(self, key):
+        """Called when a new key is stored."""
+        if self.keep_keys:
+            self.keys.append(key)
+
+    def rebuild(self, database):
+        """Called after the keyspace was replaced, e.g. by loading a file."""
+        self.keys = list(database) if self.keep_keys else []
+        self.compacted = self.compacted_keys = None
+        self.generation = (self.generation + 1) & GENERATION_MASK
+
+    def scan(self, database, cursor, count):
+        """Returns (next cursor, keys) after looking at up to count entries from cursor on."""
+        self.last_scan = time.monotonic()
+        if self.compacted is not None:
+            # Finishing would restart this scan; try again once it is idle
+            self.compacted = self.compacted_keys = None
+        position = cursor & POSITION_MASK
+        if cursor >> POSITION_BITS != self.generation:
+            # The list was replaced since this cursor was handed out: start over
+            position = 0
+        keys = self.keys
+        end = min(len(keys), position + count)
+        found = [key for key in keys[position:end] if key in database]
+        if end == len(keys):
+            return 0, found
+        return (self.generation << POSITION_BITS) | end, found
+
+    def cron(self, database):
+        """Compacts the list, a step per call, once it is mostly stale and nobody is scanning."""
+        if self.compacted is None:
+            if (time.monotonic() - self.last_scan > REBUILD_IDLE_SECONDS
+                    and len(self.keys) > 2 * len(database) + STALE_ENTRY_SLACK):
+                self.compacted = []
+                self.compacted_keys = set()
+                self.compact_position = 0
+            return
+        keys = self.keys
+        compacted = self.compacted
+        seen = self.compacted_keys
+        start = self.compact_position
+        # Keys created meanwhile are appended to keys, so they are copied too
+        end = min(len(keys), start + COMPACT_ENTRIES_PER_CRON)
+        for key in keys[start:end]:
+            if key in database and key not in seen:
+                seen.add(key)
+                compacted.append(key)
+        self.compact_position = end
+        if end == len(keys):
+            self.keys = compacted
+            self.compacted = self.compacted_keys = None
+            self.generation = (self.generation + 1) & GENERATION_MASK
@@ -0,0 +1,15 @@
+import os
+import stat
+
+from aof import write_aof_base
+
+
+def test_rewritten_file_gets_umask_permissions(tmp_path):
+    path = tmp_path / "appendonly.aof"
+    old_umask = os.umask(0o022)
+    try:
+        write_aof_base(str(path), {b"key": b"value"}, {})
+    finally:
+        os.umask(old_umask)
+    assert stat.S_IMODE(path.stat().st_mode) == 0o644
+    assert path.read_bytes() == b"*3\r\n$3\r\nSET\r\n$3\r\nkey\r\n$5\r\nvalue\r\n"
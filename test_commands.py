@@ -0,0 +1,51 @@
+import pytest
+
+import keyspace
+import rdb_file_config
+from commands import Command, call_command
+
+
+@pytest.fixture
+def empty_keyspace():
+    keyspace.flush_keyspace()
+    yield
+    keyspace.flush_keyspace()
+
+
+@pytest.mark.parametrize("option, value", [
+    (b"PX", b"0"), (b"PX", b"-5"), (b"PXAT", b"-1"), (b"PX", b"99999999999999999999999"),
+    (b"PXAT", str(1 << 63).encode()), (b"PX", str((1 << 63) - 1).encode()),
+])
+def test_set_rejects_expire_times_outside_int64(empty_keyspace, option, value):
+    assert call_command(None, [b"SET", b"k", b"v", option, value]) == b"-ERR invalid expire time in 'set' command\r\n"
+    assert keyspace.lookup_key(b"k") is None
+
+
+def test_set_px_is_propagated_as_pxat(empty_keyspace):
+    args = [b"SET", b"k", b"v", b"PX", b"10000"]
+    assert call_command(None, args) == b"+OK\r\n"
+    assert args[3] == b"PXAT" and int(args[4]) == keyspace.expiry[b"k"]
+
+
+def test_failed_save_is_reported(empty_keyspace, tmp_path, monkeypatch):
+    monkeypatch.setitem(rdb_file_config.config, b"dir", str(tmp_path).encode())
+    # A TTL write_rdb cannot encode; set_key() would refuse it
+    keyspace.database[b"k"] = b"v"
+    keyspace.expiry[b"k"] = -1
+    assert rdb_file_config.save_command(None, [b"SAVE"]) == b"-ERR Error saving DB on disk\r\n"
+    assert rdb_file_config.persistence["lastsave_ok"] is False
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_handler_exception_becomes_error_reply(capsys):
+    def broken(client, args):
+        raise ValueError("bad\r\nvalue")
+
+    cmd = Command(b'BROKEN', broken, 1, frozenset(['write']), 0, 0, 1)
+    table = {b'BROKEN': cmd}
+    for _ in range(2):
+        assert call_command(None, [b'BROKEN'], table) == (
+            b"-ERR internal error in 'broken' command: ValueError: bad  value\r\n")
+    assert cmd.stats.calls == 2 and cmd.stats.failed_calls == 2
+    # The traceback is logged the first time only
+    assert capsys.readouterr().out.count("Traceback") == 1
@@ -0,0 +1,21 @@
+import pytest
+
+from compact_store import CompactStore
+
+
+@pytest.mark.parametrize("expire_ms", [0, -1, 1 << 63, 99999999999999999999999])
+def test_out_of_range_expire_leaves_the_key_alone(expire_ms):
+    store = CompactStore()
+    store[b"k"] = b"v"
+    with pytest.raises(ValueError, match="out of range"):
+        store.expiry[b"k"] = expire_ms
+    assert store.get(b"k") == b"v"
+    assert store.get_expire(b"k") is None
+    assert store.volatile == 0
+
+
+def test_largest_expire_fits():
+    store = CompactStore()
+    store[b"k"] = b"v"
+    store.expiry[b"k"] = (1 << 63) - 1
+    assert store.get_expire(b"k") == (1 << 63) - 1
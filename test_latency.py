@@ -0,0 +1,47 @@
+import socket
+from types import SimpleNamespace
+
+import commands
+from latency import SlowLog, client_address, slowlog
+
+
+def test_client_address_of_unix_socket_client():
+    # The --workers links between processes are AF_UNIX sockets
+    left, right = socket.socketpair(socket.AF_UNIX)
+    try:
+        client = SimpleNamespace(sock=left)
+        assert client_address(client) == b""
+        slowlog = SlowLog(threshold_usec=0)
+        slowlog.maybe_add(client, [b"GET", b"key"], 5000)
+        assert slowlog.entries[0][4] == b""
+    finally:
+        left.close()
+        right.close()
+
+
+def test_client_address_of_tcp_client():
+    server = socket.create_server(("127.0.0.1", 0))
+    client_sock = socket.create_connection(server.getsockname())
+    accepted, peer = server.accept()
+    try:
+        assert client_address(SimpleNamespace(sock=accepted)) == f"{peer[0]}:{peer[1]}".encode()
+    finally:
+        for sock in (client_sock, accepted, server):
+            sock.close()
+
+
+def test_shrinking_slowlog_keeps_newest_entries():
+    slowlog.reset()
+    slowlog.configure(0, 10)
+    first_id = slowlog.next_id
+    for i in range(10):
+        slowlog.maybe_add(None, [b"SET", b"key%d" % i, b"v"], 1000)
+    try:
+        slowlog.configure(0, 3)
+        reply = commands.slowlog_command(None, [b"SLOWLOG", b"GET", b"-1"])
+        ids = [first_id + 9, first_id + 8, first_id + 7]
+        assert reply.startswith(b"*3\r\n*6\r\n:%d\r\n" % ids[0])
+        assert [entry[0] for entry in slowlog.entries] == ids
+    finally:
+        slowlog.reset()
+        slowlog.configure(10000, 128)
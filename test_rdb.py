@@ -0,0 +1,32 @@
+import os
+import stat
+
+import pytest
+
+from rdb import OPCODE_EOF, TYPE_STRING, RdbError, encode_string, iter_rdb, write_rdb
+
+HEADER = b"REDIS0011"
+
+
+def test_string_keys_are_loaded():
+    image = HEADER + bytes([TYPE_STRING]) + encode_string(b"key") + encode_string(b"value") + bytes([OPCODE_EOF])
+    assert list(iter_rdb(image)) == [(0, b"key", b"value", None)]
+
+
+@pytest.mark.parametrize("value_type", [15, 19, 21])
+def test_stream_records_are_rejected(value_type):
+    # A stream is not a single string: skipping one as such would misparse the rest of the file
+    image = (HEADER + bytes([value_type]) + encode_string(b"stream") + encode_string(b"listpacks")
+             + bytes([TYPE_STRING]) + encode_string(b"key") + encode_string(b"value") + bytes([OPCODE_EOF]))
+    with pytest.raises(RdbError, match=f"unsupported value type {value_type}"):
+        list(iter_rdb(image))
+
+
+def test_saved_file_gets_umask_permissions(tmp_path):
+    path = tmp_path / "dump.rdb"
+    old_umask = os.umask(0o022)
+    try:
+        write_rdb(str(path), {b"key": b"value"}, {})
+    finally:
+        os.umask(old_umask)
+    assert stat.S_IMODE(path.stat().st_mode) == 0o644
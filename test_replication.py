@@ -0,0 +1,65 @@
+import socket
+
+from replication import ONLINE, REPL_SEND_CHUNK, SEND_BULK, WAIT_BGSAVE, Backlog, Leader, Replica
+from resp import encode_command
+
+
+def test_replconf_rejects_non_integer_values():
+    leader = Leader(1024, "unused.rdb")
+    conn = object()
+    assert leader.replconf(conn, [b"REPLCONF", b"listening-port", b"abc"]) == (
+        b"-ERR value is not an integer or out of range\r\n")
+    assert conn not in leader.listening_ports
+    assert leader.replconf(conn, [b"REPLCONF", b"listening-port", b"6380"]) == b"+OK\r\n"
+    assert leader.listening_ports[conn] == 6380
+    # A malformed ACK is dropped without a reply
+    assert leader.replconf(conn, [b"REPLCONF", b"ACK", b"abc"]) == b""
+
+
+class SlowLink:
+    """A follower link that sends nothing until drain() is called."""
+
+    def __init__(self):
+        self.output_limit = 1024
+        self.soft_limit = 0
+        self.closed = False
+        self.queued = []
+        self.sent = b""
+        self.sock = socket.socket()
+
+    @property
+    def output_size(self):
+        return sum(len(data) for data in self.queued)
+
+    def write(self, data):
+        self.queued.append(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        self.sent += b"".join(self.queued)
+        self.queued = []
+
+
+def test_full_sync_streams_the_snapshot(tmp_path):
+    snapshot = bytes(range(256)) * 1024
+    leader = Leader(1024, str(tmp_path / "sync.rdb"))
+    (tmp_path / "sync.rdb").write_bytes(snapshot)
+    link = SlowLink()
+    leader.replicas[link] = Replica(link, WAIT_BGSAVE, 6380)
+    # Replicas are not held to the client output limit
+    assert link.output_limit == 0
+    leader.backlog = Backlog(1024, 0)
+    leader.sync_buffer = [b"before"]
+    leader._finish_sync(True)
+    leader.feed([b"SET", b"k", b"v"])
+    while leader.replicas[link].state == SEND_BULK:
+        # Never more than a chunk of the file waits in memory
+        assert link.output_size <= REPL_SEND_CHUNK + 16
+        link.drain()
+        leader.flush()
+    link.drain()
+    link.sock.close()
+    assert link.sent == b"$%d\r\n" % len(snapshot) + snapshot + b"before" + encode_command([b"SET", b"k", b"v"])
+    assert leader.replicas[link].state == ONLINE
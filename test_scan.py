@@ -0,0 +1,50 @@
+import scan
+from scan import COMPACT_ENTRIES_PER_CRON, KeyLog
+
+
+def scan_all(log, database, count=100):
+    cursor, found = 0, []
+    while True:
+        cursor, keys = log.scan(database, cursor, count)
+        found += keys
+        if cursor == 0:
+            return found
+
+
+def test_keys_are_logged_as_they_are_created():
+    log = KeyLog()
+    database = {}
+    for i in range(250):
+        database[b"k%d" % i] = b"v"
+        log.added(b"k%d" % i)
+    assert sorted(scan_all(log, database)) == sorted(database)
+
+
+def test_compaction_runs_in_bounded_steps(monkeypatch):
+    log = KeyLog()
+    database = {}
+    total = 3 * COMPACT_ENTRIES_PER_CRON
+    for i in range(total):
+        database[b"k%d" % i] = b"v"
+        log.added(b"k%d" % i)
+    # Mostly stale: keep one key in ten
+    for i in range(total):
+        if i % 10:
+            del database[b"k%d" % i]
+    monkeypatch.setattr(scan.time, "monotonic", lambda: log.last_scan + 3600)
+    generation = log.generation
+    log.cron(database)
+    steps = 0
+    while log.compacted is not None:
+        before = log.compact_position
+        # A key deleted and created again while compacting is not copied twice
+        if steps == 1:
+            del database[b"k0"]
+            database[b"k0"] = b"v"
+            log.added(b"k0")
+        log.cron(database)
+        assert log.compact_position - before <= COMPACT_ENTRIES_PER_CRON
+        steps += 1
+    assert steps > 1
+    assert log.generation != generation
+    assert sorted(log.keys) == sorted(database)
@@ -0,0 +1,169 @@
+"""
+MULTI/EXEC/DISCARD/WATCH transactions.
+
+Between MULTI and EXEC a client's commands are checked (known command,
+right number of arguments) and queued instead of run, and each is answered
+with +QUEUED. EXEC runs the whole queue in one loop through call_command()
+and answers with one array of the replies. The event loop is single
+threaded, so no other client's command runs in between. A command that
+could not be queued makes EXEC refuse to run anything, as in Redis.
+
+WATCH is optimistic: keyspace.py keeps a version counter for every watched
+key that every write or removal of the key (expiry and eviction included)
+bumps, and the client remembers the versions it saw. If any of them moved
+by the time of EXEC, the queue is discarded and EXEC replies with a nil
+array so the client can retry.
+
+When a transaction propagates more than one write, the AOF and the
+followers get them wrapped in MULTI and EXEC. load_aof() and the follower
+only run such a block once its EXEC has arrived, so a crash or a dropped
+link never applies half of a transaction.
+"""
+from commands import call_command, lookup_command, write_listeners, wrong_arity
+from keyspace import expire_if_needed, key_version, unwatch_key, watch_key
+
+QUEUED = b"+QUEUED\r\n"
+EXECABORT_ERROR = b"-EXECABORT Transaction discarded because of previous errors.\r\n"
+
+# Run right away inside MULTI instead of being queued
+IMMEDIATE_COMMANDS = frozenset((b"MULTI", b"EXEC", b"DISCARD", b"WATCH"))
+
+
+class ClientState:
+    """The queued commands and watched keys of one client."""
+
+    __slots__ = ("queued", "failed", "watched")
+
+    def __init__(self):
+        self.queued = None     # Commands queued since MULTI; None outside a transaction
+        self.failed = False    # A command could not be queued, so EXEC will refuse to run
+        self.watched = {}      # Watched key -> its version when WATCH ran
+
+
+# State of every client that is in a transaction or watches keys
+clients = {}
+
+
+def in_multi(client):
+    """True if client sent MULTI and its commands are being queued."""
+    state = clients.get(client)
+    return state is not None and state.queued is not None
+
+
+def multi(client):
+    """MULTI: starts queueing the client's commands."""
+    state = clients.get(client)
+    if state is None:
+        state = clients[client] = ClientState()
+    elif state.queued is not None:
+        return b"-ERR MULTI calls can not be nested\r\n"
+    state.queued = []
+    return b"+OK\r\n"
+
+
+def queue(client, args, error=None):
+    """
+    Queues a command for EXEC and returns +QUEUED. A command that cannot
+    run, because it is unknown, has the wrong arity or the caller passes an
+    error for it, is answered with that error and fails the transaction.
+    """
+    state = clients[client]
+    if error is None:
+        cmd = lookup_command(args[0])
+        if cmd is None:
+            error = b"-ERR unknown command\r\n"
+        elif (cmd.arity > 0 and len(args) != cmd.arity) or len(args) < -cmd.arity:
+            error = wrong_arity(cmd.name)
+    if error is not None:
+        state.failed = True
+        return error
+    state.queued.append(args)
+    return QUEUED
+
+
+def watched_key_changed(state):
+    """True if a key the client watches was written or removed since WATCH."""
+    for key, version in state.watched.items():
+        # A key whose TTL ran out counts as changed even if nobody read it since
+        expire_if_needed(key)
+        if key_version(key) != version:
+            return True
+    return False
+
+
+def run_queued(client, queued):
+    """Runs the queued commands and propagates their writes as one block. Returns the replies."""
+    if not write_listeners:
+        return [call_command(client, args) for args in queued]
+    listeners = write_listeners[:]
+    propagated = []
+    write_listeners[:] = [propagated.append]
+    try:
+        replies = [call_command(client, args) for args in queued]
+    finally:
+        write_listeners[:] = listeners
+    if len(propagated) > 1:
+        propagated = [[b"MULTI"], *propagated, [b"EXEC"]]
+    for args in propagated:
+        for listener in listeners:
+            listener(args)
+    return replies
+
+
+def exec_transaction(client):
+    """EXEC: runs the queued commands, unless a command failed to queue or a watched key changed."""
+    state = clients.get(client)
+    if state is None or state.queued is None:
+        return b"-ERR EXEC without MULTI\r\n"
+    queued, failed = state.queued, state.failed
+    changed = not failed and watched_key_changed(state)
+    reset(client)
+    if failed:
+        return EXECABORT_ERROR
+    if changed:
+        return b"*-1\r\n"
+    replies = run_queued(client, queued)
+    return b"*%d\r\n" % len(replies) + b"".join(replies)
+
+
+def discard(client):
+    """DISCARD: drops the queued commands and unwatches every key."""
+    if not in_multi(client):
+        return b"-ERR DISCARD without MULTI\r\n"
+    reset(client)
+    return b"+OK\r\n"
+
+
+def watch(client, keys):
+    """WATCH: remembers the current version of keys for the next EXEC."""
+    state = clients.get(client)
+    if state is None:
+        state = clients[client] = ClientState()
+    elif state.queued is not None:
+        return b"-ERR WATCH inside MULTI is not allowed\r\n"
+    for key in keys:
+        if key not in state.watched:
+            # A key that already expired is gone before we start watching it
+            expire_if_needed(key)
+            state.watched[key] = watch_key(key)
+    return b"+OK\r\n"
+
+
+def unwatch(client):
+    """UNWATCH: forgets the watched keys (the transaction, if any, goes on)."""
+    state = clients.get(client)
+    if state is not None:
+        for key in state.watched:
+            unwatch_key(key)
+        state.watched.clear()
+        if state.queued is None:
+            del clients[client]
+    return b"+OK\r\n"
+
+
+def reset(client):
+    """Leaves the transaction and unwatches everything, e.g. after EXEC or on disconnect."""
+    state = clients.pop(client, None)
+    if state is not None:
+        for key in state.watched:
+            unwatch_key(key)
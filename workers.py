@@ -0,0 +1,208 @@
+"""
+Multi-process mode (--workers N).
+
+The parent creates one Unix-domain listening socket per worker and forks N
+workers. Each worker binds the client port with SO_REUSEPORT, so the kernel
+spreads incoming connections across them, and owns the keys whose hash maps
+to its id. A command whose keys belong to another worker is forwarded over
+that worker's Unix socket as plain RESP, and the reply comes back through a
+DeferredReply so a pipelining client still gets its replies in order.
+Commands without keys (PING, INFO, SAVE, ...) run on whichever worker got
+them and only see that worker's shard.
+"""
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import traceback
+import zlib
+from collections import deque
+
+from commands import lookup_command
+from connection import Connection, DeferredReply
+from resp import encode_command, reply_end
+
+CROSSSLOT_ERROR = b"-CROSSSLOT Keys in request don't hash to the same worker\r\n"
+
+# How many bytes to pull off a worker link per read event
+LINK_RECV_SIZE = 64 * 1024
+
+
+def hash_tag(key):
+    """
+    Returns the part of key that decides its owner. As with Redis Cluster hash
+    tags, only the text inside the first non-empty {...} is hashed, so keys
+    like b'user:{42}:name' and b'user:{42}:email' always live together.
+    """
+    start = key.find(b"{")
+    if start >= 0:
+        end = key.find(b"}", start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+def key_owner(key, num_workers):
+    """Id of the worker that owns key."""
+    return zlib.crc32(hash_tag(key)) % num_workers
+
+
+class PeerLink:
+    """Connection to another worker; replies come back in the order commands were sent."""
+
+    def __init__(self, path, sel):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        sock.setblocking(False)
+        self.conn = Connection(sock, sel, self.read_replies, output_limit=0)
+        self.waiting = deque()
+        self.buffer = bytearray()
+
+    def send(self, client, args):
+        """Queues a command for the peer and returns the DeferredReply it will fill."""
+        reply = DeferredReply(client)
+        self.waiting.append(reply)
+        # Flushed from Cluster.flush() once per event loop iteration
+        self.conn.write(encode_command(args))
+        return reply
+
+    def read_replies(self, conn):
+        """Selector callback: hands each complete reply to the client waiting for it."""
+        try:
+            data = conn.sock.recv(LINK_RECV_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.close()
+            return
+
+        buf = self.buffer
+        buf += data
+        pos = 0
+        clients = set()
+        while pos < len(buf):
+            end = reply_end(buf, pos)
+            if end < 0:
+                break
+            reply = self.waiting.popleft()
+            reply.resolve(bytes(buf[pos:end]))
+            if reply.client is not None:
+                clients.add(reply.client)
+            pos = end
+        del buf[:pos]
+        # One flush per client for the whole batch of replies
+        for client in clients:
+            client.flush()
+
+    def close(self):
+        """Fails every outstanding request and closes the link."""
+        self.conn.close()
+        while self.waiting:
+            reply = self.waiting.popleft()
+            reply.resolve(b"-ERR connection to worker lost\r\n")
+            if reply.client is not None:
+                reply.client.flush()
+
+
+class Cluster:
+    """This worker's view of the key partitioning and its links to the others."""
+
+    def __init__(self, worker_id, num_workers, peer_paths, sel):
+        self.worker_id = worker_id
+        self.num_workers = num_workers
+        self.peer_paths = peer_paths
+        self.sel = sel
+        self.links = {}
+
+    def owns(self, key):
+        """True if this worker owns key."""
+        return key_owner(key, self.num_workers) == self.worker_id
+
+    def route(self, args):
+        """
+        Decides where a command runs. Returns None to run it here, the id of
+        the worker that owns its keys, or -1 if its keys span several workers.
+        """
+        cmd = lookup_command(args[0])
+        if cmd is None or not cmd.first_key:
+            return None
+        keys = cmd.keys(args)
+        if not keys:
+            return None
+        owner = key_owner(keys[0], self.num_workers)
+        for key in keys[1:]:
+            if key_owner(key, self.num_workers) != owner:
+                return -1
+        return None if owner == self.worker_id else owner
+
+    def forward(self, worker_id, client, args):
+        """Sends a command to its owner and returns a DeferredReply for the client."""
+        link = self.links.get(worker_id)
+        if link is None or link.conn.closed:
+            link = self.links[worker_id] = PeerLink(self.peer_paths[worker_id], self.sel)
+        return link.send(client, args)
+
+    def flush(self):
+        """Pushes the commands queued on every link to the other workers."""
+        for link in self.links.values():
+            if link.conn.output:
+                link.conn.flush()
+
+
+def run_workers(num_workers, start_worker):
+    """
+    Forks num_workers processes and waits for them. Each child calls
+    start_worker(worker_id, num_workers, peer_listener, peer_paths), where
+    peer_listener is its Unix socket for forwarded commands. The sockets are
+    all bound before forking so every link can connect immediately.
+    """
+    runtime_dir = tempfile.mkdtemp(prefix="redis-workers-")
+    peer_paths = [os.path.join(runtime_dir, f"worker-{i}.sock") for i in range(num_workers)]
+    listeners = []
+    for path in peer_paths:
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen()
+        listeners.append(listener)
+
+    pids = []
+    for worker_id in range(num_workers):
+        pid = os.fork()
+        if pid == 0:
+            for i, listener in enumerate(listeners):
+                if i != worker_id:
+                    listener.close()
+            status = 0
+            try:
+                start_worker(worker_id, num_workers, listeners[worker_id], peer_paths)
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                traceback.print_exc()
+                status = 1
+            finally:
+                os._exit(status)
+        pids.append(pid)
+    for listener in listeners:
+        listener.close()
+
+    print(f"Started {num_workers} workers: {pids}")
+    # Turn SIGTERM into KeyboardInterrupt so the workers get cleaned up too
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        for pid in pids:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        shutil.rmtree(runtime_dir, ignore_errors=True)